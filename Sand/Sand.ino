@@ -116,17 +116,40 @@ bool paused = false;
 bool baseCalRotating = false;
 
 #define BAUD_RATE 250000
+#define PROTOCOL_VERSION 3 // 2: framed lines and BAUD, 3: telemetry frames (TELEM)
+long currentBaud = BAUD_RATE;
 char serialBuf[64];
 int bufIdx = 0;
+bool lineOverflow = false;
+
+// --- LINE FRAMING ("N<seq> <command>*<xor>") ---
+unsigned long expectedSeq = 0;
+bool seqSynced = false; // The first framed line after boot, CLEAR or PROTO? sets the sequence
+
+// --- TELEMETRY ---
+// "T <theta> <rho> <lines queued> <steps queued> <steps/s> <paused>", off until the host sends TELEM <ms>
+#define TELEMETRY_FRAME_MAX 48          // Skipped while the UART TX buffer has less room than this
+#define TELEMETRY_IDLE_MS 1000          // Heartbeat while nothing is queued or moving
+unsigned long telemetryInterval = 0;
+unsigned long lastTelemetryMs = 0;
+unsigned long stepTicks = 0;            // Step periods run, for the measured step rate
+unsigned long lastTelemetryTicks = 0;
+bool lastTelemetryActive = false;
+bool lastTelemetryPaused = false;
 
 #define EEPROM_MAGIC 0x53414E44 // "SAND" magic signature
 
 // --- PROTOTYPES ---
 void processSerialQueue();
+void handleLine(char* line);
 void handleCommand(char* cmd);
+void requestResend();
+void switchBaud(long rate);
 void processMathPlanner();
 void runStepperEngine();
 IKResult calculateIK(float x, float y, long referenceBaseSteps);
+void forwardKinematics(long baseSteps, long elbowSteps, float* theta, float* rho);
+void sendTelemetry();
 void calibrate();
 void findMagnetCenter(int stepPin, int dirPin, int stopPin); 
 void updateLedMode();
@@ -195,6 +218,7 @@ void loop() {
 
   processMathPlanner();
   updateLedMode();
+  sendTelemetry();
 
   if (baseCalRotating && stepsRemaining == 0) {
     digitalWrite(dirBase, LOW);
@@ -289,6 +313,7 @@ void runStepperEngine() {
 
       stepsRemaining--;
       globalStepCount++;
+      stepTicks++;
     }
   }
 }
@@ -379,6 +404,53 @@ void processMathPlanner() {
   }
 }
 
+// Where the arm is for a pair of step counts: the inverse of calculateIK. Theta is in [-PI, PI].
+void forwardKinematics(long baseSteps, long elbowSteps, float* theta, float* rho) {
+  // Reduce the base to one turn first, so long designs with thousands of windings keep float precision
+  const long baseRevSteps = round((2.0 * PI) * stepsPerRad);
+  float t1 = -(float)(baseSteps % baseRevSteps) / stepsPerRad;
+  float bend = (gearRatio * (float)baseSteps - (float)elbowSteps) / stepsPerRad;
+  float x = L1 * cos(t1) + L2 * cos(t1 + bend);
+  float y = L1 * sin(t1) + L2 * sin(t1 + bend);
+  *rho = hypot(x, y) / tableRadius;
+  *theta = atan2(y, x);
+}
+
+void sendTelemetry() {
+  if (telemetryInterval == 0) return;
+  int localCmdHead, localCmdTail, localStepHead, localStepTail;
+  ATOMIC_BLOCK(ATOMIC_RESTORESTATE) {
+    localCmdHead = cmdHead; localCmdTail = cmdTail;
+    localStepHead = stepHead; localStepTail = stepTail;
+  }
+  // Lines received but not yet fully planned, and micro-segments waiting for the stepper engine
+  int linesQueued = (localCmdHead - localCmdTail + CMD_QUEUE_SIZE) % CMD_QUEUE_SIZE + (hasPendingCmd ? 1 : 0) + (isDrawingLine ? 1 : 0);
+  int stepsQueued = (localStepHead - localStepTail + STEP_QUEUE_SIZE) % STEP_QUEUE_SIZE + (stepsRemaining > 0 ? 1 : 0);
+  bool active = linesQueued > 0 || stepsQueued > 0;
+
+  unsigned long now = millis();
+  unsigned long elapsed = now - lastTelemetryMs;
+  // A frame at once when motion starts/stops or pause changes, then at the interval (slower while idle)
+  bool changed = active != lastTelemetryActive || paused != lastTelemetryPaused;
+  if (!changed && elapsed < (active ? telemetryInterval : max(telemetryInterval, (unsigned long)TELEMETRY_IDLE_MS))) return;
+  // Never block the loop on a full TX buffer: try again on the next pass
+  if (Serial.availableForWrite() < TELEMETRY_FRAME_MAX) return;
+
+  float theta, rho;
+  forwardKinematics(curBaseSteps, curElbowSteps, &theta, &rho);
+  unsigned long ticks = stepTicks - lastTelemetryTicks;
+  Serial.print(F("T ")); Serial.print(theta, 4);
+  Serial.print(' '); Serial.print(rho, 4);
+  Serial.print(' '); Serial.print(linesQueued);
+  Serial.print(' '); Serial.print(stepsQueued);
+  Serial.print(' '); Serial.print(elapsed > 0 ? ticks * 1000UL / elapsed : 0UL);
+  Serial.print(' '); Serial.println(paused ? 1 : 0);
+  lastTelemetryMs = now;
+  lastTelemetryTicks = stepTicks;
+  lastTelemetryActive = active;
+  lastTelemetryPaused = paused;
+}
+
 IKResult calculateIK(float x, float y, long referenceBaseSteps) {
   float dist = hypot(x, y);
   const float maxReach = L1 + L2;
@@ -404,15 +476,87 @@ void processSerialQueue() {
     if (c == '\n' || c == '\r') {
       if (bufIdx > 0) {
         serialBuf[bufIdx] = '\0';
-        handleCommand(serialBuf);
+        // Never act on a truncated line: framed lines are resent, plain ones reported
+        if (!lineOverflow) handleLine(serialBuf);
+        else if (serialBuf[0] == 'N') requestResend();
+        else Serial.println(F("ERR: LINE_TOO_LONG"));
         bufIdx = 0;
       }
+      lineOverflow = false;
     } else if (bufIdx < 63) {
       serialBuf[bufIdx++] = c;
+    } else {
+      lineOverflow = true;
     }
   }
 }
 
+void requestResend() {
+  if (seqSynced) { Serial.print(F("RS ")); Serial.println(expectedSeq); }
+  else Serial.println(F("ERR: CHECKSUM")); // No sequence yet, the host resends on its ack timeout
+}
+
+// Framed lines carry a sequence number and the XOR of every byte before the '*'.
+// Plain lines (terminal, LEDs, PAUSE/RESUME/CLEAR, older hosts) go straight to handleCommand.
+void handleLine(char* line) {
+  if (line[0] != 'N' || !isdigit(line[1])) { handleCommand(line); return; }
+
+  char* star = strrchr(line, '*');
+  char* end;
+  unsigned long seq = strtoul(line + 1, &end, 10);
+  byte sum = 0;
+  for (char* p = line; star != NULL && p < star; p++) sum ^= (byte)*p;
+  if (star == NULL || *end != ' ' || !isdigit(star[1]) || sum != (byte)atoi(star + 1)) {
+    requestResend();
+    return;
+  }
+
+  if (!seqSynced) { expectedSeq = seq; seqSynced = true; }
+  if (seq > expectedSeq) { requestResend(); return; } // A line went missing
+  if (seq < expectedSeq) {
+    // Already executed: the host resent it because our answer was lost or is still pending
+    if (seq + 1 == expectedSeq && (hasPendingCmd || owesSyncOK)) return;
+    Serial.println(F("OK"));
+    return;
+  }
+  expectedSeq++;
+  *star = '\0';
+  handleCommand(end + 1);
+}
+
+// Moves the UART to a new rate, keeping it only if the host's PING arrives within a second
+void switchBaud(long rate) {
+  long previous = currentBaud;
+  Serial.flush();
+  Serial.end();
+  Serial.begin(rate);
+  char buf[8];
+  int n = 0;
+  unsigned long start = millis();
+  while (millis() - start < 1000) {
+    runStepperEngine();
+    if (Serial.available() > 0) {
+      char c = Serial.read();
+      if (c == '\n' || c == '\r') {
+        buf[n] = '\0';
+        if (strcmp(buf, "PING") == 0) {
+          currentBaud = rate;
+          bufIdx = 0; lineOverflow = false;
+          Serial.println(F("PONG"));
+          return;
+        }
+        n = 0;
+      } else if (n < 7) {
+        buf[n++] = c;
+      }
+    }
+  }
+  Serial.end();
+  Serial.begin(previous);
+  bufIdx = 0; lineOverflow = false;
+  Serial.println(F("BAUD_REVERT"));
+}
+
 void handleCommand(char* cmd) {
   char* start = cmd;
   while (*start == ' ' || *start == '\t') start++;
@@ -439,10 +583,10 @@ void handleCommand(char* cmd) {
     stepsRemaining = 0;
     isDrawingLine = false; owesSyncOK = false;
     hasPendingCmd = false;
+    seqSynced = false;
     
-    // Retain physical motor step position so new commands start seamlessly from current arm position
-    float curX = (curElbowSteps / stepsPerRad); // Approximate current position
-    planTheta = atan2(curX, 1.0);
+    // Re-plan from where the arm physically stopped, so new commands start from its real position
+    forwardKinematics(curBaseSteps, curElbowSteps, &planTheta, &planRho);
     planBaseSteps = curBaseSteps;
     planElbowSteps = curElbowSteps;
     
@@ -490,6 +634,28 @@ void handleCommand(char* cmd) {
   else if (strcasecmp(start, "SYNC") == 0) {
     owesSyncOK = true;
   }
+  else if (strcasecmp(start, "PROTO?") == 0) {
+    // A (re)connecting host starts its sequence again at 0: the UART does not reset the board
+    seqSynced = false;
+    Serial.print(F("PROTO ")); Serial.print(PROTOCOL_VERSION);
+    Serial.print(F(" BAUD ")); Serial.println(currentBaud);
+  }
+  else if (strncasecmp(start, "BAUD ", 5) == 0) {
+    long rate = atol(start + 5);
+    if (rate == 250000 || rate == 500000 || rate == 1000000) {
+      Serial.print(F("BAUD_OK ")); Serial.println(rate);
+      switchBaud(rate);
+    } else {
+      Serial.println(F("ERR: BAUD"));
+    }
+  }
+  else if (strncasecmp(start, "TELEM ", 6) == 0) {
+    long ms = atol(start + 6);
+    telemetryInterval = (ms <= 0) ? 0 : max(20L, ms);
+    lastTelemetryMs = millis(); lastTelemetryTicks = stepTicks;
+    lastTelemetryActive = !lastTelemetryActive; // Counts as a change: the first frame goes out right away
+    Serial.print(F("TELEM_OK ")); Serial.println(telemetryInterval);
+  }
   else if (strncasecmp(start, "SPEED ", 6) == 0) {
     float newMult = atof(start + 6);
     if (newMult >= 0.1 && newMult <= 10.0) {
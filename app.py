@@ -1,36 +1,94 @@
-from flask import Flask, render_template, request, jsonify, Response, url_for, send_from_directory, redirect
-import serial, threading, time, subprocess, sys
+import time
+STARTUP_T0 = time.monotonic()  # Start of the startup timing report (includes imports)
+from flask import Flask, render_template, request, jsonify, Response, url_for, send_from_directory, send_file, redirect
+import serial, threading, subprocess, sys
 import os
 import re
 import socket
 import json
 import datetime
-import shutil
 import math
+import queue
+import mimetypes
 from collections import deque
 import wifi_tools 
-from pyngrok import ngrok, conf 
-try:
-    import thumbnailer
-except ImportError:
-    thumbnailer = None
-    print("Warning: thumbnailer.py or its dependencies (Pillow) not found. Thumbnails will be disabled.")
+import kinematics
+import design_store
+import firmware_build
+import static_assets
+import serial_recorder
+import serial_protocol
+
+# Optional subsystems are imported on first use so the web server comes up faster
+thumbnailer = None  # None = not loaded yet, False = unavailable
+patterns = None
+design_analysis = None
+
+def get_thumbnailer():
+    global thumbnailer
+    if thumbnailer is None:
+        try:
+            import thumbnailer as thumbnailer_module
+            thumbnailer = thumbnailer_module
+        except ImportError:
+            thumbnailer = False
+            print("Warning: thumbnailer.py or its dependencies (Pillow) not found. Thumbnails will be disabled.")
+    return thumbnailer or None
+
+def get_patterns():
+    global patterns
+    if patterns is None:
+        try:
+            import patterns as patterns_module
+            patterns = patterns_module
+        except ImportError:
+            patterns = False
+            print("Warning: numpy not found. Server-side pattern generators will be disabled.")
+    return patterns or None
+
+def get_design_analysis():
+    global design_analysis
+    if design_analysis is None:
+        try:
+            import design_analysis as design_analysis_module
+            design_analysis = design_analysis_module
+        except ImportError:
+            design_analysis = False
+            print("Warning: numpy not found. Design analysis will be disabled.")
+    return design_analysis or None
+
+def get_ngrok():
+    from pyngrok import ngrok, conf
+    return ngrok, conf
 
 
 app = Flask(__name__)
 app.secret_key = 'your_super_secret_key' 
+app.config['MAX_CONTENT_LENGTH'] = 64 * 1024 * 1024  # Hard cap on any request body
 
 # === CONFIGURATION ===
 BASE_DIR = app.root_path
 DESIGNS_FOLDER = os.path.join(BASE_DIR, 'templates', 'designs')
 SCHEDULE_FILE = os.path.join(BASE_DIR, 'schedules.json')
 SETTINGS_FILE = os.path.join(BASE_DIR, 'settings.json')
+JOURNAL_FILE = os.path.join(BASE_DIR, 'journal.json')
+JOURNAL_SPOOL = os.path.join(BASE_DIR, 'journal_spool')
+PATTERN_CACHE = os.path.join(BASE_DIR, 'pattern_cache')
+RECORDINGS_FOLDER = os.path.join(BASE_DIR, 'recordings')
 ARDUINO_PROJECT_PATH = os.path.join(BASE_DIR, 'Sand') 
 
 # Default Settings
 DEFAULT_SETTINGS = {
     "cooldown": 30,
-    "speed": 1.0
+    "speed": 1.0,
+    "resume_after_calibration": True,
+    "record_serial": False, # Capture all serial traffic for replay (serial_recorder.py)
+    "max_baud": 1000000,    # Highest rate tried at connect; 250000 disables negotiation
+    "server_threads": 8,    # Waitress worker threads (size with loadtest.py)
+    "auto_erase": False,    # Erase the next design's footprint before drawing it (queue and loop)
+    "erase_margin_mm": 10.0,
+    "erase_pitch_mm": 3.0,
+    "telemetry_ms": 100     # Firmware position/queue frames while moving (0 = off); needs protocol v3
 }
 
 # Load Settings Helper
@@ -52,6 +110,7 @@ def save_app_settings(data):
 
 # Initialize Global Settings
 SYSTEM_SETTINGS = load_app_settings()
+design_index = design_store.DesignIndex(DESIGNS_FOLDER)
 
 # === UTILITIES ===
 def find_available_port():
@@ -65,18 +124,6 @@ def find_available_port():
                 continue
     return 5000 
 
-def find_arduino_port():
-    # Priority for Hardware UART (RX/TX on pins 8/10)
-    ports = [
-        '/dev/serial0', '/dev/ttyAMA0', '/dev/ttyS0', # Hardware UART (RX/TX)
-        '/dev/ttyUSB0', '/dev/ttyUSB1',               # USB Serial (CH340/FTDI)
-        '/dev/ttyACM0', '/dev/ttyACM1'                # USB CDC (Uno/Mega/Leo)
-    ]
-    for p in ports:
-        if os.path.exists(p):
-            return p
-    return None
-
 def get_current_ip():
     try:
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -85,176 +132,43 @@ def get_current_ip():
     except: ip = '127.0.0.1'
     return ip
 
-# === STATE MANAGEMENT ===
-job_queue = deque()      
-loop_playlist = []       
-is_looping = False       
-is_paused = False        
-is_waiting = False       
-is_calibrating = False   
-calibration_done = False 
-skip_cooldown = False    
-
-current_theta = 0.0
-current_rho = 0.0
-
-current_job_name = None  
-next_job_name = None     
-
+# === LOGGING ===
 serial_log = []
-lock = threading.Lock()
+log_lock = threading.Lock()
 
 def log_message(msg):
     timestamp = time.strftime("[%H:%M:%S] ")
-    with lock:
+    with log_lock:
         serial_log.append(timestamp + msg)
         if len(serial_log) > 200:
             serial_log.pop(0)
 
 # === SERIAL CONNECTION ===
-arduino = None
-arduino_connected = False
-current_gcode_runner = None
-arduino_port = "/dev/ttyUSB0" # Default
-
-def send_speed_to_arduino():
-    global arduino_connected
-    if arduino_connected:
-        spd = SYSTEM_SETTINGS.get("speed", 1.0)
-        cmd = f"SPEED {spd}\n"
-        with lock: arduino.write(cmd.encode())
-        log_message(f"Sent initial speed: {spd}")
-
-def connect_arduino():
-    global arduino, arduino_connected, arduino_port
-    try:
-        port = find_arduino_port()
-        if not port:
-            raise Exception("No serial port found (UART or USB)")
-        
-        arduino_port = port
-        # Updated to 250000 baud per request
-        arduino = serial.Serial(port, 250000, timeout=0.1) 
-        time.sleep(2) 
-        arduino_connected = True
-        threading.Thread(target=read_from_serial, daemon=True).start()
-        log_message(f"Arduino Connected: {port} @ 250000")
-        print(f"Connected to Arduino on {port}")
-        
-        # Send current speed setting
-        send_speed_to_arduino()
-    except Exception as e:
-        arduino_connected = False
-        print(f"WARNING: Arduino not connected: {e}") 
-        log_message(f"Arduino Init Failed: {e}")
-
-# === PERSISTENT LED HELPER ===
-def send_led_persistent(r, g, b):
-    """Sends RGB values to Arduino via Serial."""
-    if arduino_connected:
-        try:
-            cmd = f"{r},{g},{b}\n"
-            with lock: arduino.write(cmd.encode())
-            log_message(f"LED Serial: {r},{g},{b}")
+def wait_for_ready(ser, port, timeout=3.0):
+    """Replaces a fixed post-open sleep: returns as soon as the firmware is listening.
+    USB boards reset when the port opens, so wait for the SAND_TABLE_READY banner.
+    The Pi's hardware UART doesn't reset the board, so probe with SYNC and wait for its OK."""
+    auto_resets = 'ttyUSB' in port or 'ttyACM' in port
+    if not auto_resets:
+        ser.reset_input_buffer()
+        ser.write(b"SYNC\n")
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        line = ser.readline().decode(errors="ignore").strip()
+        if "SAND_TABLE_READY" in line or (not auto_resets and line == "OK"):
             return True
-        except Exception as e:
-            log_message(f"LED Serial Error: {e}")
-    else:
-        log_message("LED Fail: Arduino not connected.")
     return False
 
-# === SCHEDULER ===
-def load_schedules():
-    if not os.path.exists(SCHEDULE_FILE): return []
-    try:
-        with open(SCHEDULE_FILE, 'r') as f: return json.load(f)
-    except: return []
-
-def save_schedules(data):
-    with open(SCHEDULE_FILE, 'w') as f: json.dump(data, f)
-
-def hex_to_rgb(hex_val):
-    hex_val = hex_val.lstrip('#')
-    return tuple(int(hex_val[i:i+2], 16) for i in (0, 2, 4))
-
-class SchedulerThread(threading.Thread):
-    def __init__(self):
-        super().__init__(daemon=True)
-        self.last_minute_checked = None
-
-    def run(self):
-        log_message("Scheduler Service Started")
-        while True:
-            now = datetime.datetime.now()
-            current_time = now.strftime("%H:%M") 
-            current_day = now.strftime("%a")     
-            
-            if self.last_minute_checked != current_time:
-                self.last_minute_checked = current_time
-                self.check_triggers(current_time, current_day)
-            
-            time.sleep(5) 
-
-    def check_triggers(self, time_str, day_str):
-        schedules = load_schedules()
-        for item in schedules:
-            if item['time'] == time_str and day_str in item['days']:
-                self.execute_action(item)
-
-    def execute_action(self, item):
-        global is_looping, loop_playlist, is_paused
-        action = item['type']
-        val = item.get('value')
-        log_message(f"Scheduler Trigger: {action}")
-
-        if action == "led_off":
-            # UPDATED: Set Color to Black (Serial)
-            send_led_persistent(0, 0, 0)
-        
-        elif action == "led_on":
-            # Set Color to White (Full)
-            send_led_persistent(255, 255, 255)
-        
-        elif action == "led_color" and val:
-            try:
-                r, g, b = hex_to_rgb(val)
-                # UPDATED: Use Serial Sender
-                send_led_persistent(r, g, b)
-            except: pass
-            
-        elif action == "stop_sand":
-            # UPDATED: 'Stop' button logic changed to PAUSE per request
-            is_paused = True
-            if arduino_connected:
-                with lock: arduino.write(b"PAUSE\n")
-            log_message("Automation: Sand Table Paused.")
-
-        elif action == "resume_sand":
-            is_paused = False
-            if arduino_connected:
-                with lock: arduino.write(b"RESUME\n")
-            log_message("Automation: Sand Table Resumed.")
-
-        elif action == "sand_shuffle":
-            try:
-                files = [f for f in os.listdir(DESIGNS_FOLDER) if f.endswith('.txt')]
-                if files:
-                    import random
-                    random.shuffle(files)
-                    loop_playlist = files
-                    is_looping = True
-                    log_message(f"Scheduler: Loop started with {len(files)} designs.")
-                    if current_gcode_runner is None or not current_gcode_runner.is_alive():
-                        process_queue(wait_enabled=False)
-            except Exception as e: log_message(str(e))
-        elif action == "sand_specific" and val:
-            path = os.path.join(DESIGNS_FOLDER, val)
-            if os.path.exists(path):
-                with open(path, 'r') as f: gcode = f.read()
-                if is_waiting or (current_gcode_runner and current_gcode_runner.is_alive()):
-                    job_queue.append({'gcode': gcode, 'filename': val})
-                else:
-                    start_job({'gcode': gcode, 'filename': val})
+def find_link_rate(ser, port):
+    """The Pi's UART doesn't reset the board, so firmware an earlier run moved to a faster rate
+    is still there. Probes the faster rates; returns the one that answered, or None."""
+    if 'ttyUSB' in port or 'ttyACM' in port: return None
+    for rate in serial_protocol.BAUD_LADDER:
+        if rate == serial_protocol.BASE_BAUD: continue
+        ser.baudrate = rate
+        if wait_for_ready(ser, port, timeout=1.0): return rate
+    ser.baudrate = serial_protocol.BASE_BAUD
+    return None
 
 # === THETA-RHO RUNNER ===
 def generate_transition_path(from_theta, from_rho, to_theta, to_rho, steps=20):
@@ -294,73 +208,222 @@ def generate_transition_path(from_theta, from_rho, to_theta, to_rho, steps=20):
 
     return waypoints
 
+def load_job_text(job):
+    """Text jobs carry their design; library jobs are a reference loaded only when prepared."""
+    if 'gcode' in job: return job['gcode']
+    return design_store.read_design(job['ref'])
+
+def library_job(filename):
+    """Validates a library filename and returns a lightweight by-reference job, or None."""
+    if not filename or not design_store.is_design(filename): return None
+    path = design_store.resolve_design(DESIGNS_FOLDER, filename)
+    if not path:
+        # A duplicate that was collapsed: its name now points to the copy that was kept
+        canonical = design_index.alias_of(os.path.basename(filename))
+        if canonical:
+            filename = canonical
+            path = design_store.resolve_design(DESIGNS_FOLDER, canonical)
+    if not path or not os.path.abspath(path).startswith(os.path.abspath(DESIGNS_FOLDER)): return None
+    return {'filename': os.path.basename(filename), 'ref': path}
+
+def text_job(gcode, filename):
+    """Job for design text (sketch / AI exports). Text drawing the same as a library design plays
+    that design by reference; text identical to an already queued job shares its copy."""
+    h = design_store.text_hash(gcode or "")
+    if h:
+        name = design_index.find_hash(h)
+        job = library_job(name) if name else None
+        if job:
+            log_message(f"{filename} is the same drawing as {name}, playing it from the library")
+            return job
+        for table in list(tables.values()):
+            for queued in list(table.job_queue):
+                if queued.get('hash') == h and 'gcode' in queued:
+                    job = {'gcode': queued['gcode'], 'filename': filename, 'hash': h}
+                    if 'spool' in queued: job['spool'] = queued['spool']
+                    return job
+    return {'gcode': gcode, 'filename': filename, 'hash': h}
+
+PREFETCH_WINDOW = 64  # Lines pre-encoded so the first serial writes need no work
+ACK_RESEND = 2.0      # Seconds without an ack before a framed line is sent again
+MAX_PARTIAL_LINE = 4096  # Bytes of an unterminated reply kept across read timeouts
+TELEMETRY_STALE = 3.0    # Seconds after which the last telemetry frame no longer counts (idle frames come every 1 s)
+TELEMETRY_SETTLE = 0.5   # Seconds a job start waits for the frame saying the arm has stopped
+
+class PreparedJob:
+    """A job parsed and planned ahead of time so a runner can start streaming immediately."""
+    def __init__(self, job_data, from_theta, from_rho, start_line=0):
+        self.job = job_data
+        self.filename = job_data['filename']
+        self.key = None
+        if 'pattern' in job_data:
+            # Generated patterns stream from a cached point array, nothing to parse
+            design = get_patterns().pattern_lines(job_data['pattern'], PATTERN_CACHE)
+        else:
+            # Parse lines, stripping comments and keeping non-empty lines
+            design = [l for l in map(design_store.normalize_line, load_job_text(job_data).split('\n')) if l]
+
+        # Resume support: skip lines already drawn before a crash/restart
+        self.design_lines = len(design)
+        self.start_line = min(max(0, start_line), self.design_lines)
+        self.design = design[self.start_line:]
+
+        if isinstance(self.design, list):
+            points = [p for p in (kinematics.parse_point(l) for l in self.design) if p]
+            self.start_position = points[0] if points else None
+            self.end_position = points[-1] if points else None
+            self.estimate = kinematics.estimate_seconds(points, SYSTEM_SETTINGS.get('speed', 1.0))
+        else:
+            self.start_position, self.end_position = self.design.endpoints()
+            self.estimate = self.design.estimate_seconds(SYSTEM_SETTINGS.get('speed', 1.0))
+
+        self.erase = None       # (pitch_mm, margin_mm) once a footprint erase is planned
+        self.footprint = None
+        self.erase_info = None
+        self.from_position = None
+        self.plan_transition(from_theta, from_rho)
+
+    def design_points(self):
+        if isinstance(self.design, list):
+            return [p for p in map(kinematics.parse_point, self.design) if p]
+        return self.design.data
+
+    def enable_erase(self, pitch_mm, margin_mm):
+        """Erases only where this design will draw (plus a margin) before drawing it. Requires numpy."""
+        pt = get_patterns()
+        if not pt or not self.start_position or self.erase == (pitch_mm, margin_mm): return
+        self.footprint = pt.footprint(self.design_points(), pitch_mm, margin_mm)
+        self.erase = (pitch_mm, margin_mm)
+        from_position, self.from_position = self.from_position, None
+        self.plan_transition(*from_position)
+
+    def plan_transition(self, from_theta, from_rho):
+        """(Re)builds the lead-in from the given position. Cheap: only the transition changes."""
+        if self.from_position == (from_theta, from_rho): return
+        self.from_position = (from_theta, from_rho)
+        lead_in = []
+        self.erase_info = None
+        if self.erase:
+            pt = get_patterns()
+            path = pt.erase_path(self.footprint, self.erase[0], from_theta, from_rho)
+            if len(path):
+                speed = SYSTEM_SETTINGS.get('speed', 1.0)
+                lead_in = generate_transition_path(from_theta, from_rho, *map(float, path[0])) + list(pt.PatternLines(path))
+                from_theta, from_rho = map(float, path[-1])
+                self.erase_info = {"lines": len(path), "estimate": round(pt.estimate_seconds(path, speed)),
+                                   "full_estimate": round(pt.full_erase_seconds(self.erase[0], speed))}
+        # Prepend a straight-line transition from current position to design start
+        if self.start_position:
+            lead_in += generate_transition_path(from_theta, from_rho, *self.start_position)
+        self.transition_len = len(lead_in)
+        self.lines = lead_in + self.design if lead_in else self.design
+        self.encoded_head = [(l + "\n").encode() for l in self.lines[:PREFETCH_WINDOW]]
+
 class GCodeRunner(threading.Thread):
-    def __init__(self, gcode_block, filename, on_complete=None):
+    def __init__(self, prepared, table, on_complete=None, on_phase=None):
         super().__init__(daemon=True)
-        # Parse lines, stripping comments and keeping non-empty lines
-        self.lines = [l.split('#')[0].strip() for l in gcode_block.split('\n') if l.split('#')[0].strip()]
-
-        # Prepend a straight-line transition from current position to design start
-        if self.lines:
-            first_line = self.lines[0].split()
-            if len(first_line) >= 2:
-                try:
-                    target_theta = float(first_line[0])
-                    target_rho = float(first_line[1])
-                    transition = generate_transition_path(
-                        current_theta, current_rho, target_theta, target_rho
-                    )
-                    if transition:
-                        self.lines = transition + self.lines
-                except (ValueError, IndexError):
-                    pass
+        self.prepared = prepared
+        self.table = table
+        self.lines = prepared.lines
+        self.design_lines = prepared.design_lines
+        self.start_line = prepared.start_line
+        self.transition_len = prepared.transition_len
+        self.end_position = prepared.end_position
+        self.job = prepared.job
 
         self.total_lines = len(self.lines)
-        self.filename = filename
+        self.filename = prepared.filename
         self.is_running = True
         self.on_complete = on_complete
+        self.on_phase = on_phase    # Called with DRAWING after the lead-in, SYNCING before the final SYNC
         self.ARDUINO_BUFFER_SIZE = 1 # Simple 1-line-at-a-time for Theta-Rho
         self.credits = self.ARDUINO_BUFFER_SIZE
         self.lines_sent = 0
+        self.lines_drawn = None  # From telemetry: lines the firmware has finished with; None without it
+        self.last_seq = None  # Sequence number of the last framed line, for resends
         self.slot_available_event = threading.Event()
         self.pause_event = threading.Event()
         self.pause_event.set()
 
+    def stop(self):
+        """Stops streaming now: wakes the runner wherever it waits (pause, ack, SYNC)."""
+        self.is_running = False
+        self.pause_event.set()
+        self.slot_available_event.set()
+
+    def phase(self, state):
+        if self.on_phase: self.on_phase(self, state)
+
+    def lines_done(self):
+        """Lines the arm has drawn as far as the host knows: from telemetry, else everything sent."""
+        drawn = self.lines_drawn
+        return self.lines_sent if drawn is None else min(drawn, self.lines_sent)
+
+    def on_telemetry(self, frame):
+        # Lines sent minus the ones the firmware still holds; never goes backwards
+        drawn = max(0, self.lines_sent - frame["lines_queued"])
+        if self.lines_drawn is None or drawn > self.lines_drawn: self.lines_drawn = drawn
+
+    def design_offset(self):
+        """Index of the next design line to draw, ignoring the lead-in transition."""
+        return self.start_line + max(0, self.lines_done() - self.transition_len)
+
     def process_incoming_serial(self, line):
         clean_line = line.strip().upper()
         if clean_line == "OK" or clean_line == "RGB_OK":
-            with lock:
+            with self.table.lock:
                 if self.credits < self.ARDUINO_BUFFER_SIZE: self.credits += 1
                 self.slot_available_event.set() 
 
     def send_line(self, line):
-        global current_theta, current_rho
+        table = self.table
         try:
             # Basic parsing for state tracking: line format is usually "THETA RHO"
             parts = line.strip().split()
             if len(parts) >= 2:
                 try:
-                    current_theta = float(parts[0])
-                    current_rho = float(parts[1])
+                    table.current_theta = float(parts[0])
+                    table.current_rho = float(parts[1])
                 except: pass
 
-            log_message(f"TX (Runner): {line}")
-            with lock: arduino.write((line + "\n").encode())
+            table.log(f"TX (Runner): {line}")
+            head = self.prepared.encoded_head
+            if table.link.framed:
+                payload, self.last_seq = table.link.encode(line)
+            else:
+                payload = head[self.lines_sent] if self.lines_sent < len(head) else (line + "\n").encode()
+            table.write(payload)
             self.lines_sent += 1
             self.credits -= 1 
             return True
         except Exception as e:
-            log_message(f"SERIAL ERROR: {e}")
+            table.log(f"SERIAL ERROR: {e}")
             self.is_running = False
             return False
 
+    def wait_for_ack(self, timeout=10.0):
+        """Waits for the firmware to take the last line. A framed line is sent again every
+        ACK_RESEND seconds meanwhile, which also recovers an ack lost to line noise
+        (the firmware re-acks duplicates instead of executing them twice)."""
+        deadline = time.monotonic() + timeout
+        while self.is_running:
+            left = deadline - time.monotonic()
+            if left <= 0: return False
+            if self.slot_available_event.wait(timeout=min(ACK_RESEND, left)): return True
+            if self.last_seq is not None and self.is_running:
+                for data in self.table.link.resend_from(self.last_seq, reason='timeout'): self.table.write(data)
+        return False
+
     def run(self):
-        global current_gcode_runner, current_job_name, is_paused
-        current_gcode_runner = self
-        current_job_name = self.filename
-        is_paused = False
+        table = self.table
+        table.runner = self
+        table.current_job_name = self.filename
+        table.is_paused = False
 
-        log_message(f"Job Started: {self.filename}")
+        table.log(f"Job Started: {self.filename} (est. {int(self.prepared.estimate)}s)")
+        erase = self.prepared.erase_info
+        if erase: table.log(f"Erasing footprint first: {erase['lines']} lines, est. {erase['estimate']}s (full erase {erase['full_estimate']}s)")
+        table.schedule_prefetch()
 
         while self.is_running and self.lines_sent < self.total_lines:
             if not self.pause_event.is_set():
@@ -369,152 +432,1132 @@ class GCodeRunner(threading.Thread):
                     break
             if self.credits <= 0:
                 self.slot_available_event.clear()
-                if not self.slot_available_event.wait(timeout=10.0): break
+                if self.credits <= 0 and not self.wait_for_ack(): break
             if self.is_running:
                 if not self.send_line(self.lines[self.lines_sent]): break
-                time.sleep(0.002)
+                if self.lines_sent == self.transition_len: self.phase(DRAWING)
 
-        if self.is_running:
-            while self.credits < self.ARDUINO_BUFFER_SIZE:
-                time.sleep(0.2)
-                if not self.is_running: break
+        while self.is_running and self.credits < self.ARDUINO_BUFFER_SIZE:
+            self.slot_available_event.clear()
+            if self.credits < self.ARDUINO_BUFFER_SIZE and not self.wait_for_ack(): break
 
         if self.is_running:
-            log_message("Waiting for Arduino to finish all moves (SYNC)...")
-            with lock: arduino.write(b"SYNC\n")
+            self.phase(SYNCING)
+            table.log("Waiting for Arduino to finish all moves (SYNC)...")
+            payload, self.last_seq = table.link.encode("SYNC")
             self.credits = 0
-            self.slot_available_event.clear()
-            if not self.slot_available_event.wait(timeout=120.0):
-                log_message("SYNC timeout - Arduino may still be moving")
+            self.slot_available_event.clear()  # Before the write, so a fast OK is not lost
+            table.write(payload)
+            if not self.wait_for_ack(timeout=120.0):
+                table.log("SYNC timeout - Arduino may still be moving")
 
-        current_job_name = None
-        current_gcode_runner = None
+        table.current_job_name = None
+        table.runner = None
         if self.on_complete: self.on_complete()
 
-def on_job_finished(): process_queue(wait_enabled=True)
+# === JOB LIFECYCLE ===
+IDLE, TRANSITION, DRAWING, SYNCING, COOLDOWN = "idle", "transition", "drawing", "syncing", "cooldown"
+JOB_HISTORY = 100  # Transitions kept per table
+
+def cooldown_seconds():
+    try: return max(0, int(SYSTEM_SETTINGS.get('cooldown', 30)))
+    except (ValueError, TypeError): return 30
+
+class JobController(threading.Thread):
+    """Owns one table's job lifecycle as a state machine:
 
-def process_queue(wait_enabled=True):
-    global current_job_name, is_looping, is_waiting, is_paused, skip_cooldown
+        idle -> transition (lead-in / erase) -> drawing -> syncing -> cooldown -> transition ... -> idle
 
-    # Prevent multiple overlapping queue processors
-    if current_gcode_runner and current_gcode_runner.is_alive(): return
-    if is_waiting and wait_enabled: return
+    Everything that can change it (jobs queued, skip, pause, resume, stop, a runner reaching
+    the next phase or finishing) is posted as an event. The thread sleeps on a condition until
+    the next event or the cooldown deadline, so commands act within milliseconds, and it is
+    the only place runners are started, so two can never overlap."""
+    def __init__(self, table):
+        super().__init__(daemon=True)
+        self.table = table
+        self.cond = threading.Condition()
+        self.events = deque()
+        self.state = IDLE
+        self.since = time.time()
+        self.deadline = None      # Monotonic end of the cooldown
+        self.remaining = None     # Cooldown left while paused
+        self.stopping = False     # CLEAR sent; the running job ends as stopped
+        self.history = deque(maxlen=JOB_HISTORY)
+
+    def post(self, event, **data):
+        with self.cond:
+            self.events.append((event, data))
+            self.cond.notify()
+
+    def busy(self):
+        """A job is running or cooling down, or one is about to start."""
+        with self.cond: return self.state != IDLE or any(e in ('wake', 'start') for e, _ in self.events)
+
+    def status(self):
+        left = None
+        if self.state == COOLDOWN:
+            left = self.remaining if self.deadline is None else max(0.0, self.deadline - time.monotonic())
+        return {"state": self.state, "since": round(self.since, 3),
+                "cooldown_left": round(left, 1) if left is not None else None}
+
+    def enter(self, state, detail=None):
+        now = time.time()
+        self.history.append({"time": round(now, 3), "from": self.state, "to": state, "detail": detail})
+        self.state, self.since = state, now
+        events.publish("job", dict(self.status(), detail=detail), table_id=self.table.id)
 
-    def run_queue():
-        global is_waiting, skip_cooldown, is_looping, is_paused
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.events:
+                    if self.deadline is not None and time.monotonic() >= self.deadline: break
+                    self.cond.wait(None if self.deadline is None else self.deadline - time.monotonic())
+                event, data = self.events.popleft() if self.events else ('deadline', {})
+            try:
+                getattr(self, 'on_' + event)(**data)
+            except Exception as e:
+                self.table.log(f"Job controller error ({event}): {e}")
+
+    # --- Events ---
+    def on_wake(self, skip=False):
+        """Jobs were queued or the playlist changed."""
+        t = self.table
+        if self.state == IDLE or (self.state == COOLDOWN and skip):
+            self.start_next()
+        elif self.state == COOLDOWN and not t.has_next():
+            self.deadline = self.remaining = None
+            self.enter(IDLE, "nothing left to play")
+            t.log("Queue empty.")
+
+    def on_skip(self):
+        if self.state == COOLDOWN: self.start_next()
+
+    def on_deadline(self):
+        self.deadline = None
+        if self.state == COOLDOWN: self.start_next()
+
+    def on_start(self, job, start_line=0):
+        """Plays a specific job now (resume after a restart). Ignored while another one runs."""
+        if self.state in (IDLE, COOLDOWN): self.launch(job, None, start_line)
+
+    def on_pause(self):
+        t = self.table
+        t.is_paused = True
+        runner = t.runner
+        if runner: runner.pause_event.clear()
+        if t.connected: t.write(b"PAUSE\n")
+        if self.state == COOLDOWN and self.deadline is not None:
+            # A paused cooldown doesn't count down
+            self.remaining, self.deadline = max(0.0, self.deadline - time.monotonic()), None
+        self.history.append({"time": round(time.time(), 3), "from": self.state, "to": self.state, "detail": "paused"})
+
+    def on_resume(self):
+        t = self.table
+        t.is_paused = False
+        runner = t.runner
+        if runner: runner.pause_event.set()
+        if t.connected: t.write(b"RESUME\n")
+        if self.state == COOLDOWN and self.remaining is not None:
+            self.deadline, self.remaining = time.monotonic() + self.remaining, None
+        self.history.append({"time": round(time.time(), 3), "from": self.state, "to": self.state, "detail": "resumed"})
+
+    def on_stop(self):
+        """CLEAR: drop the queue and playlist, stop the runner and the firmware's queued moves."""
+        t = self.table
+        t.is_looping = False; t.loop_playlist = []; t.job_queue.clear(); t.is_paused = False
+        runner = t.runner
+        if runner: runner.stop()
+        if t.connected: t.write(b"CLEAR\nRESUME\n")
+        self.deadline = self.remaining = None
+        if self.state == COOLDOWN or (not runner and self.state != IDLE): self.enter(IDLE, "cleared")
+        elif runner: self.stopping = True
+        # A running job ends through on_done, which finds nothing left to play
+
+    def on_phase(self, runner, state):
+        if runner is self.table.runner and self.state != state: self.enter(state)
+
+    def on_done(self, runner):
+        t = self.table
+        stopped, self.stopping = self.stopping, False
+        if self.state == IDLE: return  # Stopped and already idle
+        t.check_link()
+        if stopped:
+            t.current_job_name = None
+            if t.connected: t.write(b"PAUSE\n")
+            self.enter(IDLE, "stopped")
+        elif not t.connected:
+            self.enter(IDLE, "disconnected")
+        elif t.has_next():
+            wait = cooldown_seconds()
+            t.log(f"Cooling down for {wait}s...")
+            t.write(b"PAUSE\n")
+            if t.is_paused: self.deadline, self.remaining = None, float(wait)
+            else: self.deadline, self.remaining = time.monotonic() + wait, None
+            self.enter(COOLDOWN, f"{wait}s")
+        else:
+            t.log("Queue empty.")
+            t.current_job_name = None
+            if t.connected: t.write(b"PAUSE\n")
+            self.enter(IDLE, "queue empty")
+
+    # --- Transitions ---
+    def start_next(self):
+        self.deadline = self.remaining = None
+        job, prepared = self.table.next_job()
+        if job or prepared:
+            self.table.plan_erase(prepared)
+            self.launch(job, prepared)
+        else:
+            t = self.table
+            t.log("Queue empty.")
+            t.current_job_name = None
+            if t.connected: t.write(b"PAUSE\n")
+            self.enter(IDLE, "queue empty")
+
+    def launch(self, job, prepared, start_line=0):
+        t = self.table
+        if not t.connected:
+            self.enter(IDLE, "disconnected")
+            return
+        t.settle_position()
+        if prepared is None:
+            prepared = PreparedJob(job, t.current_theta, t.current_rho, start_line)
+        else:
+            # Arm may not be where the prefetcher expected (CLEAR, manual moves): re-plan the lead-in only
+            prepared.plan_transition(t.current_theta, t.current_rho)
+        if t.jogger: t.jogger.cancel()  # Acks belong to the runner from here on
+        t.write(b"RESUME\n")
+        runner = GCodeRunner(prepared, t, on_complete=lambda: self.post('done', runner=runner),
+                             on_phase=lambda r, state: self.post('phase', runner=r, state=state))
+        t.runner = runner
+        self.enter(TRANSITION if prepared.transition_len else DRAWING, prepared.filename)
+        runner.start()
+        journal_wake.set()
+
+# === JOG CHANNEL ===
+JOG_MIN_INTERVAL = 0.05  # Seconds between jog moves (20 Hz max)
+JOG_DEADMAN = 0.6        # Seconds without a jog request before a move in progress is stopped
+JOG_ACK_TIMEOUT = 5.0    # Give up on a move's acks after this long so the channel can't wedge
+
+class JogThread(threading.Thread):
+    """Latest-wins jog sender for one table. Only the newest target is kept; it is sent once the
+    previous move has finished (move + SYNC, one move in flight), so stale moves never pile up
+    in the firmware queue. If the client goes quiet mid-move the arm is stopped."""
+    def __init__(self, table):
+        super().__init__(daemon=True)
+        self.table = table
+        self.cond = threading.Condition()
+        self.target = None
+        self.session = None  # Page that sent the last jog; seq ordering applies within one page
+        self.seq = -1
+        self.last_seen = 0
+        self.in_flight = False
+        self.acks_pending = 0
+        self.ack_deadline = 0
+        self.last_sent = 0
+
+    def submit(self, theta, rho, seq=None, session=None):
+        """Replaces the pending target. Returns False for a request that arrived out of order."""
+        with self.cond:
+            if session != self.session:
+                # Another page (or a reload) numbers its jogs from 1 again
+                self.session = session
+                self.seq = -1
+            if seq is not None:
+                if seq <= self.seq: return False
+                self.seq = seq
+            self.target = (theta, rho)
+            self.last_seen = time.monotonic()
+            self.cond.notify()
+        return True
+
+    def release(self):
+        """Client let go: drop the pending target, the move in flight is short and finishes."""
+        with self.cond:
+            self.target = None
+            self.last_seen = 0
+            self.seq = -1
+
+    def cancel(self):
+        with self.cond:
+            self.target = None
+            self.last_seen = 0
+            self.seq = -1
+            self.in_flight = False
+            self.acks_pending = 0
+
+    def on_line(self, line):
+        if line.strip().upper() != "OK": return
+        with self.cond:
+            if self.acks_pending > 0:
+                self.acks_pending -= 1
+                if self.acks_pending == 0:
+                    self.in_flight = False
+                    self.cond.notify()
+                    events.publish("jog", self.event("idle"), table_id=self.table.id)
+
+    def event(self, state):
+        theta, rho = self.table.position()
+        return {"table": self.table.id, "state": state, "seq": self.seq, "theta": theta, "rho": rho}
 
-        if wait_enabled:
-            is_waiting = True
+    def run(self):
+        table = self.table
+        while True:
+            with self.cond:
+                active = self.target or self.in_flight or self.last_seen
+                self.cond.wait(timeout=JOG_MIN_INTERVAL if active else 1.0)
+                now = time.monotonic()
+                if self.in_flight and now > self.ack_deadline:
+                    self.in_flight = False
+                    self.acks_pending = 0
+                stalled = self.last_seen and now - self.last_seen > JOG_DEADMAN
+                move = None
+                if stalled:
+                    moving = self.in_flight
+                    self.target = None
+                    self.last_seen = 0
+                    self.seq = -1
+                    self.in_flight = False
+                    self.acks_pending = 0
+                elif self.target and not self.in_flight and now - self.last_sent >= JOG_MIN_INTERVAL:
+                    move, self.target = self.target, None
+                    self.in_flight = True
+                    self.acks_pending = 2
+                    self.ack_deadline = now + JOG_ACK_TIMEOUT
+                    self.last_sent = now
             try:
-                # Robust type handling for cooldown setting
-                raw_cd = SYSTEM_SETTINGS.get('cooldown', 30)
-                if raw_cd is None or raw_cd == "":
-                    wait_time = 30
-                else:
-                    wait_time = int(raw_cd)
-            except (ValueError, TypeError):
-                wait_time = 30
-
-            log_message(f"Cooling down for {wait_time}s...")
-            if arduino_connected:
-                with lock: arduino.write(b"PAUSE\n")
-
-            # Wait loop with early exit checks
-            elapsed = 0
-            while elapsed < wait_time:
-                if skip_cooldown: break
-                if not is_looping and len(job_queue) == 0: break
-
-                # If paused during cooldown, don't count down
-                if not is_paused:
-                    elapsed += 1
-
-                time.sleep(1)
-
-            is_waiting = False
-            skip_cooldown = False
-
-        # Find the next job AFTER the wait
-        next_job = None
-        if len(job_queue) > 0: 
-            next_job = job_queue.popleft()
-        elif is_looping and len(loop_playlist) > 0:
-            next_file = loop_playlist.pop(0)
-            loop_playlist.append(next_file) 
+                if stalled:
+                    if moving and table.connected:
+                        # Dead-man: client went quiet mid-move, drop whatever the firmware has queued
+                        table.write(b"CLEAR\nRESUME\n")
+                        table.log("Jog stopped: client went quiet")
+                        table.settle_position()  # Report where the arm halted, not the target it never reached
+                        events.publish("jog", self.event("stopped"), table_id=table.id)
+                elif move:
+                    table.current_theta, table.current_rho = move
+                    table.write(f"{move[0]:.4f} {move[1]:.4f}\nSYNC\n".encode())
+                    events.publish("jog", self.event("moving"), table_id=table.id)
+            except Exception as e:
+                table.log(f"Jog error: {e}")
+                self.cancel()
+
+# === TABLES ===
+SERIAL_PORTS = [
+    '/dev/serial0', '/dev/ttyAMA0', '/dev/ttyS0', # Hardware UART (RX/TX on pins 8/10)
+    '/dev/ttyUSB0', '/dev/ttyUSB1',               # USB Serial (CH340/FTDI)
+    '/dev/ttyACM0', '/dev/ttyACM1'                # USB CDC (Uno/Mega/Leo)
+]
+FLASH_PORT = '/dev/ttyS0'  # avrdude flashes the table on the UART (reset via GPIO18)
+
+def find_arduino_ports():
+    """Every candidate port in priority order; aliases (serial0 -> ttyAMA0/ttyS0) are collapsed."""
+    found, seen = [], set()
+    for p in SERIAL_PORTS:
+        if os.path.exists(p):
+            real = os.path.realpath(p)
+            if real not in seen:
+                seen.add(real)
+                found.append(p)
+    return found
+
+class TableController:
+    """One serial-attached table: its link, runner, queue, playlist, calibration state and position.
+    Each table has its own serial lock, so a busy table never holds up the others."""
+    def __init__(self, port):
+        self.port = port
+        self.id = os.path.basename(port) if port else "none"
+        self.arduino = None
+        self.connected = False
+        self.lock = threading.Lock()
+        self.link = serial_protocol.Link()
+        self.runner = None
+
+        self.job_queue = deque()
+        self.loop_playlist = []
+        self.is_looping = False
+        self.is_paused = False
+        self.is_calibrating = False
+        self.calibration_done = False
+        self.jobs = JobController(self)  # Started with the serial reader
+
+        self.current_theta = 0.0    # Last position sent
+        self.current_rho = 0.0
+        self.current_job_name = None
+        self.telemetry = None       # Last firmware telemetry frame, theta unwrapped, with its arrival time
+        self.arm_idle = threading.Event()  # Set while telemetry says nothing is queued or moving
+
+        self.prefetch_lock = threading.Lock()
+        self.prefetched = None      # PreparedJob for whatever the job controller will pick next
+        self.pending_resume = None  # Journal state waiting for calibration
+
+        self.jogger = None          # JogThread, started on the first jog
+        self.jog_lock = threading.Lock()
+        self.raster = None          # thumbnailer.ProgressRaster of the current/last job
+        self.raster_runner = None
+        self.raster_sent = 0
+        self.render_lock = threading.Lock()
+
+    def log(self, msg):
+        log_message(f"[{self.id}] {msg}" if len(tables) > 1 else msg)
+
+    def write(self, data):
+        with self.lock: self.arduino.write(data)
+
+    @property
+    def is_waiting(self):
+        return self.jobs.state == COOLDOWN
+
+    def is_busy(self):
+        return self.jobs.busy()
+
+    def status(self):
+        return {
+            "id": self.id,
+            "port": self.port,
+            "connected": self.connected,
+            "playing": design_store.design_stem(self.current_job_name) if self.current_job_name else None,
+            "queue_count": len(self.job_queue),
+            "is_looping": self.is_looping,
+            "is_paused": self.is_paused,
+            "is_waiting": self.is_waiting,
+            "job": self.jobs.status(),
+            "is_calibrating": self.is_calibrating,
+            "calibration_done": self.calibration_done,
+            "link": self.link.status()
+        }
+
+    def get_jogger(self):
+        with self.jog_lock:
+            if self.jogger is None:
+                self.jogger = JogThread(self)
+                self.jogger.start()
+            return self.jogger
+
+    def render_live(self):
+        """Brings the live raster up to the runner's progress by drawing only the new lines.
+        Returns True if the image changed."""
+        tn = get_thumbnailer()
+        if not tn: return False
+        with self.render_lock:
+            runner = self.runner
+            changed = False
+            if runner is not None and runner is not self.raster_runner:
+                # New job: start a fresh image
+                if self.raster is None: self.raster = tn.ProgressRaster()
+                else: self.raster.reset()
+                self.raster_runner, self.raster_sent = runner, 0
+                changed = True
+            runner = self.raster_runner
+            if runner is None: return changed
+            sent = runner.lines_done()  # Lines the arm has drawn, not just sent, when telemetry is on
+            if sent > self.raster_sent:
+                new_lines = runner.lines[self.raster_sent:sent]
+                self.raster_sent = sent
+                changed = self.raster.add_points([p for p in map(kinematics.parse_point, new_lines) if p]) or changed
+            return changed
+
+    # --- Serial link ---
+    def open_port(self):
+        """Opens the port and waits for the firmware. Returns True if it answered the handshake."""
+        self.arduino = None
+        self.link = serial_protocol.Link()
+        try:
+            # Opens at 250000 baud; negotiate() moves to a faster rate if the firmware supports it
+            self.arduino = serial.Serial(self.port, serial_protocol.BASE_BAUD, timeout=0.1)
+            if not wait_for_ready(self.arduino, self.port):
+                rate = find_link_rate(self.arduino, self.port)
+                if not rate: return False
+                self.link.baud = rate
+                self.log(f"Firmware was still at {rate} baud")
             try:
-                with open(os.path.join(DESIGNS_FOLDER, next_file), 'r') as f: 
-                    next_job = {'gcode': f.read(), 'filename': next_file}
+                serial_protocol.negotiate(self.arduino, self.link, serial_protocol.port_reader(self.arduino),
+                                          int(SYSTEM_SETTINGS.get('max_baud', 1000000)), self.log)
             except Exception as e:
-                log_message(f"Error reading loop file: {e}")
-                # Use a small delay before retrying to prevent CPU spinning on error
-                time.sleep(1)
-                process_queue(wait_enabled=False)
-                return
+                self.log(f"Protocol negotiation failed, using plain lines: {e}")
+                self.link.framed = False
+            return True
+        except Exception as e:
+            print(f"WARNING: Arduino not connected on {self.port}: {e}")
+            log_message(f"Arduino Init Failed on {self.port}: {e}")
+            return False
 
-        if next_job:
-            start_job(next_job)
+    def start(self):
+        self.connected = True
+        threading.Thread(target=self.read_from_serial, daemon=True).start()
+        if not self.jobs.is_alive(): self.jobs.start()
+        self.log(f"Arduino Connected: {self.port} @ {self.link.baud}")
+        print(f"Connected to Arduino on {self.port}")
+        if SYSTEM_SETTINGS.get('record_serial'): self.set_recording(True)
+        # Send current speed setting
+        self.send_speed()
+        self.send_telemetry_rate()
+
+    def connect(self):
+        if not self.open_port() and self.arduino:
+            self.log("Arduino did not answer the ready handshake, continuing anyway")
+        if self.arduino: self.start()
+
+    def disconnect(self):
+        self.connected = False
+        if self.arduino: self.arduino.close()
+
+    def set_recording(self, enabled):
+        """Starts/stops capturing every TX/RX line to recordings/<table>-<time>.srec."""
+        with self.lock:
+            recording = isinstance(self.arduino, serial_recorder.RecordingSerial)
+            if not self.arduino or recording == enabled: return
+            if enabled:
+                path = os.path.join(RECORDINGS_FOLDER, f"{self.id}-{time.strftime('%Y%m%d-%H%M%S')}.srec")
+                recorder = serial_recorder.RingRecorder(path)
+                recorder.note(f"{self.port} @ {self.link.baud}")
+                self.arduino = serial_recorder.RecordingSerial(self.arduino, recorder)
+                serial_recorder.prune_recordings(RECORDINGS_FOLDER)
+            else:
+                self.arduino.recorder.close()
+                self.arduino = self.arduino.ser
+        self.log(f"Serial recording {'started: ' + os.path.basename(path) if enabled else 'stopped'}")
+
+    def send_speed(self):
+        if self.connected:
+            spd = SYSTEM_SETTINGS.get("speed", 1.0)
+            self.write(f"SPEED {spd}\n".encode())
+            self.log(f"Sent initial speed: {spd}")
+
+    def send_telemetry_rate(self):
+        if self.connected and self.link.version >= serial_protocol.TELEMETRY_VERSION:
+            try: ms = max(0, int(SYSTEM_SETTINGS.get('telemetry_ms', 100)))
+            except (ValueError, TypeError): ms = 100
+            self.write(f"TELEM {ms}\n".encode())
+            if not ms: self.telemetry = None
+
+    def on_telemetry(self, frame):
+        """A telemetry frame: the arm's real position (from its step counters) and the firmware's queues."""
+        last = self.telemetry
+        # Firmware theta is wrapped; continue from the last known theta (the arm turns far less than pi per frame)
+        ref = last["theta"] if last else self.current_theta
+        frame["theta"] = ref + (frame["theta"] - ref + math.pi) % (2 * math.pi) - math.pi
+        frame["time"] = time.monotonic()
+        self.telemetry = frame
+        if frame["lines_queued"] or frame["steps_queued"]: self.arm_idle.clear()
+        else: self.arm_idle.set()
+        runner = self.runner
+        if runner: runner.on_telemetry(frame)
+
+    def live_telemetry(self):
+        t = self.telemetry
+        return t if t and time.monotonic() - t["time"] < TELEMETRY_STALE else None
+
+    def position(self):
+        """(theta, rho) where the arm really is when telemetry is live, else the last position sent."""
+        t = self.live_telemetry()
+        return (t["theta"], t["rho"]) if t else (self.current_theta, self.current_rho)
+
+    def settle_position(self):
+        """Before planning a lead-in: wait briefly for the arm to stop (after CLEAR it stops wherever
+        it was), then plan from where it actually is rather than from the last line sent."""
+        if not self.live_telemetry(): return
+        if not self.arm_idle.wait(TELEMETRY_SETTLE): return
+        t = self.live_telemetry()
+        if t: self.current_theta, self.current_rho = t["theta"], t["rho"]
+
+    def send_led(self, r, g, b):
+        """Sends RGB values to Arduino via Serial."""
+        if self.connected:
+            try:
+                self.write(f"{r},{g},{b}\n".encode())
+                self.log(f"LED Serial: {r},{g},{b}")
+                return True
+            except Exception as e:
+                self.log(f"LED Serial Error: {e}")
         else:
-            log_message("Queue empty.")
-            current_job_name = None
-            if arduino_connected:
-                with lock: arduino.write(b"PAUSE\n")
-            is_waiting = False
-
-    # Run the queue processor in a separate thread if it's going to wait
-    if wait_enabled:
-        threading.Thread(target=run_queue, daemon=True).start()
-    else:
-        run_queue()
-
-def start_job(job_data):
-    if not arduino_connected: return
-    # Ensure is_waiting is False when a job starts
-    global is_waiting
-    is_waiting = False
-    with lock: arduino.write(b"RESUME\n") 
-    GCodeRunner(job_data['gcode'], job_data['filename'], on_complete=on_job_finished).start()
-
-def read_from_serial():
-    global current_gcode_runner, is_calibrating, calibration_done
-    while arduino_connected:
-        try:
-            if arduino.in_waiting > 0:
-                line = arduino.readline().decode(errors="ignore").strip()
+            self.log("LED Fail: Arduino not connected.")
+        return False
+
+    def check_link(self):
+        """Drops to a lower baud rate, between jobs, when retransmits and garbled replies climb."""
+        if not self.connected or not self.link.should_fall_back(): return
+        with self.lock:
+            self.link.negotiating = True
+            try: serial_protocol.fall_back(self.arduino, self.link, serial_protocol.queue_reader(self.link), self.log)
+            except Exception as e: self.log(f"Baud fallback failed: {e}")
+            finally: self.link.negotiating = False
+
+    def read_from_serial(self):
+        partial = b""
+        while self.connected:
+            try:
+                # Blocks until a line arrives or the port times out (0.1 s): replies are handled the moment they land
+                raw = self.arduino.readline()
+                if not raw: continue
+                if not raw.endswith(b"\n"):
+                    # Timed out mid-line: keep the start for the next read
+                    partial = (partial + raw)[-MAX_PARTIAL_LINE:]
+                    continue
+                raw, partial = partial + raw, b""
+                if self.link.framed and serial_protocol.is_garbled(raw):
+                    self.link.rx_error()
+                    continue
+                line = raw.decode(errors="ignore").strip()
+                if line and self.link.negotiating:
+                    self.link.replies.put(line)
+                    continue
+                if line.startswith("T "):
+                    # Telemetry arrives several times a second: parsed into live state, never logged
+                    frame = serial_protocol.parse_telemetry(line)
+                    if frame:
+                        self.on_telemetry(frame)
+                        continue
+                if line.startswith("RS ") and self.link.framed:
+                    # The firmware rejected a line (checksum, truncated, gap): send from there again
+                    try: seq = int(line.split()[1])
+                    except (IndexError, ValueError): continue
+                    resend = self.link.resend_from(seq)
+                    self.log(f"Resend requested from line {seq} ({len(resend)} lines)")
+                    for data in resend: self.write(data)
+                    continue
                 if line:
-                    log_message(f"Ard: {line}")
+                    self.log(f"Ard: {line}")
                     if "STATUS:CALIBRATING" in line:
-                        is_calibrating = True
-                        calibration_done = False
-                        log_message("Calibration Started...")
+                        self.is_calibrating = True
+                        self.calibration_done = False
+                        self.log("Calibration Started...")
                     if "CALIBRATION_COMPLETE" in line:
-                        is_calibrating = False
-                        calibration_done = True
-                        current_theta = 0.0
-                        current_rho = 1.0
-                        log_message("CALIBRATION COMPLETE! Position set to 0, 1")
-                    
+                        self.is_calibrating = False
+                        self.calibration_done = True
+                        self.current_theta = 0.0
+                        self.current_rho = 1.0
+                        self.telemetry = None
+                        self.log("CALIBRATION COMPLETE! Position set to 0, 1")
+                    if "CALIBRATION_CENTERED" in line:
+                        # Firmware follows calibration with an automatic "0 0" move
+                        self.is_calibrating = False
+                        self.calibration_done = True
+                        self.current_theta = 0.0
+                        self.current_rho = 0.0
+                        self.telemetry = None
+                        self.log("CALIBRATION COMPLETE! Position set to 0, 0")
+                    if self.calibration_done and self.pending_resume and "CALIBRATION_" in line:
+                        threading.Thread(target=self.resume_from_journal, daemon=True).start()
+
                     if "ZERO_SAVED" in line:
-                        current_theta = 0.0
-                        current_rho = 0.0
-                        log_message("Origin Saved! Position set to 0, 0")
-                    
-                    if current_gcode_runner: current_gcode_runner.process_incoming_serial(line)
-            else: time.sleep(0.01) 
-        except Exception: 
-            time.sleep(1) # RETRY on error
+                        self.current_theta = 0.0
+                        self.current_rho = 0.0
+                        self.telemetry = None
+                        self.log("Origin Saved! Position set to 0, 0")
+
+                    runner = self.runner
+                    if runner: runner.process_incoming_serial(line)
+                    elif self.jogger: self.jogger.on_line(line)
+            except Exception: 
+                time.sleep(1) # RETRY on error
+
+    # --- Queue ---
+    def has_next(self):
+        return bool(self.job_queue) or (self.is_looping and bool(self.loop_playlist))
+
+    def next_job(self):
+        """Takes the next queue/loop job and reads it (usually already done by the prefetcher).
+        Returns (job, prepared), or (None, None) when there is nothing playable; a design that
+        can't be read is logged and skipped, and every entry gets at most one try per call."""
+        for _ in range(len(self.job_queue) + len(self.loop_playlist)):
+            job = prepared = None
+            if self.job_queue:
+                job = self.job_queue.popleft()
+                prepared = self.take_prefetched(job)
+            elif self.is_looping and self.loop_playlist:
+                next_file = self.loop_playlist.pop(0)
+                self.loop_playlist.append(next_file)
+                prepared = self.take_prefetched(next_file)
+                if not prepared:
+                    job = library_job(next_file) or {'filename': next_file, 'ref': os.path.join(DESIGNS_FOLDER, next_file)}
+            else:
+                break
+            if prepared: return job, prepared
+            # By-reference jobs are read here, so a missing/corrupt file is caught before starting
+            try:
+                return job, PreparedJob(job, self.current_theta, self.current_rho)
+            except Exception as e:
+                self.log(f"Error reading design {job.get('filename')}: {e}")
+        return None, None
+
+    def plan_erase(self, prepared):
+        """Adds the optional footprint erase to a job the job controller is about to start."""
+        if not prepared or not SYSTEM_SETTINGS.get('auto_erase') or prepared.start_line: return
+        try:
+            prepared.enable_erase(float(SYSTEM_SETTINGS.get('erase_pitch_mm', 3.0)),
+                                  float(SYSTEM_SETTINGS.get('erase_margin_mm', 10.0)))
+        except Exception as e:
+            self.log(f"Erase planning failed: {e}")
+
+    def submit_job(self, job):
+        """Queues the job; the job controller starts it now if the table is idle."""
+        busy = self.is_busy()
+        self.job_queue.append(job)
+        if busy: self.schedule_prefetch()
+        self.jobs.post('wake')
+        return "Queued" if busy else f"Started {job['filename']}"
+
+    # --- Next-job prefetch ---
+    def prefetch_next_job(self):
+        """Reads, parses and plans the next queue/loop job while the current one draws."""
+        try:
+            runner = self.runner
+            from_pos = runner.end_position if runner and runner.end_position else (self.current_theta, self.current_rho)
+            if self.job_queue:
+                job = self.job_queue[0]
+                key = ('queue', id(job))
+            elif self.is_looping and self.loop_playlist:
+                job = None
+                fname = self.loop_playlist[0]
+                key = ('loop', fname, os.path.getmtime(os.path.join(DESIGNS_FOLDER, fname)))
+            else:
+                return
+            with self.prefetch_lock:
+                p = self.prefetched
+                if p and p.key == key and p.from_position == from_pos: return
+            if job is None:
+                job = library_job(fname)
+            prepared = PreparedJob(job, *from_pos)
+            prepared.key = key
+            self.plan_erase(prepared)
+            with self.prefetch_lock:
+                self.prefetched = prepared
+            self.log(f"Prefetched next job: {prepared.filename} ({len(prepared.lines)} lines)")
+        except Exception as e:
+            self.log(f"Prefetch failed: {e}")
+
+    def schedule_prefetch(self):
+        threading.Thread(target=self.prefetch_next_job, daemon=True).start()
+
+    def take_prefetched(self, match):
+        """Returns the prefetched job if it is for `match` (a queued job dict or loop filename)."""
+        with self.prefetch_lock:
+            p, self.prefetched = self.prefetched, None
+        if not p: return None
+        if isinstance(match, dict):
+            return p if p.job is match else None
+        try:
+            mtime = os.path.getmtime(os.path.join(DESIGNS_FOLDER, match))
+        except OSError:
+            return None
+        return p if p.key == ('loop', match, mtime) else None
+
+    def repoint_designs(self, removed, keep):
+        """Points queued, prefetched and looped references to collapsed duplicates at the kept copy.
+        Queue entries are updated in place, so a prefetched job (which holds the same dict) follows."""
+        job = library_job(keep)
+        if not job: return
+        for queued in list(self.job_queue):
+            if 'ref' in queued and queued.get('filename') in removed: queued.update(job)
+        with self.prefetch_lock:
+            p = self.prefetched
+            if p and p.filename in removed: p.filename = keep
+        self.loop_playlist = [keep if f in removed else f for f in self.loop_playlist]
+
+    # --- Journal ---
+    def journal_snapshot(self):
+        runner = self.runner
+        active = None
+        if runner and runner.is_alive() and runner.job:
+            active = dict(job_ref(runner.job), offset=runner.design_offset())
+        elif self.pending_resume:
+            # Nothing resumed yet (waiting for calibration): keep the old checkpoint alive
+            active = self.pending_resume.get('active')
+        return {
+            "active": active,
+            "queue": [job_ref(j) for j in list(self.job_queue)],
+            "loop_playlist": list(self.loop_playlist),
+            "is_looping": self.is_looping
+        }
+
+    def restore(self, state):
+        for ref in state.get('queue', []):
+            job = load_job_ref(ref)
+            if job: self.job_queue.append(job)
+        self.loop_playlist = [j['filename'] for j in map(library_job, state.get('loop_playlist', [])) if j]
+        self.is_looping = bool(state.get('is_looping')) and len(self.loop_playlist) > 0
+        if state.get('active') or self.job_queue or self.is_looping:
+            self.pending_resume = state
+            active = state.get('active')
+            self.log(f"Journal restored: {len(self.job_queue)} queued, {len(self.loop_playlist)} in loop" +
+                     (f", {active['filename']} at line {active.get('offset', 0)} waiting for calibration" if active else ""))
+
+    def resume_from_journal(self):
+        state, self.pending_resume = self.pending_resume, None
+        if not state: return
+        active = state.get('active')
+        if active:
+            job = load_job_ref(active)
+            if job:
+                offset = max(0, int(active.get('offset', 0)) - RESUME_REWIND)
+                self.log(f"Resuming {job['filename']} from line {offset}")
+                self.jobs.post('start', job=job, start_line=offset)
+                return
+        self.jobs.post('wake')
+
+tables = {}                        # id -> TableController, in port priority order
+OFFLINE_TABLE = TableController(None)  # Answers status requests while no table is connected
+
+def default_table():
+    return next(iter(tables.values()), OFFLINE_TABLE)
+
+def connect_tables():
+    """Probes every candidate port in parallel; ports whose firmware answers become tables.
+    Ports already driven by a table are skipped, so this can be re-run to pick up new tables."""
+    in_use = {os.path.realpath(t.port) for t in tables.values()}
+    ports = [p for p in find_arduino_ports() if os.path.realpath(p) not in in_use]
+    if not ports:
+        if not tables:
+            print("WARNING: Arduino not connected: No serial port found (UART or USB)")
+            log_message("Arduino Init Failed: No serial port found (UART or USB)")
+        return
+    candidates = [TableController(p) for p in ports]
+    answered = {}
+    def probe(c): answered[c.port] = c.open_port()
+    threads = [threading.Thread(target=probe, args=(c,), daemon=True) for c in candidates]
+    for t in threads: t.start()
+    for t in threads: t.join()
+
+    found = [c for c in candidates if answered.get(c.port)]
+    if not found and not tables:
+        # Nothing answered: keep the highest-priority port, as the single-table setup always did
+        found = [c for c in candidates if c.arduino][:1]
+        for c in found: log_message(f"Arduino did not answer the ready handshake on {c.port}, continuing anyway")
+    for c in candidates:
+        if c not in found and c.arduino: c.arduino.close()
+    for c in found: tables[c.id] = c
+    for c in found: c.start()
+    if len(tables) > 1: log_message(f"Driving {len(tables)} tables: {', '.join(tables)}")
+
+def all_tables():
+    return list(tables.values()) or [OFFLINE_TABLE]
+
+# === SERVER-SENT EVENTS ===
+EVENT_CLIENTS_MAX = 3       # Each open stream holds one of waitress' worker threads
+EVENT_STREAM_SECONDS = 300  # Streams end periodically to free the thread; EventSource reconnects
+LIVE_FPS = 4                # Cap on live view frames pushed per second
+
+class EventHub:
+    """Fan-out of small JSON events to SSE clients. Slow clients drop events instead of blocking."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clients = []
+
+    def subscribe(self, table_id):
+        q = queue.Queue(maxsize=64)
+        with self.lock:
+            if len(self.clients) >= EVENT_CLIENTS_MAX: return None
+            self.clients.append((table_id, q))
+        return q
+
+    def unsubscribe(self, q):
+        with self.lock:
+            self.clients = [c for c in self.clients if c[1] is not q]
+
+    def has_clients(self):
+        return bool(self.clients)
+
+    def publish(self, event, data, table_id=None):
+        msg = f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        with self.lock:
+            targets = [q for t, q in self.clients if table_id is None or t == table_id]
+        for q in targets:
+            try: q.put_nowait(msg)
+            except queue.Full: pass
+
+events = EventHub()
+
+class LiveRenderThread(threading.Thread):
+    """Advances each table's live raster at up to LIVE_FPS while someone is watching,
+    and pushes the new version tag. Without viewers the raster catches up on the next request."""
+    def __init__(self):
+        super().__init__(daemon=True)
+
+    def run(self):
+        while True:
+            time.sleep(1.0 / LIVE_FPS)
+            if not events.has_clients(): continue
+            for table in list(tables.values()):
+                try:
+                    if table.render_live():
+                        runner = table.raster_runner
+                        events.publish("live", {
+                            "table": table.id,
+                            "version": table.raster.version,
+                            "sent": runner.lines_sent,
+                            "drawn": runner.lines_done(),
+                            "total": runner.total_lines
+                        }, table_id=table.id)
+                except Exception as e:
+                    print(f"Live render error: {e}")
+
+# === SCHEDULER ===
+def load_schedules():
+    if not os.path.exists(SCHEDULE_FILE): return []
+    try:
+        with open(SCHEDULE_FILE, 'r') as f: return json.load(f)
+    except: return []
+
+def save_schedules(data):
+    with open(SCHEDULE_FILE, 'w') as f: json.dump(data, f)
+
+def hex_to_rgb(hex_val):
+    hex_val = hex_val.lstrip('#')
+    return tuple(int(hex_val[i:i+2], 16) for i in (0, 2, 4))
+
+class SchedulerThread(threading.Thread):
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.last_minute_checked = None
+
+    def run(self):
+        log_message("Scheduler Service Started")
+        while True:
+            now = datetime.datetime.now()
+            current_time = now.strftime("%H:%M") 
+            current_day = now.strftime("%a")     
+            
+            if self.last_minute_checked != current_time:
+                self.last_minute_checked = current_time
+                self.check_triggers(current_time, current_day)
+            
+            time.sleep(5) 
+
+    def check_triggers(self, time_str, day_str):
+        schedules = load_schedules()
+        for item in schedules:
+            if item['time'] == time_str and day_str in item['days']:
+                # A schedule with a 'table' field targets that table, otherwise every table
+                targets = [tables[item['table']]] if item.get('table') in tables else all_tables()
+                for table in targets:
+                    self.execute_action(item, table)
+
+    def execute_action(self, item, table):
+        action = item['type']
+        val = item.get('value')
+        table.log(f"Scheduler Trigger: {action}")
+
+        if action == "led_off":
+            # UPDATED: Set Color to Black (Serial)
+            table.send_led(0, 0, 0)
+        
+        elif action == "led_on":
+            # Set Color to White (Full)
+            table.send_led(255, 255, 255)
+        
+        elif action == "led_color" and val:
+            try:
+                r, g, b = hex_to_rgb(val)
+                # UPDATED: Use Serial Sender
+                table.send_led(r, g, b)
+            except: pass
+            
+        elif action == "stop_sand":
+            # UPDATED: 'Stop' button logic changed to PAUSE per request
+            table.jobs.post('pause')
+            table.log("Automation: Sand Table Paused.")
+
+        elif action == "resume_sand":
+            table.jobs.post('resume')
+            table.log("Automation: Sand Table Resumed.")
+
+        elif action == "sand_shuffle":
+            try:
+                files = design_store.list_designs(DESIGNS_FOLDER)
+                if files:
+                    import random
+                    random.shuffle(files)
+                    table.loop_playlist = files
+                    table.is_looping = True
+                    table.log(f"Scheduler: Loop started with {len(files)} designs.")
+                    table.jobs.post('wake')
+            except Exception as e: table.log(str(e))
+        elif action == "sand_specific" and val:
+            job = library_job(val)
+            if job: table.submit_job(job)
+
+# === DESIGN LIBRARY INDEX ===
+LIBRARY_SCAN_INTERVAL = 15  # Seconds between checks for designs added/changed outside the web UI
+ANALYSIS_BATCH = 20         # Designs analyzed per pass in the background
+
+class LibraryWatcher(threading.Thread):
+    """Keeps design_index in step with DESIGNS_FOLDER so searches never scan files.
+    Uploads and deletes update the index directly; this catches copies, pulls and edits."""
+    def __init__(self):
+        super().__init__(daemon=True)
+
+    def run(self):
+        while True:
+            try:
+                t0 = time.monotonic()
+                changed = design_index.refresh()
+                if changed: log_message(f"Design index: {changed} changes ({time.monotonic() - t0:.1f}s)")
+                self.analyze_pending()
+            except Exception as e:
+                print(f"Library index error: {e}")
+            time.sleep(LIBRARY_SCAN_INTERVAL)
+
+    def analyze_pending(self):
+        # A few per pass, so a big library is worked through without hogging the Pi
+        da = get_design_analysis()
+        if not da: return
+        for name, mtime in design_index.unanalyzed(da.ANALYSIS_VERSION)[:ANALYSIS_BATCH]:
+            analyze_design(name, mtime)
+        design_index.save()
+
+def analyze_design(name, mtime=None):
+    """Runs the kinematic analysis of a library design and stores it in the index. Returns it, or None."""
+    da = get_design_analysis()
+    path = os.path.join(DESIGNS_FOLDER, name)
+    if not da or not os.path.exists(path): return None
+    mtime = mtime or os.stat(path).st_mtime
+    try:
+        analysis = da.analyze_file(path)
+    except Exception as e:
+        log_message(f"Analysis of {name} failed: {e}")
+        analysis = {"version": da.ANALYSIS_VERSION, "error": str(e), "flags": []}
+    design_index.set_analysis(name, analysis, mtime)
+    if analysis.get("flags"): log_message(f"Design {name}: {', '.join(analysis['flags'])}")
+    return analysis
+
+# === JOB JOURNAL (CRASH-SAFE RESUME) ===
+JOURNAL_INTERVAL = 5   # Seconds between checkpoints (sampled, not per line)
+RESUME_REWIND = 32     # Lines to redraw on resume; matches the Arduino inbox depth (CMD_QUEUE_SIZE)
+
+journal_wake = threading.Event()
+journal_orphans = {}   # Journal entries for tables that are not connected this run, kept as-is
+
+def job_ref(job):
+    """Returns a small reference to a job for the journal instead of its full text."""
+    fname = job.get('filename') or 'untitled.txt'
+    if 'ref' in job:
+        return {'filename': fname}
+    if 'pattern' in job:
+        return {'filename': fname, 'pattern': job['pattern']}
+    if 'spool' in job:
+        return {'filename': fname, 'spool': job['spool']}
+    # Text that draws the same as a library design is journaled as that design
+    twin = design_index.find_hash(job['hash']) if job.get('hash') else None
+    if twin:
+        return {'filename': twin}
+    # Generated designs (sketch / AI exports) aren't in the library, so spool their text once
+    # (once per content: identical exports share a spool file)
+    os.makedirs(JOURNAL_SPOOL, exist_ok=True)
+    spool = os.path.join(JOURNAL_SPOOL, f"{job['hash']}.txt" if job.get('hash') else f"{int(time.time() * 1000)}_{os.path.basename(fname)}")
+    if not os.path.exists(spool):
+        with open(spool + '.tmp', 'w') as f: f.write(job['gcode'])
+        os.replace(spool + '.tmp', spool)
+    job['spool'] = spool
+    return {'filename': fname, 'spool': spool}
+
+def load_job_ref(ref):
+    """Rebuilds a job dict from a journal reference. Returns None if the source is gone."""
+    if ref.get('pattern'):
+        return {'filename': ref['filename'], 'pattern': ref['pattern']}
+    if not ref.get('spool'):
+        job = library_job(ref['filename'])
+        if not job: log_message(f"Journal: {ref['filename']} no longer in library")
+        return job
+    try:
+        job = {'gcode': design_store.read_design(ref['spool']), 'filename': ref['filename']}
+    except Exception as e:
+        log_message(f"Journal: cannot reload {ref.get('filename')}: {e}")
+        return None
+    job['spool'] = ref['spool']
+    return job
+
+def journal_snapshot():
+    states = dict(journal_orphans)
+    for table in tables.values():
+        states[table.id] = table.journal_snapshot()
+    return {"tables": states}
+
+def write_journal(state):
+    # Atomic replace so a power cut never leaves a half-written journal
+    tmp = JOURNAL_FILE + ".tmp"
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, JOURNAL_FILE)
+
+def clean_journal_spool(state):
+    if not os.path.isdir(JOURNAL_SPOOL): return
+    keep = set()
+    for s in state['tables'].values():
+        refs = [s['active']] if s.get('active') else []
+        keep |= {r.get('spool') for r in refs + s.get('queue', [])}
+    for name in os.listdir(JOURNAL_SPOOL):
+        path = os.path.join(JOURNAL_SPOOL, name)
+        if path not in keep:
+            try: os.remove(path)
+            except OSError: pass
+
+def restore_journal():
+    """Reloads each table's queue & playlist from the journal. Active jobs resume after calibration."""
+    if not SYSTEM_SETTINGS.get('resume_after_calibration', True): return
+    if not os.path.exists(JOURNAL_FILE): return
+    try:
+        with open(JOURNAL_FILE, 'r') as f: state = json.load(f)
+    except Exception as e:
+        log_message(f"Journal unreadable, starting fresh: {e}")
+        return
+    # Journals from single-table versions hold one table's state at the top level
+    states = state['tables'] if 'tables' in state else {default_table().id: state}
+    for table_id, table_state in states.items():
+        if table_id in tables: tables[table_id].restore(table_state)
+        else: journal_orphans[table_id] = table_state
+
+class JournalThread(threading.Thread):
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.last_written = None
+
+    def run(self):
+        log_message("Job Journal Started")
+        while True:
+            journal_wake.wait(timeout=JOURNAL_INTERVAL)
+            journal_wake.clear()
+            try:
+                state = journal_snapshot()
+                encoded = json.dumps(state, sort_keys=True)
+                if encoded != self.last_written:
+                    write_journal(state)
+                    clean_journal_spool(state)
+                    self.last_written = encoded
+            except Exception as e:
+                print(f"Journal error: {e}")
+
+# === TABLE SELECTION ===
+class UnknownTable(Exception): pass
+
+def get_table():
+    """The table a request is for: ?table=<id> or a JSON 'table' field, else the first table."""
+    table_id = request.args.get("table")
+    if table_id is None and request.is_json:
+        table_id = (request.get_json(silent=True) or {}).get("table")
+    if table_id is None: return default_table()
+    if str(table_id) in tables: return tables[str(table_id)]
+    raise UnknownTable(table_id)
+
+@app.errorhandler(UnknownTable)
+def unknown_table(e): return jsonify(success=False, error=f"Unknown table: {e}"), 404
+
+@app.route("/api/tables")
+def list_tables():
+    return jsonify([t.status() for t in tables.values()])
 
 @app.route("/api/calibration_status")
 def calibration_status():
-    global is_calibrating, calibration_done
+    table = get_table()
     return jsonify({
-        "is_calibrating": is_calibrating,
-        "calibration_done": calibration_done
+        "is_calibrating": table.is_calibrating,
+        "calibration_done": table.calibration_done
     })
 
 @app.route("/api/skip_cooldown", methods=["POST"])
 def skip_cooldown_route():
-    global skip_cooldown
-    skip_cooldown = True
+    get_table().jobs.post('skip')
     return jsonify(success=True)
 
 # === TUNNELING SERVICE ===
@@ -522,11 +1565,13 @@ def skip_cooldown_route():
 def get_tunnel_status():
     public_url = None
     try:
+        ngrok, conf = get_ngrok()
         tunnels = ngrok.get_tunnels()
         public_url = tunnels[0].public_url if tunnels else None
     except: pass
     has_token = False
     try:
+        ngrok, conf = get_ngrok()
         if os.path.exists(conf.get_default().config_path):
             with open(conf.get_default().config_path, 'r') as f:
                 if "authtoken" in f.read(): has_token = True
@@ -536,6 +1581,7 @@ def get_tunnel_status():
 @app.route("/api/tunnel/key", methods=["POST"])
 def set_tunnel_key():
     try:
+        ngrok, conf = get_ngrok()
         ngrok.set_auth_token(request.json.get("token"))
         return jsonify(success=True)
     except Exception as e: return jsonify(success=False, message=str(e))
@@ -543,10 +1589,12 @@ def set_tunnel_key():
 @app.route("/api/tunnel/start", methods=["POST"])
 def start_tunnel():
     try:
+        ngrok, conf = get_ngrok()
         ngrok.kill()
         time.sleep(1)
     except: pass
     try:
+        ngrok, conf = get_ngrok()
         url = ngrok.connect(SERVER_PORT).public_url
         log_message(f"Tunnel Started: {url}")
         return jsonify(success=True, public_url=url)
@@ -555,6 +1603,7 @@ def start_tunnel():
 @app.route("/api/tunnel/stop", methods=["POST"])
 def stop_tunnel():
     try:
+        ngrok, conf = get_ngrok()
         ngrok.kill()
         return jsonify(success=True)
     except Exception as e: return jsonify(success=False, message=str(e))
@@ -574,6 +1623,7 @@ def auto_start_ngrok_thread():
 
     try:
         # Replicating the successful manual start logic to avoid the NoneType config error
+        ngrok, conf = get_ngrok()
         try:
             ngrok.kill()
             time.sleep(1)
@@ -586,6 +1636,54 @@ def auto_start_ngrok_thread():
     except Exception as e:
         log_message(f"Ngrok Auto-Start Failed: {e}")
 
+# === STATIC ASSETS & PAGE CACHE ===
+assets = static_assets.AssetCache(app.static_folder)
+page_cache = {}
+page_cache_lock = threading.Lock()
+page_deps = threading.local()  # Assets linked while a page renders
+
+@app.template_global()
+def asset_url(filename):
+    """Content-fingerprinted URL for a static file, served with immutable cache headers."""
+    deps = getattr(page_deps, 'files', None)
+    if deps is not None: deps[filename] = assets.stamp(filename)
+    return assets.url(filename)
+
+def payload_response(payload, mimetype, cache_control):
+    enc, body, etag = payload.select(request.headers.get("Accept-Encoding", ""))
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    if etag in request.headers.get("If-None-Match", ""):
+        return Response(status=304, headers=headers)
+    resp = Response(body, mimetype=mimetype, headers=headers)
+    if enc: resp.headers["Content-Encoding"] = enc
+    return resp
+
+def render_page(name):
+    """Pages without per-request data are rendered once, precompressed and revalidated by ETag.
+    The cached copy is dropped when the template or any asset it links to changes."""
+    stamp = os.stat(os.path.join(app.root_path, app.template_folder, name)).st_mtime_ns
+    with page_cache_lock: entry = page_cache.get(name)
+    if not entry or entry['stamp'] != stamp or any(assets.stamp(f) != s for f, s in entry['deps'].items()):
+        page_deps.files = {}
+        try: html = render_template(name)
+        finally: deps, page_deps.files = page_deps.files, None
+        entry = {'stamp': stamp, 'deps': deps, 'payload': static_assets.Payload(html.encode())}
+        with page_cache_lock: page_cache[name] = entry
+    return payload_response(entry['payload'], "text/html; charset=utf-8", "no-cache")
+
+@app.route("/assets/<fingerprint>/<path:filename>")
+def fingerprinted_asset(fingerprint, filename):
+    asset = assets.get(filename)
+    if not asset: return jsonify(success=False, error="Not found"), 404
+    # A stale fingerprint still gets the current file, just not cached forever
+    cache_control = static_assets.IMMUTABLE if fingerprint == asset.hash else "no-cache"
+    if asset.payload:
+        mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        return payload_response(asset.payload, mimetype, cache_control)
+    resp = send_file(asset.path, conditional=True, etag=asset.hash)
+    resp.headers["Cache-Control"] = cache_control
+    return resp
+
 # === FLASK ROUTES ===
 def get_current_ip():
     try:
@@ -598,34 +1696,55 @@ def get_current_ip():
 @app.route("/")
 def index():
     if get_current_ip() in ["10.42.0.1", "192.168.4.1"]: return redirect(url_for('wifi_setup_page'))
-    return render_template("designs.html")
+    return render_page("designs.html")
 
 @app.route("/controller")
-def controller_page(): return render_template("controller.html")
+def controller_page(): return render_page("controller.html")
 
 @app.route("/api/move", methods=["POST"])
 def manual_move():
-    global current_theta, current_rho
-    if not arduino_connected: return jsonify(success=False, error="Arduino Disconnected")
+    table = get_table()
+    if not table.connected: return jsonify(success=False, error="Arduino Disconnected")
     
     # Block manual moves if design is playing or in cooldown
-    if (current_gcode_runner and current_gcode_runner.is_alive()) or is_waiting:
+    if table.is_busy():
         return jsonify(success=False, error="Cannot move manually while design is active"), 400
 
     data = request.json
     theta = data.get("theta")
     rho = data.get("rho")
     # Update state tracking
-    current_theta = float(theta)
-    current_rho = float(rho)
+    table.current_theta = float(theta)
+    table.current_rho = float(rho)
     # Send as raw theta rho to the firmware
     cmd = f"{theta} {rho}\n"
-    log_message(f"TX (Manual): {cmd.strip()}")
-    with lock: arduino.write(cmd.encode())
+    table.log(f"TX (Manual): {cmd.strip()}")
+    table.write(cmd.encode())
     return jsonify(success=True)
 
+@app.route("/api/jog", methods=["POST"])
+def jog_route():
+    """Lightweight jog input: {theta, rho, seq, session} sets the latest target, {stop: true} releases.
+    Feedback (moving / idle / stopped) arrives as 'jog' events on /api/events."""
+    table = get_table()
+    if not table.connected: return jsonify(success=False, error="Arduino Disconnected")
+    if table.is_busy():
+        return jsonify(success=False, error="Cannot move manually while design is active"), 400
+    d = request.json or {}
+    jogger = table.get_jogger()
+    if d.get("stop"):
+        jogger.release()
+        return jsonify(success=True)
+    try:
+        theta = float(d["theta"])
+        rho = min(max(float(d["rho"]), 0.0), 1.0)
+        seq = int(d["seq"]) if d.get("seq") is not None else None
+    except (KeyError, TypeError, ValueError):
+        return jsonify(success=False, error="theta and rho required"), 400
+    return jsonify(success=True, accepted=jogger.submit(theta, rho, seq, d.get("session")))
+
 @app.route("/settings")
-def settings_page(): return render_template("settings.html")
+def settings_page(): return render_page("settings.html")
 
 # --- SETTINGS API ---
 @app.route("/api/settings", methods=["GET", "POST"])
@@ -638,7 +1757,11 @@ def api_settings():
         SYSTEM_SETTINGS.update(data)
         save_app_settings(SYSTEM_SETTINGS)
         if 'speed' in data:
-            send_speed_to_arduino()
+            for table in tables.values(): table.send_speed()
+        if 'record_serial' in data:
+            for table in tables.values(): table.set_recording(bool(data['record_serial']))
+        if 'telemetry_ms' in data:
+            for table in tables.values(): table.send_telemetry_rate()
         log_message(f"Settings updated: {SYSTEM_SETTINGS}")
         return jsonify(success=True)
 
@@ -649,59 +1772,80 @@ def git_pull():
         return jsonify(success=(r.returncode==0), message=r.stdout[:500] if r.returncode==0 else r.stderr)
     except Exception as e: return jsonify(success=False, message=str(e))
 
-@app.route("/update_firmware", methods=["POST"])
-def update_firmware():
-    global arduino, arduino_connected
-    d = request.json or {}
-    auto_reboot = d.get("reboot", False)
-    
-    # 1. Paths & Setup
-    SKETCH_PATH = "/home/sandtable2/stepper_gcode_project/Sand"
-    BUILD_PATH = f"{SKETCH_PATH}/build"
-    CONF_PATH = "/home/sandtable2/.arduino15/packages/arduino/tools/avrdude/8.0.0-arduino1/etc/avrdude.conf"
-    HEX_FILE = f"{BUILD_PATH}/Sand.ino.hex"
-    FQBN = "lgt8fx:avr:328:clock_source=internal,clock_div=1,variant=modelP"
+# === FIRMWARE UPDATE ===
+FIRMWARE_SKETCH_PATH = "/home/sandtable2/stepper_gcode_project/Sand"
+FIRMWARE_FQBN = "lgt8fx:avr:328:clock_source=internal,clock_div=1,variant=modelP"
+AVRDUDE_CONF = "/home/sandtable2/.arduino15/packages/arduino/tools/avrdude/8.0.0-arduino1/etc/avrdude.conf"
 
-    try:
-        # 2. Clean old builds for speed & fresh compile
-        if os.path.exists(BUILD_PATH): shutil.rmtree(BUILD_PATH)
-        os.makedirs(BUILD_PATH)
-        
-        # 3. High-Speed Compile
-        log_message("Compiling Firmware...")
-        subprocess.run(["arduino-cli", "compile", "--fqbn", FQBN, "--output-dir", BUILD_PATH, SKETCH_PATH], check=True)
-
-        # 4. Critical Flash Window: Disconnect -> Reset -> Blast -> Reconnect
-        if arduino: 
-            arduino.close()
-            arduino_connected = False
-
-        log_message("Flashing LGT8F...")
-        # Hardware Reset
-        subprocess.run(["sudo", "pinctrl", "set", "18", "op", "dl"], check=True)
-        time.sleep(0.1)
-        subprocess.run(["sudo", "pinctrl", "set", "18", "op", "dh"], check=True)
-
-        # Immediate avrdude blast (no verify for max speed)
-        subprocess.run([
-            "/usr/bin/avrdude", "-C", CONF_PATH, "-p", "atmega328p", "-c", "arduino", 
-            "-P", "/dev/ttyS0", "-b", "115200", "-D", "-V", "-U", f"flash:w:{HEX_FILE}:i"
-        ], check=True, capture_output=True)
-        
-        log_message("Firmware Updated Successfully!")
-        connect_arduino()
+firmware_builder = firmware_build.FirmwareBuilder(FIRMWARE_SKETCH_PATH, FIRMWARE_FQBN, log=log_message)
+firmware_thread = None
 
-        if auto_reboot:
-            log_message("Auto-Rebooting Pi Host System...")
-            subprocess.Popen(["sudo", "reboot"])
-            return jsonify(success=True, message="Firmware updated! Rebooting Raspberry Pi...")
+class FirmwareUpdateThread(threading.Thread):
+    """Builds (or reuses a cached build) while the tables keep drawing; the serial link is
+    only closed for the reset + avrdude window."""
+    def __init__(self, auto_reboot=False):
+        super().__init__(daemon=True)
+        self.auto_reboot = auto_reboot
+        self.stage = "building"
+        self.message = None
 
-        return jsonify(success=True, message="Firmware Updated Successfully!")
+    def run(self):
+        flash_table = uart_table()
+        try:
+            hex_file = firmware_builder.build()
+
+            # Critical Flash Window: Disconnect -> Reset -> Blast -> Reconnect
+            # Only the table on the UART is flashed; tables on other ports keep drawing
+            self.stage = "flashing"
+            if flash_table: flash_table.disconnect()
+
+            log_message("Flashing LGT8F...")
+            # Hardware Reset
+            subprocess.run(["sudo", "pinctrl", "set", "18", "op", "dl"], check=True)
+            time.sleep(0.1)
+            subprocess.run(["sudo", "pinctrl", "set", "18", "op", "dh"], check=True)
+
+            # Immediate avrdude blast (no verify for max speed)
+            subprocess.run([
+                "/usr/bin/avrdude", "-C", AVRDUDE_CONF, "-p", "atmega328p", "-c", "arduino", 
+                "-P", FLASH_PORT, "-b", "115200", "-D", "-V", "-U", f"flash:w:{hex_file}:i"
+            ], check=True, capture_output=True)
+
+            log_message("Firmware Updated Successfully!")
+            reconnect_after_flash(flash_table)
+            self.stage, self.message = "done", "Firmware Updated Successfully!"
+
+            if self.auto_reboot:
+                log_message("Auto-Rebooting Pi Host System...")
+                subprocess.Popen(["sudo", "reboot"])
+        except Exception as e:
+            log_message(f"Update Failed: {str(e)}")
+            if self.stage == "flashing": reconnect_after_flash(flash_table)
+            self.stage, self.message = "failed", str(e)
 
-    except Exception as e:
-        log_message(f"Update Failed: {str(e)}")
-        connect_arduino()
-        return jsonify(success=False, message=str(e))
+@app.route("/update_firmware", methods=["POST"])
+def update_firmware():
+    global firmware_thread
+    d = request.json or {}
+    if firmware_thread and firmware_thread.is_alive():
+        return jsonify(success=False, message=f"Firmware update already {firmware_thread.stage}")
+    firmware_thread = FirmwareUpdateThread(auto_reboot=d.get("reboot", False))
+    firmware_thread.start()
+    return jsonify(success=True, message="Firmware update started, progress is shown in the log")
+
+@app.route("/api/firmware_status")
+def firmware_status():
+    if not firmware_thread: return jsonify({"stage": None, "message": None})
+    return jsonify({"stage": firmware_thread.stage, "message": firmware_thread.message})
+
+def uart_table():
+    """The table on the UART avrdude flashes through, if it is connected."""
+    uart = os.path.realpath(FLASH_PORT)
+    return next((t for t in tables.values() if os.path.realpath(t.port) == uart), None)
+
+def reconnect_after_flash(flash_table):
+    if flash_table: flash_table.connect()
+    else: connect_tables()
 
 @app.route("/shutdown", methods=["POST"])
 def shutdown(): subprocess.Popen(["sudo", "shutdown", "now"]); return jsonify(success=True)
@@ -727,81 +1871,219 @@ def api_delete_schedule(idx):
 
 @app.route("/status")
 def get_status():
-    return jsonify({"connected": arduino_connected, "port": arduino_port})
+    table = get_table()
+    return jsonify({"connected": table.connected, "port": table.port, "table": table.id, "link": table.link.status()})
 
 @app.route("/status_full", methods=["GET"])
 def status_full():
+    table = get_table()
+    loop_playlist = list(table.loop_playlist)
     q = []
     # Add active job_queue items
-    for i, j in enumerate(job_queue): 
-        q.append({"index": i, "name": j['filename'].replace('.txt', ''), "type": "queue"})
+    for i, j in enumerate(list(table.job_queue)): 
+        q.append({"index": i, "name": design_store.design_stem(j['filename']), "filename": j['filename'], "type": "queue"})
     
     # Add upcoming loop items (limit to 10 for performance)
-    if is_looping:
+    if table.is_looping:
         for i in range(min(len(loop_playlist), 10)): 
-            q.append({"index": i, "name": loop_playlist[i].replace('.txt', ''), "type": "loop"})
+            q.append({"index": i, "name": design_store.design_stem(loop_playlist[i]), "filename": loop_playlist[i], "type": "loop"})
     
     progress = None
-    if current_gcode_runner and current_gcode_runner.is_alive():
+    runner = table.runner
+    if runner and runner.is_alive():
         progress = {
-            "sent": current_gcode_runner.lines_sent,
-            "total": current_gcode_runner.total_lines
+            "sent": runner.lines_sent,
+            "drawn": runner.lines_done(),  # Sent minus what the firmware still holds, with telemetry
+            "total": runner.total_lines,
+            "estimate": round(runner.prepared.estimate),
+            "erase": runner.prepared.erase_info
         }
 
+    t = table.live_telemetry()
+    telemetry = None
+    if t:
+        telemetry = {k: t[k] for k in ("lines_queued", "steps_queued", "step_rate", "paused")}
+        telemetry["age"] = round(time.monotonic() - t["time"], 2)
+        # Streaming window: lines between the host and the arm
+        if progress: telemetry["in_flight"] = runner.lines_sent - runner.lines_done()
+
+    current_job_name = table.current_job_name
+    raster = table.raster
     return jsonify({
-        "playing": current_job_name.replace('.txt', '') if current_job_name else None,
+        "live_version": raster.version if raster else None,
+        "table": table.id,
+        "playing": design_store.design_stem(current_job_name) if current_job_name else None,
+        "playing_file": current_job_name,
         "progress": progress,
-        "position": {"theta": current_theta, "rho": current_rho},
-        "queue_count": len(job_queue),
+        "position": dict(zip(("theta", "rho"), table.position())),
+        "commanded": {"theta": table.current_theta, "rho": table.current_rho},
+        "telemetry": telemetry,
+        "queue_count": len(table.job_queue),
         "queue_items": q,
         "next_up": q[0]["name"] if q else "None",
-        "is_looping": is_looping, 
-        "is_paused": is_paused, 
-        "is_waiting": is_waiting  
+        "is_looping": table.is_looping, 
+        "is_paused": table.is_paused, 
+        "is_waiting": table.is_waiting,
+        "job": table.jobs.status(),
+        "link": table.link.status()
     })
 
+@app.route("/api/job/transitions")
+def job_transitions():
+    """Recent job lifecycle transitions of a table, oldest first, with timestamps."""
+    table = get_table()
+    return jsonify(success=True, state=table.jobs.status(), transitions=list(table.jobs.history))
+
+@app.route("/api/events")
+def event_stream():
+    """Server-sent events for one table (live view frames, ...)."""
+    table = get_table()
+    q = events.subscribe(table.id)
+    if q is None: return jsonify(success=False, error="Too many event streams"), 503
+    def stream():
+        try:
+            yield "retry: 3000\n\n"
+            deadline = time.monotonic() + EVENT_STREAM_SECONDS
+            while time.monotonic() < deadline:
+                # The keepalive also detects clients that went away
+                try: yield q.get(timeout=15)
+                except queue.Empty: yield ": keepalive\n\n"
+        finally:
+            events.unsubscribe(q)
+    return Response(stream(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/api/live.png")
+def live_image():
+    """The sand drawn so far. ?v=<version> URLs are immutable; otherwise revalidate with the ETag."""
+    table = get_table()
+    table.render_live()
+    if not table.raster: return jsonify(success=False, error="Nothing drawn yet"), 404
+    version, png = table.raster.png_bytes()
+    etag = f'"{table.id}-{version}"'
+    if request.headers.get("If-None-Match") == etag:
+        return Response(status=304, headers={"ETag": etag})
+    resp = Response(png, mimetype="image/png")
+    resp.headers["ETag"] = etag
+    resp.headers["Cache-Control"] = "public, max-age=31536000, immutable" if request.args.get("v") == str(version) else "no-cache"
+    return resp
+
 @app.route("/remove_from_queue", methods=["POST"])
 def remove_from_queue():
     try:
+        table = get_table()
         idx = int(request.json.get("index")); typ = request.json.get("type")
-        if typ == "queue": del job_queue[idx]
-        elif typ == "loop": del loop_playlist[idx]
+        if typ == "queue": del table.job_queue[idx]
+        elif typ == "loop": del table.loop_playlist[idx]
+        table.schedule_prefetch()
+        table.jobs.post('wake')  # Ends a cooldown with nothing left to play
         return jsonify(success=True)
+    except UnknownTable: raise
     except: return jsonify(success=False)
 
 @app.route("/set_loop", methods=["POST"])
 def set_loop():
-    global is_looping, loop_playlist, skip_cooldown
+    table = get_table()
     # designs.html sends 'filenames', but we also check 'files' for compatibility
     new_files = request.json.get("filenames", request.json.get("files", []))
-    loop_playlist = new_files
-    is_looping = len(loop_playlist) > 0
+    table.loop_playlist = new_files
+    table.is_looping = len(table.loop_playlist) > 0
     
-    log_message(f"Loop set with {len(loop_playlist)} items. Looping: {is_looping}")
+    table.log(f"Loop set with {len(table.loop_playlist)} items. Looping: {table.is_looping}")
+    journal_wake.set()
     
-    if is_looping:
-        if is_waiting:
-            skip_cooldown = True
-        elif not current_gcode_runner or not current_gcode_runner.is_alive():
-            process_queue(wait_enabled=False)
+    if table.is_looping:
+        table.schedule_prefetch()
+        table.jobs.post('wake', skip=True)  # A new playlist starts now, even mid-cooldown
     return jsonify(success=True)
 
 @app.route("/cancel_loop", methods=["POST"])
 def cancel_loop():
-    global is_looping, loop_playlist; is_looping = False; loop_playlist = []; return jsonify(success=True)
+    table = get_table(); table.is_looping = False; table.loop_playlist = []; table.jobs.post('wake'); journal_wake.set(); return jsonify(success=True)
 
 @app.route("/send_gcode_block", methods=["POST"])
 def send_gcode_block_route():
-    if not arduino_connected: return jsonify(success=False, error="Arduino Disconnected (Check USB)"), 500
+    table = get_table()
+    if not table.connected: return jsonify(success=False, error="Arduino Disconnected (Check USB)"), 500
     d = request.json; g = d.get("gcode"); f = d.get("filename")
     
+    # Text upload for generated designs (sketch / AI builder); library designs use /api/play
     # If currently in cooldown or already running a job, append to queue
-    if is_waiting or (current_gcode_runner and current_gcode_runner.is_alive()):
-        job_queue.append({'gcode': g, 'filename': f})
-        return jsonify(success=True, message="Queued")
-    else:
-        start_job({'gcode': g, 'filename': f})
-        return jsonify(success=True, message=f"Started {f}")
+    return jsonify(success=True, message=table.submit_job(text_job(g, f)))
+
+@app.route("/api/play", methods=["POST"])
+def play_design_route():
+    """Play a library design by filename; the server reads the file, the browser never downloads it."""
+    table = get_table()
+    if not table.connected: return jsonify(success=False, error="Arduino Disconnected (Check USB)"), 500
+    job = library_job((request.json or {}).get("filename"))
+    if not job: return jsonify(success=False, error="Design not found"), 404
+    return jsonify(success=True, message=table.submit_job(job))
+
+@app.route("/api/enqueue", methods=["POST"])
+def enqueue_designs_route():
+    """Batch version of /api/play: validates every filename, queues the valid ones in order."""
+    table = get_table()
+    if not table.connected: return jsonify(success=False, error="Arduino Disconnected (Check USB)"), 500
+    names = (request.json or {}).get("filenames", [])
+    jobs, rejected = [], []
+    for name in names:
+        job = library_job(name)
+        if job: jobs.append(job)
+        else: rejected.append(name)
+    if not jobs: return jsonify(success=False, error="No valid designs", rejected=rejected), 400
+    busy = table.is_busy()
+    table.job_queue.extend(jobs)
+    if busy: table.schedule_prefetch()
+    table.jobs.post('wake')
+    journal_wake.set()
+    table.log(f"Enqueued {len(jobs)} designs ({len(rejected)} rejected)")
+    return jsonify(success=True, queued=len(jobs), rejected=rejected)
+
+# === PARAMETRIC PATTERNS ===
+def pattern_job(data):
+    """Validates a pattern description into a job. Returns (job, error)."""
+    pt = get_patterns()
+    if not pt: return None, "Pattern generators unavailable (numpy not installed)"
+    try: params = pt.normalize(data)
+    except ValueError as e: return None, str(e)
+    return {'filename': pt.pattern_filename(params), 'pattern': params}, None
+
+@app.route("/api/patterns")
+def list_patterns():
+    pt = get_patterns()
+    if not pt: return jsonify(families={}, common={})
+    return jsonify(families=pt.FAMILIES, common=pt.COMMON)
+
+@app.route("/api/patterns/preview", methods=["POST"])
+def preview_pattern():
+    """Generates (or loads from cache) a pattern and its thumbnail without playing it."""
+    job, error = pattern_job((request.json or {}).get("pattern"))
+    if error: return jsonify(success=False, error=error), 400
+    pt = get_patterns(); tn = get_thumbnailer()
+    try:
+        lines = pt.pattern_lines(job['pattern'], PATTERN_CACHE)
+        thumb = pt.thumbnail(job['pattern'], PATTERN_CACHE, tn.ThumbnailBuilder) if tn else None
+    except ValueError as e: return jsonify(success=False, error=str(e)), 400
+    key = pt.pattern_key(job['pattern'])
+    return jsonify(success=True, key=key, filename=job['filename'], pattern=job['pattern'], points=len(lines),
+                   estimate=round(lines.estimate_seconds(SYSTEM_SETTINGS.get('speed', 1.0))),
+                   thumbnail=url_for('pattern_thumbnail', key=key) if thumb else None)
+
+@app.route("/api/patterns/<key>.png")
+def pattern_thumbnail(key):
+    if not re.fullmatch(r'[0-9a-f]{16}', key): return jsonify(success=False, error="Invalid key"), 400
+    return send_from_directory(PATTERN_CACHE, key + ".png", max_age=31536000)
+
+@app.route("/api/patterns/play", methods=["POST"])
+def play_pattern():
+    """Plays a pattern described by parameters; points are computed server-side and streamed to the runner."""
+    table = get_table()
+    if not table.connected: return jsonify(success=False, error="Arduino Disconnected (Check USB)"), 500
+    job, error = pattern_job((request.json or {}).get("pattern"))
+    if error: return jsonify(success=False, error=error), 400
+    try: get_patterns().load(job['pattern'], PATTERN_CACHE)  # Reject oversized patterns before queueing
+    except ValueError as e: return jsonify(success=False, error=str(e)), 400
+    return jsonify(success=True, filename=job['filename'], message=table.submit_job(job))
 
 @app.route("/delete_design", methods=["POST"])
 def delete_design():
@@ -819,13 +2101,14 @@ def delete_design():
 
         deleted_any = False
 
-        # 1. Delete main design file (.txt or .thr)
+        # 1. Delete main design file (.txt / .thr, optionally .gz / .zst)
         if os.path.exists(target_path):
             os.remove(target_path)
+            design_index.remove(safe_filename)
             deleted_any = True
 
         # 2. Delete corresponding thumbnail image if present (.png / .jpg)
-        base_name = os.path.splitext(safe_filename)[0]
+        base_name = design_store.design_stem(safe_filename)
         for ext in ['.png', '.jpg', '.jpeg']:
             thumb_path = os.path.join(DESIGNS_FOLDER, base_name + ext)
             if os.path.exists(thumb_path):
@@ -842,62 +2125,106 @@ def delete_design():
         log_message(f"Delete Error: {str(e)}")
         return jsonify(success=False, error=str(e)), 500
 
+def ingest_design(chunks, filename, gzip_input=False):
+    """Single pass over an upload: validated file, thumbnail and index entry. Returns a summary dict."""
+    tn = get_thumbnailer()
+    thumb = tn.ThumbnailBuilder() if tn else None
+    stats, report = design_store.ingest(chunks, DESIGNS_FOLDER, filename, gzip_input=gzip_input,
+                                        on_point=thumb.add_point if thumb else None)
+    entry = design_index.put(filename, stats)
+    twins = design_index.twins(filename)
+    thumb_path = os.path.join(DESIGNS_FOLDER, design_store.thumb_name(filename))
+    twin = twin_thumbnail(filename)
+    if twin: design_store.link_or_copy(twin, thumb_path)
+    elif thumb: thumb.save(thumb_path)
+    log_message(f"Saved design {filename}: {stats.points} points ({report['duplicates']} duplicates, {report['invalid']} invalid dropped)" +
+                (f", same drawing as {', '.join(twins)}" if twins else ""))
+    da = get_design_analysis()
+    analysis = entry.get('analysis')
+    if da and (not analysis or analysis.get('version') != da.ANALYSIS_VERSION):
+        analysis = analyze_design(filename, entry['mtime'])
+    design_index.save()
+    return dict(report, filename=filename, points=entry['points'], max_rho=entry['max_rho'],
+                estimate=round(kinematics.steps_to_seconds(entry['steps'], SYSTEM_SETTINGS.get('speed', 1.0))),
+                flags=analysis.get('flags', []) if analysis else None, duplicate_of=twins)
+
+def twin_thumbnail(filename):
+    """Up-to-date thumbnail of an identical design under another name, to share instead of redraw."""
+    stem = design_store.design_stem(filename)
+    for twin in design_index.twins(filename):
+        if design_store.design_stem(twin) == stem: continue
+        thumb = os.path.join(DESIGNS_FOLDER, design_store.thumb_name(twin))
+        try:
+            if os.path.getmtime(thumb) >= os.path.getmtime(os.path.join(DESIGNS_FOLDER, twin)): return thumb
+        except OSError:
+            continue
+    return None
+
+def upload_filename(name):
+    f = os.path.basename(name or "")
+    if not design_store.is_design(f) or f.endswith('.zst'): return None
+    return f
+
 @app.route("/save_design", methods=["POST"])
 def save_design():
-    f = request.json.get("filename"); g = request.json.get("gcode")
-    with open(os.path.join(DESIGNS_FOLDER, f), "w") as file: file.write(g)
-    return jsonify(success=True)
+    f = upload_filename(request.json.get("filename")); g = request.json.get("gcode")
+    if not f or not g: return jsonify(success=False, error="Invalid filename or empty design"), 400
+    try: return jsonify(success=True, **ingest_design([g.encode()], f))
+    except ValueError as e: return jsonify(success=False, error=str(e)), 400
+
+@app.route("/api/designs/upload", methods=["POST"])
+def upload_design():
+    """Streaming upload: raw design text (or gzip with Content-Encoding: gzip) as the request body.
+    Parsed in 64 KB chunks, so large designs never sit in memory as one JSON string."""
+    f = upload_filename(request.args.get("filename"))
+    if not f: return jsonify(success=False, error="Filename must end in .thr/.txt (optionally .gz)"), 400
+    gz = request.headers.get("Content-Encoding", "").lower() == "gzip"
+    chunks = iter(lambda: request.stream.read(64 * 1024), b'')
+    try: return jsonify(success=True, **ingest_design(chunks, f, gzip_input=gz))
+    except ValueError as e: return jsonify(success=False, error=str(e)), 400
 
 @app.route("/send", methods=["POST"])
 def send_command():
-    global is_paused
+    table = get_table()
     cmd = request.json.get("command")
     if cmd == "CLEAR":
-        global is_looping, loop_playlist;
-        is_looping = False; loop_playlist = []; job_queue.clear(); is_paused = False
-        if current_gcode_runner:
-            current_gcode_runner.is_running = False
-            current_gcode_runner.pause_event.set()
-        if arduino_connected:
-            with lock:
-                arduino.write(b"CLEAR\n")
-                arduino.write(b"RESUME\n")
+        table.jobs.post('stop')
+        journal_wake.set()
         return jsonify(success=True)
     elif cmd == "PAUSE":
-        is_paused = True
-        if current_gcode_runner:
-            current_gcode_runner.pause_event.clear()
-        if arduino_connected:
-            with lock: arduino.write(b"PAUSE\n")
+        table.jobs.post('pause')
         return jsonify(success=True)
     elif cmd == "RESUME":
-        is_paused = False
-        if current_gcode_runner:
-            current_gcode_runner.pause_event.set()
-        if arduino_connected:
-            with lock: arduino.write(b"RESUME\n")
+        table.jobs.post('resume')
         return jsonify(success=True)
     elif cmd.startswith("LED:") or cmd in ["POWER:ON", "POWER:OFF"]:
         # Use Serial Sender
         if cmd.startswith("LED:"):
             parts = cmd.split(":")[1].split(",")
             r, g, b, br = map(int, parts)
-            send_led_persistent(r, g, b)
+            table.send_led(r, g, b)
         elif cmd == "POWER:OFF":
-            send_led_persistent(0, 0, 0)
+            table.send_led(0, 0, 0)
         elif cmd == "POWER:ON":
-            send_led_persistent(255, 255, 255)
+            table.send_led(255, 255, 255)
         return jsonify(success=True)
     
-    if arduino_connected: 
-        log_message(f"TX (Raw): {cmd}")
-        with lock:
-            arduino.write((cmd+"\n").encode())
+    if table.connected: 
+        table.log(f"TX (Raw): {cmd}")
+        table.write((cmd+"\n").encode())
         return jsonify(success=True)
     return jsonify(success=False)
 
 @app.route("/wifi_setup")
-def wifi_setup_page(): return render_template("wifi_setup.html", networks=wifi_tools.get_wifi_networks(), saved_networks=wifi_tools.get_saved_networks())
+def wifi_setup_page():
+    # Rendered from the scan cache; the page refreshes the list itself via /api/wifi_networks
+    scan = wifi_tools.scanner.snapshot()
+    return render_template("wifi_setup.html", networks=scan["networks"], saved_networks=scan["saved_networks"])
+@app.route("/api/wifi_networks")
+def wifi_networks_route():
+    """Cached networks, never waiting on nmcli; ?refresh=1 starts a scan and the page polls while 'scanning'."""
+    if request.args.get("refresh"): wifi_tools.scanner.refresh()
+    return jsonify(wifi_tools.scanner.snapshot())
 @app.route("/api/forget_wifi", methods=["POST"])
 def forget_wifi_route(): success, msg = wifi_tools.forget_network(request.json.get("ssid")); return jsonify(success=success, message=msg)
 @app.route("/check_password", methods=["POST"])
@@ -905,45 +2232,181 @@ def check_password_route(): return jsonify(success=(request.json.get("password")
 
 # --- PAGES ---
 @app.route("/terminal")
-def terminal(): return render_template("terminal.html")
+def terminal(): return render_page("terminal.html")
 @app.route("/AI_builder")
-def ai_builder(): return render_template("AI_builder.html")
+def ai_builder(): return render_page("AI_builder.html")
 @app.route("/led_controls")
-def led_controls(): return render_template("led_controls.html")
+def led_controls(): return render_page("led_controls.html")
 @app.route("/sketch")
-def sketch_page(): return render_template("sketch.html")
+def sketch_page(): return render_page("sketch.html")
 @app.route("/designs")
-def designs(): return render_template("designs.html")
+def designs(): return render_page("designs.html")
 @app.route('/designs/<path:filename>')
-def serve_design_file(filename): return send_from_directory(DESIGNS_FOLDER, filename)
+def serve_design_file(filename):
+    path = design_store.resolve_design(DESIGNS_FOLDER, filename) if design_store.is_design(filename) else None
+    if not path: return send_from_directory(DESIGNS_FOLDER, filename)
+    _, comp = design_store.split_compression(path)
+    if comp == '.gz' and 'gzip' in request.headers.get('Accept-Encoding', ''):
+        # Pass the stored gzip bytes straight through, the browser inflates them
+        resp = send_file(path, mimetype='text/plain', conditional=True)
+        resp.headers['Content-Encoding'] = 'gzip'
+        resp.headers['Vary'] = 'Accept-Encoding'
+        return resp
+    if comp:
+        def stream():
+            with design_store.open_design(path) as f:
+                for chunk in iter(lambda: f.read(64 * 1024), ''): yield chunk
+        return Response(stream(), mimetype='text/plain')
+    return send_from_directory(DESIGNS_FOLDER, os.path.basename(path))
 @app.route('/api/designs')
 def list_designs():
     try:
-        files = [f for f in os.listdir(DESIGNS_FOLDER) if f.endswith('.txt') or f.endswith('.thr')]
+        files = design_store.list_designs(DESIGNS_FOLDER)
         results = []
         for f in files:
-            file_path = os.path.join(DESIGNS_FOLDER, f)
-            thumb_name = f.replace('.txt', '.png').replace('.thr', '.png')
+            thumb_name = design_store.thumb_name(f)
             has_thumb = os.path.exists(os.path.join(DESIGNS_FOLDER, thumb_name))
             
-            # Fast line count for time estimation without network roundtrips
+            # Point count from the index (rescanned only when the file changed)
             line_count = 0
-            try:
-                line_count = sum(1 for line in open(file_path, 'r', errors='ignore') if line.strip() and not line.startswith('#'))
+            try: line_count = design_index.get(f)['points']
             except: pass
 
             results.append({
                 "filename": f,
-                "name": f.replace('.txt', '').replace('.thr', ''),
+                "name": design_store.design_stem(f),
                 "thumbnail": thumb_name if has_thumb else None,
                 "lines": line_count
             })
+        design_index.prune(files)
+        design_index.save()
         return jsonify(results)
     except:
         return jsonify([])
+def number_arg(name, cast=float):
+    value = request.args.get(name, "")
+    if value == "": return None
+    try: return cast(value)
+    except ValueError: raise ValueError(f"Invalid value for {name}")
+
+@app.route('/api/designs/search')
+def search_designs():
+    """Paged library search over the index.
+    ?q= name words (substring or fuzzy), min_/max_ points, duration (seconds) and radius (0-1),
+    tags=a,b (all required), sort=name|points|duration|radius|modified|relevance (- for descending),
+    limit, cursor (from the previous page's next_cursor)."""
+    try:
+        limit = min(max(number_arg("limit", int) or 48, 1), 200)
+        page, next_cursor, total = design_index.search(
+            q=request.args.get("q", "").strip(), sort=request.args.get("sort"),
+            cursor=request.args.get("cursor"), limit=limit,
+            min_points=number_arg("min_points", int), max_points=number_arg("max_points", int),
+            min_duration=number_arg("min_duration"), max_duration=number_arg("max_duration"),
+            min_radius=number_arg("min_radius"), max_radius=number_arg("max_radius"),
+            tags=request.args.get("tags"), speed=SYSTEM_SETTINGS.get('speed', 1.0))
+    except ValueError as e:
+        return jsonify(success=False, error=str(e)), 400
+    duplicated = {name for group in design_index.duplicates().values() for name, _, _ in group}
+    results = []
+    for f, e, duration in page:
+        thumb_name = design_store.thumb_name(f)
+        results.append({
+            "filename": f,
+            "name": design_store.design_stem(f),
+            "thumbnail": thumb_name if os.path.exists(os.path.join(DESIGNS_FOLDER, thumb_name)) else None,
+            "lines": e.get('points', 0),
+            "duration": round(duration),
+            "max_rho": e.get('max_rho', 0.0),
+            "tags": e.get('tags', []),
+            "flags": e['analysis'].get('flags', []) if 'analysis' in e else None,
+            "duplicate": f in duplicated,
+            "aliases": e.get('aliases', [])
+        })
+    return jsonify(success=True, results=results, next_cursor=next_cursor, total=total)
+
+@app.route('/api/designs/tags', methods=["GET", "POST"])
+def design_tags():
+    if request.method == "GET":
+        counts = {}
+        for e in design_index.snapshot().values():
+            for t in e.get('tags', []): counts[t] = counts.get(t, 0) + 1
+        return jsonify(success=True, tags=counts)
+    data = request.json or {}
+    try: tags = design_index.set_tags(os.path.basename(data.get("filename", "")), data.get("tags", []))
+    except KeyError: return jsonify(success=False, error="Design not found"), 404
+    design_index.save()
+    return jsonify(success=True, tags=tags)
+
+@app.route('/api/designs/duplicates')
+def design_duplicates():
+    """Identical designs stored under more than one name (same points, whatever the formatting)."""
+    groups = []
+    for h, group in design_index.duplicates().items():
+        groups.append({"hash": h, "keep": group[0][0],
+                       "files": [{"filename": name, "size": size} for name, size, _ in group],
+                       "reclaimable": sum(size for _, size, _ in group[1:])})
+    groups.sort(key=lambda g: -g["reclaimable"])
+    return jsonify(success=True, groups=groups, reclaimable=sum(g["reclaimable"] for g in groups))
+
+@app.route('/api/designs/collapse', methods=["POST"])
+def collapse_duplicates():
+    """Keeps one copy of each duplicated design (or of one group, given its hash) and turns
+    the other names into aliases, so queues, playlists and schedules that use them still play."""
+    data = request.json or {}
+    hashes = [data["hash"]] if data.get("hash") else list(design_index.duplicates())
+    collapsed, freed = [], 0
+    for h in hashes:
+        try: keep, removed, size = design_index.collapse(h, data.get("keep"))
+        except KeyError: return jsonify(success=False, error="No such duplicate group"), 404
+        for table in tables.values(): table.repoint_designs(removed, keep)
+        collapsed.append({"keep": keep, "removed": removed})
+        freed += size
+    design_index.save()
+    journal_wake.set()
+    if collapsed: log_message(f"Collapsed {sum(len(c['removed']) for c in collapsed)} duplicate designs, {freed // 1024} KB freed")
+    return jsonify(success=True, collapsed=collapsed, freed=freed)
+
+@app.route('/api/designs/analysis')
+def design_analysis_route():
+    """Kinematic analysis of a design at the current speed (computed now if the index has none)."""
+    da = get_design_analysis()
+    if not da: return jsonify(success=False, error="numpy not installed"), 501
+    f = os.path.basename(request.args.get("filename", ""))
+    try:
+        if not design_store.is_design(f): raise FileNotFoundError(f)
+        e = design_index.get(f)
+    except OSError: return jsonify(success=False, error="Design not found"), 404
+    analysis = e.get('analysis')
+    if not analysis or analysis.get('version') != da.ANALYSIS_VERSION:
+        analysis = analyze_design(f, e['mtime'])
+        design_index.save()
+    return jsonify(success=True, analysis=da.summarize(analysis, SYSTEM_SETTINGS.get('speed', 1.0)))
+
+@app.route('/api/designs/fix_centre', methods=["POST"])
+def fix_centre_route():
+    """Saves a copy of a design that routes around the centre instead of through it."""
+    da = get_design_analysis()
+    if not da: return jsonify(success=False, error="numpy not installed"), 501
+    data = request.json or {}
+    f = os.path.basename(data.get("filename", ""))
+    path = design_store.resolve_design(DESIGNS_FOLDER, f) if design_store.is_design(f) else None
+    if not path: return jsonify(success=False, error="Design not found"), 404
+    try:
+        clearance = float(data.get("clearance_mm", da.CLEARANCE_MM))
+        if not 1.0 <= clearance <= 20.0: raise ValueError
+    except (TypeError, ValueError):
+        return jsonify(success=False, error="clearance_mm must be between 1 and 20"), 400
+    points, rerouted = da.reroute_centre(da.load_points(path), clearance)
+    if not rerouted:
+        return jsonify(success=True, rerouted=0, filename=f)
+    out = design_store.design_stem(f) + "-centre.thr"
+    try: summary = ingest_design([da.format_lines(points).encode()], out)
+    except ValueError as e: return jsonify(success=False, error=str(e)), 400
+    return jsonify(success=True, rerouted=rerouted, **summary)
+
 @app.route("/terminal/logs")
 def get_logs():
-    with lock: return jsonify(list(serial_log))
+    with log_lock: return jsonify(list(serial_log))
 
 @app.route("/restart_app", methods=["POST"])
 def restart_app():
@@ -955,30 +2418,63 @@ def restart_app():
     threading.Thread(target=restart).start()
     return jsonify(success=True, message="Application is restarting...")
 
+# === STARTUP ===
+startup_times = []
+
+def timed_phase(name, fn):
+    t0 = time.monotonic()
+    try: fn()
+    except Exception as e: log_message(f"Startup phase '{name}' failed: {e}")
+    startup_times.append((name, time.monotonic() - t0))
+
+def start_thumbnailer():
+    tn = get_thumbnailer()
+    if tn:
+        threading.Thread(target=tn.monitor_designs, args=(DESIGNS_FOLDER, twin_thumbnail), daemon=True).start()
+    else:
+        print("Thumbnailer disabled due to missing dependencies.")
+
+def background_startup():
+    """Hardware and optional subsystems come up in parallel while the HTTP server is already serving."""
+    t0 = time.monotonic()
+    def tables_phase():
+        # The journal is keyed by table, so it is restored once the ports are known
+        timed_phase("serial", connect_tables)
+        timed_phase("journal", restore_journal)
+    phases = [
+        (tables_phase, ()),
+        (timed_phase, ("thumbnailer", start_thumbnailer)),
+        (timed_phase, ("wifi_scan", wifi_tools.scanner.start))
+    ]
+    threads = [threading.Thread(target=fn, args=args, daemon=True) for fn, args in phases]
+    for t in threads: t.start()
+    for t in threads: t.join()
+
+    SchedulerThread().start()
+    JournalThread().start()
+    LiveRenderThread().start()
+    LibraryWatcher().start()
+    # Auto-Start Tunnel (Background Thread), it waits for the network on its own
+    threading.Thread(target=auto_start_ngrok_thread, daemon=True).start()
+
+    report = ", ".join(f"{name} {dt * 1000:.0f}ms" for name, dt in startup_times)
+    log_message(f"Startup: imports+config {(t0 - STARTUP_T0) * 1000:.0f}ms, hardware init {(time.monotonic() - t0) * 1000:.0f}ms ({report})")
+    log_message(f"Startup complete in {(time.monotonic() - STARTUP_T0) * 1000:.0f}ms")
+
 if __name__ == "__main__":
     # 1. Determine Port First (5000 -> 6000)
     SERVER_PORT = find_available_port()
     
-    # 2. Connect Hardware & Scheduler
-    connect_arduino() 
-    SchedulerThread().start()
-    
-    # Start Thumbnailer
-    if thumbnailer:
-        threading.Thread(target=thumbnailer.monitor_designs, args=(DESIGNS_FOLDER,), daemon=True).start()
-    else:
-        print("Thumbnailer disabled due to missing dependencies.")
-    
-    # 3. Auto-Start Tunnel (Background Thread)
-    # This runs in background to avoid blocking server start
-    threading.Thread(target=auto_start_ngrok_thread, daemon=True).start()
+    # 2. Hardware, journal, scheduler & tunnel start in the background so the UI is reachable immediately
+    threading.Thread(target=background_startup, daemon=True).start()
     
-    # 4. Start PRODUCTION Server (8 threads)
-    print(f"Starting PRODUCTION server on port {SERVER_PORT}...")
+    # 3. Start PRODUCTION Server
+    threads = int(SYSTEM_SETTINGS.get('server_threads', 8))
+    print(f"Starting PRODUCTION server on port {SERVER_PORT} ({threads} threads)...")
     
     try:
         from waitress import serve
-        serve(app, host="0.0.0.0", port=SERVER_PORT, threads=8)
+        serve(app, host="0.0.0.0", port=SERVER_PORT, threads=threads)
     except ImportError:
         print("Waitress not found. Falling back to Flask Dev Server...")
         app.run(host="0.0.0.0", port=SERVER_PORT, debug=True, use_reloader=False)
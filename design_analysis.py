@@ -0,0 +1,187 @@
+import math
+
+import numpy as np
+
+import kinematics
+import design_store
+from kinematics import TABLE_RADIUS, STEPS_PER_RAD, BASE_STEP_DELAY_US
+from patterns import joint_steps_xy
+
+ANALYSIS_VERSION = 1      # Bump when the metrics change so cached analyses are redone
+INTERPOLATION_MM = 0.2    # interpolationRes in Sand.ino: every line is drawn as 0.2 mm micro-segments
+CENTRE_MM = 1.0           # calculateIK's dist < 1.0 case: the base holds and the elbow folds
+NEAR_CENTRE_MM = 5.0      # Where steps per mm climb steeply
+CLEARANCE_MM = 3.0        # Default radius the centre fix routes around
+ARC_STEP = math.radians(10)
+CHUNK_MICRO = 1_000_000   # Micro-segments per IK batch, bounds memory on very long designs
+# Flag thresholds
+SLOW_FACTOR = 8.0         # A segment needing this many times the median steps per mm is slow...
+SLOW_SHARE_PCT = 10.0     # ...and a design spending this much of its steps on them is flagged
+BASE_SPIN_RAD = math.pi   # One segment turning the base this far
+WINDING_RAD = 1000.0      # Theta span of the design
+
+def load_points(path):
+    """(N, 2) [theta, rho] array of a design file (plain, .gz or .zst)."""
+    with design_store.open_design(path) as f:
+        points = [p for p in map(kinematics.parse_point, f) if p]
+    return np.array(points, dtype=np.float64).reshape(-1, 2)
+
+def _wrap(a):
+    return (a + np.pi) % (2 * np.pi) - np.pi
+
+def _cartesian(data):
+    r = data[:, 1] * TABLE_RADIUS
+    return r * np.cos(data[:, 0]), r * np.sin(data[:, 0])
+
+def segment_clearance(x, y):
+    """Closest approach of each straight segment (point i -> i+1) to the centre, in mm."""
+    x0, y0, dx, dy = x[:-1], y[:-1], np.diff(x), np.diff(y)
+    length2 = dx * dx + dy * dy
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = np.clip(np.where(length2 > 0, -(x0 * dx + y0 * dy) / length2, 0.0), 0.0, 1.0)
+    return np.hypot(x0 + t * dx, y0 + t * dy)
+
+def micro_segments(data):
+    """How the firmware splits each line: ceil(hypot(avgR * |dtheta|, |drho| * R) / 0.2), at least 1,
+    with dtheta wrapped to [-pi, pi]."""
+    theta, rho = data[:, 0], data[:, 1]
+    dtheta = np.abs(_wrap(np.diff(theta)))
+    avg_r = (rho[:-1] + rho[1:]) / 2 * TABLE_RADIUS
+    dist = np.hypot(avg_r * dtheta, np.diff(rho) * TABLE_RADIUS)
+    return np.maximum(np.ceil(dist / INTERPOLATION_MM), 1).astype(np.int64)
+
+def segment_steps(data):
+    """Joint steps per segment as the firmware moves them: the line is interpolated in Cartesian
+    space, every micro-segment goes through IK, and its time is the larger joint's step count.
+    Returns (steps, base steps, elbow steps) per segment; the first entry is the move from the centre."""
+    x, y = _cartesian(data)
+    # Lead-in from the centre (where the table starts) as segment 0
+    x = np.concatenate(([0.0], x)); y = np.concatenate(([0.0], y))
+    n = micro_segments(np.vstack(([0.0, 0.0], data)))
+    steps = np.zeros(len(n)); base = np.zeros(len(n)); elbow = np.zeros(len(n))
+    b_last, e_last = kinematics.calculate_ik(0, 0, 0)
+    start = 0
+    while start < len(n):
+        # Batches of whole segments, roughly CHUNK_MICRO micro-segments each
+        stop = start + max(1, int(np.searchsorted(np.cumsum(n[start:]), CHUNK_MICRO)))
+        counts = n[start:stop]
+        seg = np.repeat(np.arange(start, stop), counts)
+        first = np.cumsum(counts) - counts
+        t = (np.arange(len(seg)) - np.repeat(first, counts) + 1) / np.repeat(counts, counts)
+        mx = x[seg] + (x[seg + 1] - x[seg]) * t
+        my = y[seg] + (y[seg + 1] - y[seg]) * t
+        b, e = joint_steps_xy(mx, my, -b_last / STEPS_PER_RAD)
+        db = np.abs(np.diff(np.round(b), prepend=round(b_last)))
+        de = np.abs(np.diff(np.round(e), prepend=round(e_last)))
+        steps[start:stop] = np.add.reduceat(np.maximum(db, de), first)
+        base[start:stop] = np.add.reduceat(db, first)
+        elbow[start:stop] = np.add.reduceat(de, first)
+        b_last, e_last = b[-1], e[-1]
+        start = stop
+    return steps, base, elbow
+
+def analyze(data):
+    """Speed-independent kinematic metrics for a design; see summarize() for times and rates."""
+    data = np.asarray(data, dtype=np.float64)
+    if len(data) == 0:
+        return {"version": ANALYSIS_VERSION, "points": 0, "steps": 0, "flags": []}
+    steps, base, elbow = segment_steps(data)
+    x, y = _cartesian(data)
+    x = np.concatenate(([0.0], x)); y = np.concatenate(([0.0], y))
+    length = np.hypot(np.diff(x), np.diff(y))
+    clearance = segment_clearance(x, y)[1:]  # The lead-in starts at the centre by definition
+    drawn = steps[1:]
+    # Steps per mm of sand: what the ball's speed is divided by on each segment
+    measurable = length[1:] >= INTERPOLATION_MM
+    spm = drawn[measurable] / length[1:][measurable]
+    median_spm = float(np.median(spm)) if spm.size else 0.0
+    worst = int(np.flatnonzero(measurable)[np.argmax(spm)]) if spm.size else 0
+    peak_spm = float(spm.max()) if spm.size else 0.0
+    slow = np.zeros(len(drawn), dtype=bool)
+    if median_spm: slow[measurable] = spm >= SLOW_FACTOR * median_spm
+    near = clearance < NEAR_CENTRE_MM
+    total = max(1.0, float(drawn.sum()))
+    analysis = {
+        "version": ANALYSIS_VERSION,
+        "points": len(data),
+        "steps": int(steps.sum()),
+        "lead_in_steps": int(steps[0]),
+        "path_mm": round(float(length[1:].sum()), 1),
+        "base_travel_rad": round(float(base.sum()) / STEPS_PER_RAD, 1),
+        "elbow_travel_rad": round(float(elbow.sum()) / STEPS_PER_RAD, 1),
+        "theta_span_rad": round(float(data[:, 0].max() - data[:, 0].min()), 1),
+        "max_segment_steps": int(drawn.max()) if drawn.size else 0,
+        "max_segment_base_rad": round(float(base[1:].max()) / STEPS_PER_RAD, 2) if drawn.size else 0.0,
+        "base_spins": int((base[1:] / STEPS_PER_RAD > BASE_SPIN_RAD).sum()),
+        "centre_crossings": int((clearance < CENTRE_MM).sum()),
+        "near_centre_segments": int(near.sum()),
+        "near_centre_steps_pct": round(100 * float(drawn[near].sum()) / total, 1),
+        "slow_segments": int(slow.sum()),
+        "slow_steps_pct": round(100 * float(drawn[slow].sum()) / total, 1),
+        "median_steps_per_mm": round(median_spm, 2),
+        "peak_steps_per_mm": round(peak_spm, 2),
+        "peak_line": worst + 2,  # Design line the worst segment ends on
+    }
+    flags = []
+    if analysis["centre_crossings"]: flags.append("centre")
+    if analysis["slow_steps_pct"] >= SLOW_SHARE_PCT: flags.append("slow")
+    if analysis["base_spins"]: flags.append("base_spin")
+    if analysis["theta_span_rad"] >= WINDING_RAD: flags.append("winding")
+    analysis["flags"] = flags
+    return analysis
+
+def analyze_file(path):
+    return analyze(load_points(path))
+
+def summarize(analysis, speed=1.0):
+    """Adds the speed-dependent figures: the firmware steps its dominant joint at a fixed rate,
+    so the ball slows wherever a segment needs more steps per mm."""
+    out = dict(analysis)
+    step_rate = 1e6 / (BASE_STEP_DELAY_US / max(0.1, speed))
+    out["duration"] = round(kinematics.steps_to_seconds(analysis.get("steps", 0), speed), 1)
+    out["step_rate"] = round(step_rate)
+    median, peak = analysis.get("median_steps_per_mm"), analysis.get("peak_steps_per_mm")
+    if median and peak:
+        out["median_mm_per_s"] = round(step_rate / median, 1)
+        out["min_mm_per_s"] = round(step_rate / peak, 2)
+        # Step rate the worst segment would need to keep the design's typical ball speed
+        out["peak_required_step_rate"] = round(step_rate * peak / median)
+    return out
+
+def reroute_centre(data, clearance=CLEARANCE_MM):
+    """Moves points inside the clearance circle onto it (along their own theta) and replaces every
+    segment that cuts through the circle with an arc around it, so the arm never folds through
+    the centre. Returns (new (N, 2) array, number of segments rerouted)."""
+    data = np.array(data, dtype=np.float64)
+    if len(data) < 2: return data, 0
+    rho_c = clearance / TABLE_RADIUS
+    data[:, 1] = np.maximum(data[:, 1], rho_c)
+    x, y = _cartesian(data)
+    bad = np.flatnonzero(segment_clearance(x, y) < clearance * (1 - 1e-6))
+    positions, inserts = [], []
+    for i in bad:
+        p0, d = np.array([x[i], y[i]]), np.array([x[i + 1] - x[i], y[i + 1] - y[i]])
+        a = d @ d
+        if a == 0: continue
+        b = p0 @ d
+        root = math.sqrt(max(0.0, b * b - a * (p0 @ p0 - clearance * clearance)))
+        entry = p0 + d * min(max((-b - root) / a, 0.0), 1.0)
+        exit_ = p0 + d * min(max((-b + root) / a, 0.0), 1.0)
+        a_in, a_out = math.atan2(entry[1], entry[0]), math.atan2(exit_[1], exit_[0])
+        sweep = float(_wrap(np.array(a_out - a_in)))
+        if abs(abs(sweep) - math.pi) < 1e-3:
+            # Straight through the middle: go round the side the design is turning towards
+            turning = float(_wrap(np.array(data[i + 1, 0] - data[i, 0])))
+            sweep = math.copysign(math.pi, turning or 1.0)
+        k = max(2, math.ceil(abs(sweep) / ARC_STEP))
+        angles = a_in + sweep * np.arange(k + 1) / k
+        # Continuous theta from the segment's start, like the rest of the design
+        theta = data[i, 0] + np.cumsum(_wrap(np.diff(angles, prepend=data[i, 0])))
+        positions.extend([i + 1] * len(angles))
+        inserts.append(np.column_stack((theta, np.full(len(angles), rho_c))))
+    if inserts:
+        data = np.insert(data, positions, np.vstack(inserts), axis=0)
+    return data, len(inserts)
+
+def format_lines(data):
+    return "".join(f"{theta:.5f} {rho:.5f}\n" for theta, rho in data.tolist())
@@ -0,0 +1,548 @@
+import os
+import io
+import gzip
+import json
+import math
+import zlib
+import codecs
+import base64
+import shutil
+import struct
+import hashlib
+import threading
+
+import kinematics
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+RAW_EXTENSIONS = ('.txt', '.thr')
+COMPRESSED_EXTENSIONS = ('.gz', '.zst')
+INDEX_FILE = '.index.json'
+MAX_INGEST_BYTES = 64 * 1024 * 1024  # Decompressed size limit for uploads
+MAX_TAGS = 20
+SORT_FIELDS = ('name', 'points', 'duration', 'radius', 'modified', 'relevance')
+
+def split_compression(name):
+    """Returns (name without compression suffix, '.gz' / '.zst' / '')."""
+    for ext in COMPRESSED_EXTENSIONS:
+        if name.endswith(ext):
+            return name[:-len(ext)], ext
+    return name, ''
+
+def is_design(name):
+    base, comp = split_compression(name)
+    if comp == '.zst' and zstandard is None:
+        return False
+    return base.endswith(RAW_EXTENSIONS)
+
+def design_stem(name):
+    """'spiral.thr.gz' -> 'spiral' (display name, thumbnail base)."""
+    base, _ = split_compression(name)
+    for ext in RAW_EXTENSIONS:
+        if base.endswith(ext):
+            return base[:-len(ext)]
+    return base
+
+def thumb_name(name):
+    return design_stem(name) + '.png'
+
+def list_designs(folder):
+    return [f for f in os.listdir(folder) if is_design(f)]
+
+def resolve_design(folder, name):
+    """Finds a design by name, falling back to its compressed copy (foo.thr -> foo.thr.gz)."""
+    path = os.path.join(folder, os.path.basename(name))
+    if os.path.exists(path):
+        return path
+    for ext in COMPRESSED_EXTENSIONS:
+        if os.path.exists(path + ext):
+            return path + ext
+    return None
+
+def open_design(path):
+    """Opens a design as a text stream, decompressing .gz / .zst on the fly."""
+    _, comp = split_compression(path)
+    if comp == '.gz':
+        return gzip.open(path, 'rt', errors='ignore')
+    if comp == '.zst':
+        if zstandard is None:
+            raise RuntimeError("zstandard module not installed, cannot read " + os.path.basename(path))
+        raw = open(path, 'rb')
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(raw, closefd=True), errors='ignore')
+    return open(path, 'r', errors='ignore')
+
+def read_design(path):
+    with open_design(path) as f:
+        return f.read()
+
+def normalize_line(line):
+    """Strips '#' / ';' comments and converts 'G1 theta rho' to 'theta rho'. Returns '' for blank lines."""
+    line = line.split('#')[0].split(';')[0].strip()
+    if line[:2].upper() == 'G1':
+        parts = line[2:].split()
+        if len(parts) >= 2:
+            return f"{parts[0]} {parts[1]}"
+    return line
+
+POINT = struct.Struct('<dd')
+
+class ContentHash:
+    """Identity of a design's drawing: a hash of its points, whatever the file's name, number
+    formatting, comments or compression. Repeated points don't change the drawing and are skipped."""
+    def __init__(self):
+        self.h = hashlib.blake2b(digest_size=16)
+        self.last = None
+
+    def add(self, theta, rho):
+        if (theta, rho) == self.last: return
+        self.last = (theta, rho)
+        self.h.update(POINT.pack(theta, rho))
+
+    def hexdigest(self):
+        return self.h.hexdigest()
+
+def text_hash(text):
+    """ContentHash of design text, e.g. a sketch export. None if it has no points."""
+    h = ContentHash()
+    for line in text.split('\n'):
+        p = kinematics.parse_point(line)
+        if p: h.add(*p)
+    return h.hexdigest() if h.last else None
+
+def link_or_copy(src, dst):
+    """Hard link (one copy on the SD card), or a copy where the filesystem can't link."""
+    tmp = dst + '.tmp'
+    try:
+        if os.path.exists(tmp): os.remove(tmp)
+        os.link(src, tmp)
+    except OSError:
+        shutil.copy2(src, tmp)
+    os.replace(tmp, dst)
+
+class PathStats:
+    """Single-pass summary of a design: point count, radius bounds, joint steps for estimates and content hash."""
+    def __init__(self):
+        self.content = ContentHash()
+        self.points = 0
+        self.min_rho = None
+        self.max_rho = 0.0
+        self.steps = 0.0
+        self.last_b, self.last_e = kinematics.calculate_ik(0, 0, 0)
+
+    def add(self, theta, rho):
+        self.content.add(theta, rho)
+        self.points += 1
+        self.min_rho = rho if self.min_rho is None else min(self.min_rho, rho)
+        self.max_rho = max(self.max_rho, rho)
+        x = rho * kinematics.TABLE_RADIUS * math.cos(theta)
+        y = rho * kinematics.TABLE_RADIUS * math.sin(theta)
+        b, e = kinematics.calculate_ik(x, y, self.last_b)
+        self.steps += max(abs(b - self.last_b), abs(e - self.last_e))
+        self.last_b, self.last_e = b, e
+
+    def entry(self):
+        return {
+            "points": self.points,
+            "min_rho": round(self.min_rho or 0.0, 4),
+            "max_rho": round(self.max_rho, 4),
+            "steps": int(self.steps),
+            "hash": self.content.hexdigest()
+        }
+
+def match_score(query, text):
+    """Scores how well each word of the query matches the text; None if any word misses.
+    Substrings score highest (earlier is better), then in-order fuzzy matches with few gaps."""
+    text = text.lower()
+    total = 0
+    for word in query.lower().split():
+        pos = text.find(word)
+        if pos >= 0:
+            total += 100 - min(pos, 50)
+            continue
+        # Fuzzy: every character of the word in order, e.g. 'sprl' -> 'spiral'
+        gaps, i = 0, -1
+        for ch in word:
+            j = text.find(ch, i + 1)
+            if j < 0: return None
+            if i >= 0: gaps += j - i - 1
+            i = j
+        total += max(1, 40 - gaps * 2)
+    return total
+
+def clean_tags(tags):
+    if isinstance(tags, str): tags = tags.split(',')
+    out = []
+    for t in tags or []:
+        t = str(t).strip().lower()[:32]
+        if t and t not in out: out.append(t)
+    return out[:MAX_TAGS]
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return [key[0], key[1]]
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def scan_design(path):
+    stats = PathStats()
+    with open_design(path) as f:
+        for line in f:
+            p = kinematics.parse_point(line)
+            if p: stats.add(*p)
+    return stats
+
+class DesignIndex:
+    """Per-design stats cached in DESIGNS_FOLDER/.index.json, refreshed when a file's mtime/size changes."""
+    def __init__(self, folder):
+        self.folder = folder
+        self.path = os.path.join(folder, INDEX_FILE)
+        self.lock = threading.Lock()
+        self.dirty = False
+        try:
+            with open(self.path, 'r') as f: self.entries = json.load(f)
+        except Exception:
+            self.entries = {}
+        self.by_hash = {}  # content hash -> {name: None}, in insertion order; kept in step with entries
+        for name, e in self.entries.items(): self.index_hash(name, e)
+
+    def index_hash(self, name, e):
+        if e.get('hash'): self.by_hash.setdefault(e['hash'], {})[name] = None
+
+    def unindex_hash(self, name, e):
+        names = self.by_hash.get(e.get('hash'))
+        if names is None: return
+        names.pop(name, None)
+        if not names: del self.by_hash[e['hash']]
+
+    def pop_entry(self, name):
+        e = self.entries.pop(name, None)
+        if e is not None: self.unindex_hash(name, e)
+        return e
+
+    @staticmethod
+    def fresh(e, st):
+        # Entries from before content hashing are rescanned once
+        return e and e.get('mtime') == st.st_mtime and e.get('size') == st.st_size and 'hash' in e
+
+    def get(self, name):
+        st = os.stat(os.path.join(self.folder, name))
+        with self.lock:
+            e = self.entries.get(name)
+        if self.fresh(e, st):
+            return e
+        return self.put(name, scan_design(os.path.join(self.folder, name)), st)
+
+    def put(self, name, stats, st=None):
+        st = st or os.stat(os.path.join(self.folder, name))
+        e = dict(stats.entry(), mtime=st.st_mtime, size=st.st_size)
+        with self.lock:
+            old = self.entries.get(name, {})
+            for key in ('tags', 'aliases'):
+                if old.get(key): e[key] = old[key]  # The user's, they survive a rescan
+            # Same drawing as a design already analyzed: share its analysis instead of redoing it
+            twin = next((t for t in (self.entries[n] for n in self.by_hash.get(e['hash'], ()) if n != name)
+                         if 'analysis' in t), None)
+            if twin: e['analysis'] = twin['analysis']
+            self.unindex_hash(name, old)
+            self.entries[name] = e
+            self.index_hash(name, e)
+            self.dirty = True
+        return e
+
+    def remove(self, name):
+        with self.lock:
+            if self.pop_entry(name) is not None: self.dirty = True
+
+    def prune(self, names):
+        keep = set(names)
+        with self.lock:
+            for name in [n for n in self.entries if n not in keep]:
+                self.pop_entry(name)
+                self.dirty = True
+
+    def set_tags(self, name, tags):
+        with self.lock:
+            e = self.entries.get(name)
+            if e is None: raise KeyError(name)
+            e['tags'] = clean_tags(tags)
+            self.dirty = True
+            return e['tags']
+
+    def set_analysis(self, name, analysis, mtime):
+        """Stores a kinematic analysis, unless the design changed while it was being computed.
+        Identical designs get the same analysis."""
+        with self.lock:
+            e = self.entries.get(name)
+            if e is None or e.get('mtime') != mtime: return False
+            e['analysis'] = analysis
+            for n in self.by_hash.get(e.get('hash'), ()): self.entries[n]['analysis'] = analysis
+            self.dirty = True
+            return True
+
+    def twins(self, name):
+        """Other designs with the same content."""
+        with self.lock:
+            h = self.entries.get(name, {}).get('hash')
+            return [n for n in self.by_hash.get(h, ()) if n != name]
+
+    def find_hash(self, h):
+        with self.lock:
+            return next(iter(self.by_hash.get(h, ())), None)
+
+    def alias_of(self, name):
+        """The design a collapsed duplicate's name now points to, or None."""
+        with self.lock:
+            return next((n for n, e in self.entries.items() if name in e.get('aliases', ())), None)
+
+    def duplicates(self):
+        """Groups of identical designs, each [(name, size, mtime)] with the one to keep first:
+        the smallest file (compressed copies win), then the oldest."""
+        groups = {}
+        with self.lock:
+            for name, e in self.entries.items():
+                if e.get('hash'): groups.setdefault(e['hash'], []).append((name, e.get('size', 0), e.get('mtime', 0)))
+        return {h: sorted(g, key=lambda f: (f[1], f[2], f[0])) for h, g in groups.items() if len(g) > 1}
+
+    def collapse(self, h, keep=None):
+        """Deletes every copy of a duplicated design but one; the other names become aliases of
+        the kept file and their tags are merged into it. Returns (kept, removed names, bytes freed)."""
+        group = self.duplicates().get(h)
+        if not group: raise KeyError(h)
+        names = [f[0] for f in group]
+        keep = keep if keep in names else names[0]
+        keep_thumb = os.path.join(self.folder, thumb_name(keep))
+        removed, freed = [], 0
+        for name, size, _ in group:
+            if name == keep: continue
+            thumb = os.path.join(self.folder, thumb_name(name))
+            if os.path.exists(thumb) and not os.path.exists(keep_thumb):
+                link_or_copy(thumb, keep_thumb)
+            try:
+                os.remove(os.path.join(self.folder, name))
+                freed += size
+            except FileNotFoundError:
+                pass
+            if design_stem(name) != design_stem(keep) and os.path.exists(thumb):
+                freed += os.path.getsize(thumb) if os.stat(thumb).st_nlink == 1 else 0
+                os.remove(thumb)
+            removed.append(name)
+        with self.lock:
+            kept = self.entries[keep]
+            aliases, tags = list(kept.get('aliases', [])), list(kept.get('tags', []))
+            for name in removed:
+                e = self.pop_entry(name) or {}
+                aliases += [name] + e.get('aliases', [])
+                tags += e.get('tags', [])
+            kept['aliases'] = sorted(set(aliases) - {keep})
+            if tags: kept['tags'] = clean_tags(tags)
+            self.dirty = True
+        return keep, removed, freed
+
+    def unanalyzed(self, version):
+        """Designs without an analysis of the given version, with the mtime it must match."""
+        with self.lock:
+            return [(name, e.get('mtime')) for name, e in self.entries.items()
+                    if e.get('analysis', {}).get('version') != version]
+
+    def refresh(self):
+        """Brings the index in line with the folder: rescans new or changed designs, drops deleted ones.
+        Returns the number of entries that changed."""
+        names = list_designs(self.folder)
+        changed = 0
+        for name in names:
+            try:
+                st = os.stat(os.path.join(self.folder, name))
+                with self.lock:
+                    e = self.entries.get(name)
+                if self.fresh(e, st): continue
+                self.put(name, scan_design(os.path.join(self.folder, name)), st)
+                changed += 1
+            except Exception:
+                continue  # Deleted mid-scan or unreadable; picked up on the next pass
+        with self.lock:
+            before = len(self.entries)
+        self.prune(names)
+        with self.lock:
+            changed += before - len(self.entries)
+        self.save()
+        return changed
+
+    def snapshot(self):
+        with self.lock:
+            return {name: dict(e) for name, e in self.entries.items()}
+
+    def search(self, q='', sort=None, cursor=None, limit=48, min_points=None, max_points=None,
+               min_duration=None, max_duration=None, min_radius=None, max_radius=None, tags=None, speed=1.0):
+        """Filters, sorts and pages the index without touching the designs themselves.
+
+        sort is one of SORT_FIELDS, '-' prefixed for descending; the default is relevance when
+        there is a query and name otherwise. The cursor is the sort key of the last result
+        returned, so pages stay consistent while designs are added or removed.
+        Returns (page of (filename, entry, duration), next cursor or None, total matches)."""
+        sort = sort or ('relevance' if q else 'name')
+        desc = sort.startswith('-')
+        field = sort.lstrip('-')
+        if field not in SORT_FIELDS: raise ValueError(f"Unknown sort: {sort}")
+        want_tags = set(clean_tags(tags))
+        matches = []
+        with self.lock:
+            items = list(self.entries.items())
+        for name, e in items:
+            score = 0
+            if q:
+                score = match_score(q, design_stem(name))
+                if score is None: continue
+            duration = kinematics.steps_to_seconds(e.get('steps', 0), speed)
+            points = e.get('points', 0)
+            radius = e.get('max_rho', 0.0)
+            if min_points is not None and points < min_points: continue
+            if max_points is not None and points > max_points: continue
+            if min_duration is not None and duration < min_duration: continue
+            if max_duration is not None and duration > max_duration: continue
+            if min_radius is not None and radius < min_radius: continue
+            if max_radius is not None and radius > max_radius: continue
+            if want_tags and not want_tags.issubset(e.get('tags', ())): continue
+            value = {'name': design_stem(name).lower(), 'points': points, 'duration': duration,
+                     'radius': radius, 'modified': e.get('mtime', 0), 'relevance': -score}[field]
+            matches.append(([value, name], name, e, duration))
+        matches.sort(key=lambda m: m[0], reverse=desc)
+
+        start = 0
+        if cursor:
+            after = decode_cursor(cursor)
+            try:
+                start = next(i for i, m in enumerate(matches) if (m[0] < after if desc else m[0] > after))
+            except StopIteration:
+                start = len(matches)
+            except TypeError:
+                raise ValueError("Cursor does not match the sort order")
+        page = matches[start:start + limit]
+        more = start + limit < len(matches)
+        return ([(name, e, duration) for _, name, e, duration in page],
+                encode_cursor(page[-1][0]) if more else None, len(matches))
+
+    def save(self):
+        with self.lock:
+            if not self.dirty: return
+            data = json.dumps(self.entries)
+            self.dirty = False
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f: f.write(data)
+        os.replace(tmp, self.path)
+
+def ingest(chunks, folder, filename, gzip_input=False, on_point=None, max_bytes=MAX_INGEST_BYTES):
+    """Streams raw (or gzip'd) design bytes into the library.
+
+    Points are validated and normalised as chunks arrive: comments and blank lines are dropped,
+    as are consecutive duplicate points. The file is written to a temp name and renamed into
+    place only if the whole upload is valid. Returns (PathStats, report dict); raises ValueError.
+    """
+    out_path = os.path.join(folder, os.path.basename(filename))
+    tmp = out_path + '.part'
+    inflater = zlib.decompressobj(16 + zlib.MAX_WBITS) if gzip_input else None
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+    stats = PathStats()
+    report = {"bytes_in": 0, "bytes_text": 0, "lines": 0, "comments": 0, "duplicates": 0, "invalid": 0}
+    last = [None]
+
+    def handle(line, out):
+        report["lines"] += 1
+        norm = normalize_line(line)
+        if not norm:
+            if '#' in line or ';' in line: report["comments"] += 1
+            return
+        parts = norm.split()
+        try:
+            theta, rho = float(parts[0]), float(parts[1])
+        except (ValueError, IndexError):
+            report["invalid"] += 1
+            return
+        if not (math.isfinite(theta) and math.isfinite(rho)) or rho < 0.0 or rho > 1.0:
+            report["invalid"] += 1
+            return
+        if last[0] == (theta, rho):
+            report["duplicates"] += 1
+            return
+        last[0] = (theta, rho)
+        out.write(f"{parts[0]} {parts[1]}\n")
+        stats.add(theta, rho)
+        if on_point: on_point(theta, rho)
+
+    def feed(data, out, pending):
+        report["bytes_text"] += len(data)
+        if report["bytes_text"] > max_bytes:
+            raise ValueError(f"Design larger than {max_bytes // (1024 * 1024)} MB")
+        lines = (pending + decoder.decode(data)).split('\n')
+        for line in lines[:-1]: handle(line, out)
+        return lines[-1]
+
+    try:
+        with (gzip.open(tmp, 'wt') if out_path.endswith('.gz') else open(tmp, 'w')) as out:
+            pending = ''
+            for chunk in chunks:
+                report["bytes_in"] += len(chunk)
+                try:
+                    data = inflater.decompress(chunk) if inflater else chunk
+                except zlib.error as e:
+                    raise ValueError(f"Bad gzip data: {e}")
+                pending = feed(data, out, pending)
+            if inflater: pending = feed(inflater.flush(), out, pending)
+            pending += decoder.decode(b'', final=True)
+            if pending.strip(): handle(pending, out)
+        if stats.points == 0:
+            raise ValueError("No valid theta/rho points")
+        os.replace(tmp, out_path)
+    finally:
+        if os.path.exists(tmp): os.remove(tmp)
+    return stats, report
+
+def compress_design(path, fmt='.gz', remove_original=True):
+    """Stream-compresses a raw design next to itself. Returns the new path."""
+    out_path = path + fmt
+    tmp = out_path + '.tmp'
+    with open(path, 'rb') as src:
+        if fmt == '.gz':
+            with gzip.open(tmp, 'wb', compresslevel=9) as dst:
+                shutil.copyfileobj(src, dst, 64 * 1024)
+        elif fmt == '.zst':
+            if zstandard is None:
+                raise RuntimeError("zstandard module not installed")
+            with open(tmp, 'wb') as dst:
+                zstandard.ZstdCompressor(level=19).copy_stream(src, dst)
+        else:
+            raise ValueError(f"Unknown format {fmt}")
+    shutil.copystat(path, tmp)
+    os.replace(tmp, out_path)
+    if remove_original:
+        os.remove(path)
+    return out_path
+
+def migrate_library(folder, fmt='.gz'):
+    """Compresses every raw design in the folder. Thumbnails keep working (same stem)."""
+    saved = 0
+    count = 0
+    for name in sorted(os.listdir(folder)):
+        path = os.path.join(folder, name)
+        if not name.endswith(RAW_EXTENSIONS) or not os.path.isfile(path):
+            continue
+        before = os.path.getsize(path)
+        out = compress_design(path, fmt)
+        saved += before - os.path.getsize(out)
+        count += 1
+        print(f"{name} -> {os.path.basename(out)} ({before} -> {os.path.getsize(out)} bytes)")
+    print(f"Compressed {count} designs, saved {saved / 1024:.1f} KB")
+
+if __name__ == "__main__":
+    import sys
+    # Usage: python design_store.py compress <designs_folder> [--zst]
+    if len(sys.argv) > 2 and sys.argv[1] == "compress":
+        migrate_library(sys.argv[2], '.zst' if '--zst' in sys.argv else '.gz')
+    else:
+        print("Usage: python design_store.py compress <designs_folder> [--zst]")
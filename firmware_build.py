@@ -0,0 +1,85 @@
+import os
+import shutil
+import hashlib
+import subprocess
+
+SOURCE_EXTENSIONS = ('.ino', '.h', '.hpp', '.c', '.cpp', '.S')
+KEEP_BUILDS = 5  # Cached hex files kept per sketch (newest first)
+
+def toolchain_version():
+    """arduino-cli's version string; part of the build key so a toolchain upgrade forces a rebuild."""
+    r = subprocess.run(["arduino-cli", "version"], capture_output=True, text=True, timeout=30)
+    return r.stdout.strip()
+
+def source_files(sketch_path, skip_dir):
+    """Relative paths of every sketch source file, sorted so the hash is stable."""
+    found = []
+    for root, dirs, files in os.walk(sketch_path):
+        dirs[:] = [d for d in dirs if not d.startswith('.') and os.path.join(root, d) != skip_dir]
+        for f in files:
+            if f.endswith(SOURCE_EXTENSIONS):
+                found.append(os.path.relpath(os.path.join(root, f), sketch_path))
+    return sorted(found)
+
+def build_key(sketch_path, fqbn, toolchain, skip_dir=None):
+    h = hashlib.sha256()
+    h.update(fqbn.encode() + b'\0' + toolchain.encode() + b'\0')
+    for rel in source_files(sketch_path, skip_dir):
+        h.update(rel.encode() + b'\0')
+        with open(os.path.join(sketch_path, rel), 'rb') as f: h.update(f.read())
+        h.update(b'\0')
+    return h.hexdigest()[:16]
+
+class FirmwareBuilder:
+    """Content-addressed firmware builds.
+    Hex files are cached under build/hex/<key>.hex, where the key hashes the sketch sources,
+    FQBN and toolchain version: an unchanged sketch is never recompiled. A changed one reuses
+    arduino-cli's persistent --build-path, so only the files that changed are rebuilt."""
+    def __init__(self, sketch_path, fqbn, log=print):
+        self.sketch_path = os.path.normpath(sketch_path)
+        self.fqbn = fqbn
+        self.log = log
+        self.build_root = os.path.join(self.sketch_path, 'build')
+        self.work_path = os.path.join(self.build_root, 'work')  # Object files, kept between builds
+        self.out_path = os.path.join(self.build_root, 'out')
+        self.cache_path = os.path.join(self.build_root, 'hex')
+
+    def key(self):
+        return build_key(self.sketch_path, self.fqbn, toolchain_version(), skip_dir=self.build_root)
+
+    def build(self):
+        """Returns the path of a hex file for the current sources, compiling only on a cache miss."""
+        key = self.key()
+        hex_file = os.path.join(self.cache_path, f"{key}.hex")
+        if os.path.exists(hex_file):
+            os.utime(hex_file)  # Keep recently used builds out of pruning
+            self.log(f"Firmware unchanged (build {key}), using cached hex")
+            return hex_file
+
+        self.log(f"Compiling firmware (build {key})...")
+        for d in (self.work_path, self.out_path, self.cache_path): os.makedirs(d, exist_ok=True)
+        proc = subprocess.Popen(
+            ["arduino-cli", "compile", "--fqbn", self.fqbn, "--build-path", self.work_path,
+             "--output-dir", self.out_path, self.sketch_path],
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1
+        )
+        # Stream compiler output to the log as it arrives
+        for line in proc.stdout:
+            line = line.rstrip()
+            if line: self.log(f"Compile: {line}")
+        if proc.wait() != 0:
+            raise RuntimeError(f"arduino-cli compile failed (exit {proc.returncode})")
+
+        built = os.path.join(self.out_path, os.path.basename(self.sketch_path) + ".ino.hex")
+        tmp = hex_file + ".tmp"
+        shutil.copyfile(built, tmp)
+        os.replace(tmp, hex_file)
+        self.prune()
+        return hex_file
+
+    def prune(self):
+        hexes = [os.path.join(self.cache_path, f) for f in os.listdir(self.cache_path) if f.endswith('.hex')]
+        hexes.sort(key=os.path.getmtime, reverse=True)
+        for path in hexes[KEEP_BUILDS:]:
+            try: os.remove(path)
+            except OSError: pass
@@ -0,0 +1,67 @@
+import math
+
+# Machine Constants (matching Sand.ino and designs.html)
+TABLE_RADIUS = 202.6
+L1 = 101.3
+L2 = 101.3
+GEAR_RATIO = 1.209
+STEPS_PER_RAD = (3200.0 / 360.0) * (180.0 / math.pi)
+BASE_STEP_DELAY_US = 1000  # minStepDelay in Sand.ino at SPEED 1.0
+
+def calculate_ik(x, y, last_b):
+    dist = math.hypot(x, y)
+    max_reach = L1 + L2
+    if dist > max_reach:
+        x *= (max_reach / dist)
+        y *= (max_reach / dist)
+        dist = max_reach
+    
+    if dist < 1.0:
+        return last_b, -(math.pi - GEAR_RATIO * last_b / STEPS_PER_RAD) * STEPS_PER_RAD
+    
+    cos_bend = (dist * dist - L1 * L1 - L2 * L2) / (2.0 * L1 * L2)
+    bend = math.acos(max(-1.0, min(1.0, cos_bend)))
+    t1 = math.atan2(y, x) - math.atan2(L2 * math.sin(bend), L1 + L2 * math.cos(bend))
+    
+    last_t1 = -last_b / STEPS_PER_RAD
+    t1 = t1 - (round((t1 - last_t1) / (2.0 * math.pi)) * 2.0 * math.pi)
+    
+    return -t1 * STEPS_PER_RAD, -(bend + GEAR_RATIO * t1) * STEPS_PER_RAD
+
+def get_xy(b, e):
+    t1 = -b / STEPS_PER_RAD
+    bend = -e / STEPS_PER_RAD - GEAR_RATIO * t1
+    x = L1 * math.cos(t1) + L2 * math.cos(t1 + bend)
+    y = L1 * math.sin(t1) + L2 * math.sin(t1 + bend)
+    return x, y
+
+def parse_point(line):
+    """Parses 'theta rho' or 'G1 theta rho'. Returns (theta, rho) or None."""
+    line = line.split('#')[0].split(';')[0].strip()
+    if not line:
+        return None
+    try:
+        if line.upper().startswith('G1'):
+            parts = line[2:].strip().split()
+        else:
+            parts = line.split()
+        if len(parts) < 2:
+            return None
+        return float(parts[0]), float(parts[1])
+    except ValueError:
+        return None
+
+def steps_to_seconds(steps, speed=1.0):
+    return steps * (BASE_STEP_DELAY_US / max(0.1, speed)) / 1e6
+
+def estimate_seconds(points, speed=1.0):
+    """Rough draw time: dominant joint steps between points at the firmware step delay."""
+    steps = 0.0
+    last_b, last_e = calculate_ik(0, 0, 0)
+    for theta, rho in points:
+        x = rho * TABLE_RADIUS * math.cos(theta)
+        y = rho * TABLE_RADIUS * math.sin(theta)
+        b, e = calculate_ik(x, y, last_b)
+        steps += max(abs(b - last_b), abs(e - last_e))
+        last_b, last_e = b, e
+    return steps_to_seconds(steps, speed)
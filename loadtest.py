@@ -0,0 +1,290 @@
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import threading
+import http.client
+from collections import deque
+
+import kinematics
+
+# Polling patterns of the pages, taken from the templates: (route, interval in seconds)
+PROFILES = {
+    "designs": {"load": ["/", "/api/settings", "/api/designs/search?limit=48", "/api/designs/tags"],
+                "poll": [("/status_full", 3.0)]},
+    "controller": {"load": ["/controller"], "poll": [("/status_full", 3.0)]},
+    "terminal": {"load": ["/terminal"], "poll": [("/terminal/logs", 2.0)]},
+    "settings": {"load": ["/settings", "/api/settings", "/api/designs"], "poll": [("/api/tunnel", 5.0)]},
+}
+PROFILE_WEIGHTS = {"designs": 4, "controller": 2, "terminal": 1, "settings": 1}
+SAMPLE_INTERVAL = 0.02  # Waitress dispatcher sampling
+
+class LoopbackSerial:
+    """Serial stand-in that queues like Sand.ino: 'OK' when a point enters the 32-deep command
+    queue (held back while it is full), one point drawn every line_time seconds, and SYNC
+    answered once the queue has drained. Records when each point arrived and how long the
+    host took to send the next line after an 'OK' (its turnaround)."""
+    QUEUE = 32
+
+    def __init__(self, line_time):
+        self.line_time = line_time
+        self.cond = threading.Condition()
+        self.out = deque()
+        self.queued = 0
+        self.pending = False
+        self.owes_sync = False
+        self.last_ok = None
+        self.received = []    # (time, turnaround since the last OK or None)
+        self.baudrate = 250000
+        self.timeout = 0.1
+        self.is_open = True
+        threading.Thread(target=self.motion, daemon=True).start()
+
+    def ack(self):
+        self.out.append(b"OK\r\n")
+        self.last_ok = time.monotonic()
+        self.cond.notify_all()
+
+    def write(self, data):
+        now = time.monotonic()
+        with self.cond:
+            for line in bytes(data).decode(errors="ignore").split("\n"):
+                line = line.strip()
+                if not line: continue
+                if line == "SYNC":
+                    self.owes_sync = True
+                elif kinematics.parse_point(line):
+                    self.received.append((now, now - self.last_ok if self.last_ok else None))
+                    self.last_ok = None
+                    if self.queued < self.QUEUE:
+                        self.queued += 1
+                        self.ack()
+                    else:
+                        self.pending = True
+        return len(data)
+
+    def motion(self):
+        while self.is_open:
+            time.sleep(self.line_time)
+            with self.cond:
+                if self.queued: self.queued -= 1
+                if self.pending and self.queued < self.QUEUE:
+                    self.queued += 1
+                    self.pending = False
+                    self.ack()
+                if self.owes_sync and not self.queued and not self.pending:
+                    self.owes_sync = False
+                    self.ack()
+
+    @property
+    def in_waiting(self):
+        with self.cond: return len(self.out)
+
+    def readline(self):
+        with self.cond:
+            if not self.out: self.cond.wait(self.timeout)
+            return self.out.popleft() if self.out else b""
+
+    def reset_input_buffer(self): pass
+    def flush(self): pass
+
+    def close(self):
+        self.is_open = False
+
+def percentile(values, p):
+    if not values: return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+class Client(threading.Thread):
+    """One phone: loads its page once, then polls like the page's setInterval timers do.
+    Uses one keep-alive connection, as a browser would."""
+    def __init__(self, port, profile, results, stop):
+        super().__init__(daemon=True)
+        self.port = port
+        self.profile = profile
+        self.results = results
+        self.stop = stop
+        self.conn = None
+
+    def get(self, path):
+        route = path.split("?")[0]
+        t0 = time.monotonic()
+        status = 0
+        try:
+            if self.conn is None: self.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+            self.conn.request("GET", path, headers={"Accept-Encoding": "gzip"})
+            resp = self.conn.getresponse()
+            resp.read()
+            status = resp.status
+            if resp.getheader("Connection", "").lower() == "close": self.conn = None
+        except Exception:
+            self.conn = None
+        self.results.append((t0, route, time.monotonic() - t0, status))
+
+    def run(self):
+        spec = PROFILES[self.profile]
+        self.stop.wait(random.uniform(0, 2))  # Phones don't open the page in lockstep
+        for path in spec["load"]:
+            if self.stop.is_set(): return
+            self.get(path)
+        due = [(time.monotonic() + random.uniform(0, interval), path, interval) for path, interval in spec["poll"]]
+        while not self.stop.is_set():
+            due.sort()
+            at, path, interval = due[0]
+            if self.stop.wait(max(0.0, at - time.monotonic())): return
+            self.get(path)
+            # setInterval fires on schedule whether or not the previous request is still running;
+            # a single client thread approximates it by never falling more than one interval behind
+            due[0] = (max(at + interval, time.monotonic()), path, interval)
+
+class DispatcherSampler(threading.Thread):
+    """Samples waitress's task dispatcher: busy worker threads and requests waiting for one."""
+    def __init__(self, dispatcher, threads):
+        super().__init__(daemon=True)
+        self.dispatcher = dispatcher
+        self.threads = threads
+        self.samples = []
+        self.stop = threading.Event()
+
+    def run(self):
+        while not self.stop.wait(SAMPLE_INTERVAL):
+            busy = getattr(self.dispatcher, "active_count", 0)
+            waiting = len(getattr(self.dispatcher, "queue", ()))
+            self.samples.append((time.monotonic(), busy, waiting))
+
+def spiral_design(points):
+    turns = points / 360
+    return "\n".join(f"{2 * math.pi * turns * i / points:.4f} {i / points:.4f}" for i in range(points))
+
+def serial_stats(received, start, end):
+    window = [(t, turn) for t, turn in received if start <= t < end]
+    turns = [turn for _, turn in window if turn is not None]
+    return {
+        "lines_per_s": round(len(window) / (end - start), 1) if end > start else 0.0,
+        "turnaround_p50_ms": round(percentile(turns, 50) * 1000, 1),
+        "turnaround_p99_ms": round(percentile(turns, 99) * 1000, 1),
+    }
+
+def run(clients=10, threads=8, duration=30.0, warmup=10.0, sse=0, line_time=0.004, seed=1):
+    random.seed(seed)
+    try:
+        from waitress.server import create_server
+    except ImportError:
+        sys.exit("waitress is required: pip install waitress")
+    import app
+
+    # A table on the loopback port, drawing a long spiral for the whole run
+    port = LoopbackSerial(line_time)
+    table = app.TableController("loopback")
+    table.arduino = port
+    table.calibration_done = True
+    app.tables[table.id] = table
+    table.start()
+    app.LiveRenderThread().start()
+    design = spiral_design(20000)
+    stop = threading.Event()
+    def keep_drawing():
+        while not stop.is_set():
+            if not table.is_busy():
+                table.submit_job({"filename": "loadtest.thr", "gcode": design})
+            stop.wait(0.5)
+    threading.Thread(target=keep_drawing, daemon=True).start()
+
+    server = create_server(app.app, host="127.0.0.1", port=0, threads=threads)
+    http_port = server.effective_port
+    threading.Thread(target=server.run, daemon=True).start()
+    sampler = DispatcherSampler(server.task_dispatcher, threads)
+    sampler.start()
+
+    print(f"Baseline: {warmup:.0f}s streaming with no clients (threads={threads}, line_time={line_time * 1000:g}ms)")
+    t_base = time.monotonic()
+    time.sleep(warmup)
+    t_load = time.monotonic()
+
+    print(f"Load: {clients} clients ({sse} with a live-view event stream) for {duration:.0f}s")
+    results = []
+    profiles = random.choices(list(PROFILE_WEIGHTS), weights=list(PROFILE_WEIGHTS.values()), k=clients)
+    workers = [Client(http_port, p, results, stop) for p in profiles]
+    streams = [threading.Thread(target=hold_event_stream, args=(http_port, stop, table.id), daemon=True) for _ in range(sse)]
+    for w in workers + streams: w.start()
+    time.sleep(duration)
+    t_end = time.monotonic()
+    stop.set()
+    sampler.stop.set()
+    table.connected = False
+    port.close()
+
+    routes = {}
+    for t, route, latency, status in results:
+        if t < t_load: continue
+        r = routes.setdefault(route, {"latencies": [], "errors": 0})
+        r["latencies"].append(latency)
+        if status != 200: r["errors"] += 1
+    report = {
+        "config": {"clients": clients, "threads": threads, "duration": duration, "sse": sse,
+                   "profiles": {p: profiles.count(p) for p in PROFILE_WEIGHTS}},
+        "routes": {route: {
+            "count": len(r["latencies"]),
+            "errors": r["errors"],
+            "p50_ms": round(percentile(r["latencies"], 50) * 1000, 1),
+            "p95_ms": round(percentile(r["latencies"], 95) * 1000, 1),
+            "p99_ms": round(percentile(r["latencies"], 99) * 1000, 1),
+            "max_ms": round(max(r["latencies"]) * 1000, 1),
+        } for route, r in sorted(routes.items())},
+        "serial": {"baseline": serial_stats(port.received, t_base, t_load),
+                   "load": serial_stats(port.received, t_load, t_end)},
+    }
+    samples = [s for s in sampler.samples if s[0] >= t_load]
+    if samples:
+        report["threads"] = {
+            "busy_mean": round(sum(s[1] for s in samples) / len(samples), 2),
+            "saturated_pct": round(100 * sum(1 for s in samples if s[1] >= threads) / len(samples), 1),
+            "queued_mean": round(sum(s[2] for s in samples) / len(samples), 2),
+            "queued_max": max(s[2] for s in samples),
+        }
+    return report
+
+def hold_event_stream(port, stop, table_id):
+    """A designs page with the live view open: keeps /api/events open (one worker thread each)."""
+    while not stop.is_set():
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            conn.request("GET", f"/api/events?table={table_id}")
+            resp = conn.getresponse()
+            while not stop.is_set() and resp.readline(): pass
+            conn.close()
+        except Exception:
+            stop.wait(1)
+
+def print_report(report):
+    c = report["config"]
+    print(f"\n{c['clients']} clients {c['profiles']}, threads={c['threads']}, {c['duration']:.0f}s\n")
+    print(f"{'route':<24}{'count':>7}{'err':>5}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}  (ms)")
+    for route, r in report["routes"].items():
+        print(f"{route:<24}{r['count']:>7}{r['errors']:>5}{r['p50_ms']:>9}{r['p95_ms']:>9}{r['p99_ms']:>9}{r['max_ms']:>9}")
+    t = report.get("threads")
+    if t:
+        print(f"\nWorker threads: {t['busy_mean']} busy on average, all {c['threads']} busy {t['saturated_pct']}% of the time, "
+              f"requests waiting for a thread: mean {t['queued_mean']}, max {t['queued_max']}")
+    base, load = report["serial"]["baseline"], report["serial"]["load"]
+    drop = 100 * (1 - load["lines_per_s"] / base["lines_per_s"]) if base["lines_per_s"] else 0.0
+    print(f"Serial: {base['lines_per_s']} lines/s idle -> {load['lines_per_s']} under load ({drop:+.1f}% drop), "
+          f"ack turnaround p50 {base['turnaround_p50_ms']} -> {load['turnaround_p50_ms']}ms, "
+          f"p99 {base['turnaround_p99_ms']} -> {load['turnaround_p99_ms']}ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load/soak test: simulated UI clients against the app with a loopback table")
+    parser.add_argument("--clients", type=int, default=10)
+    parser.add_argument("--threads", type=int, default=8, help="waitress worker threads")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds under load")
+    parser.add_argument("--warmup", type=float, default=10.0, help="seconds of streaming without clients (baseline)")
+    parser.add_argument("--sse", type=int, default=0, help="clients that also hold a live-view event stream")
+    parser.add_argument("--line-time", type=float, default=0.004, help="seconds the loopback table takes per point")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+    report = run(args.clients, args.threads, args.duration, args.warmup, args.sse, args.line_time)
+    if args.json: print(json.dumps(report, indent=2))
+    else: print_report(report)
@@ -0,0 +1,320 @@
+import os
+import json
+import math
+import hashlib
+import functools
+
+import numpy as np
+
+import kinematics
+from kinematics import TABLE_RADIUS, L1, L2, GEAR_RATIO, STEPS_PER_RAD
+
+GENERATOR_VERSION = 1    # Bump when a family's math changes so cached output is regenerated
+MAX_POINTS = 500000
+THUMBNAIL_POINTS = 20000 # Points drawn into a thumbnail; long patterns are decimated
+CACHE_MAX_BYTES = 128 * 1024 * 1024  # Least recently used patterns are deleted beyond this
+
+# Parameters per family with their defaults; the default's type is the parameter's type
+FAMILIES = {
+    # Archimedean spiral between two radii
+    "spiral": {"turns": 20.0, "rho_start": 0.0, "rho_end": 1.0, "points_per_turn": 180},
+    # Spiral fill with a fixed groove pitch, e.g. to erase a band
+    "fill": {"pitch_mm": 3.0, "rho_start": 0.0, "rho_end": 1.0, "points_per_turn": 180},
+    # r = cos(n/d * theta)
+    "rose": {"n": 5, "d": 1, "points_per_petal": 120},
+    # Hypotrochoid: circle of radius r rolling inside R, pen at distance d
+    "spirograph": {"R": 96, "r": 35, "d": 50, "points_per_loop": 240},
+    # x = sin(a*t + delta), y = sin(b*t)
+    "lissajous": {"a": 3, "b": 4, "delta": 1.5708, "points": 3000},
+}
+COMMON = {"scale": 1.0, "rotation": 0.0}
+
+def normalize(params):
+    """Validates a pattern description and fills in defaults. Raises ValueError."""
+    if not isinstance(params, dict):
+        raise ValueError("Pattern must be an object")
+    family = params.get("family")
+    if family not in FAMILIES:
+        raise ValueError(f"Unknown pattern family: {family}")
+    out = {"family": family}
+    for name, default in dict(FAMILIES[family], **COMMON).items():
+        value = params.get(name, default)
+        try:
+            value = type(default)(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid value for {name}")
+        if isinstance(value, float):
+            if not math.isfinite(value): raise ValueError(f"Invalid value for {name}")
+            value = round(value, 6)  # Same design, same hash, whatever the client's float noise
+        out[name] = value
+    if not 0 < out["scale"] <= 1.0:
+        raise ValueError("scale must be in (0, 1]")
+    return out
+
+def pattern_key(params):
+    encoded = json.dumps(dict(params, version=GENERATOR_VERSION), sort_keys=True)
+    return hashlib.sha256(encoded.encode()).hexdigest()[:16]
+
+def pattern_filename(params):
+    return f"{params['family']}-{pattern_key(params)}.thr"
+
+def _count(n):
+    n = int(n)
+    if n < 2: raise ValueError("Pattern needs at least 2 points")
+    if n > MAX_POINTS: raise ValueError(f"Pattern too large ({n} points, max {MAX_POINTS})")
+    return n
+
+def _polar(x, y):
+    """Cartesian curve -> continuous theta (unwrapped, no jumps at +-pi) and rho, fitted to the table."""
+    theta = np.unwrap(np.arctan2(y, x))
+    rho = np.hypot(x, y)
+    peak = rho.max()
+    if peak > 0: rho = rho / peak
+    return theta, rho
+
+def _spiral(rho_start, rho_end, turns, points_per_turn):
+    if turns <= 0: raise ValueError("turns must be positive")
+    u = np.linspace(0.0, 1.0, _count(turns * points_per_turn + 1))
+    theta = 2 * math.pi * turns * u
+    rho = rho_start + (rho_end - rho_start) * u
+    return theta, np.clip(rho, 0.0, 1.0)
+
+def generate(params):
+    """Computes a normalized pattern as (N, 2) float64 [theta, rho]; fully vectorized."""
+    p = params
+    family = p["family"]
+    if family == "spiral":
+        theta, rho = _spiral(p["rho_start"], p["rho_end"], p["turns"], p["points_per_turn"])
+    elif family == "fill":
+        if p["pitch_mm"] < 0.5: raise ValueError("pitch_mm must be at least 0.5")
+        turns = max(abs(p["rho_end"] - p["rho_start"]) * TABLE_RADIUS / p["pitch_mm"], 1.0)
+        theta, rho = _spiral(p["rho_start"], p["rho_end"], turns, p["points_per_turn"])
+    elif family == "rose":
+        n, d = p["n"], p["d"]
+        if n <= 0 or d <= 0: raise ValueError("n and d must be positive")
+        g = math.gcd(n, d); n, d = n // g, d // g
+        # The curve closes after pi*d when n*d is odd, 2*pi*d otherwise
+        period = math.pi * d if (n * d) % 2 else 2 * math.pi * d
+        petals = n if (n * d) % 2 else 2 * n
+        t = np.linspace(0.0, period, _count(petals * p["points_per_petal"] + 1))
+        r = np.cos(n / d * t)
+        theta, rho = _polar(r * np.cos(t), r * np.sin(t))
+    elif family == "spirograph":
+        R, r, d = p["R"], p["r"], p["d"]
+        if R <= 0 or r <= 0 or d < 0 or R == r: raise ValueError("Need R, r > 0, R != r and d >= 0")
+        loops = r // math.gcd(R, r)  # Turns of the rolling circle until the curve closes
+        t = np.linspace(0.0, 2 * math.pi * loops, _count(loops * p["points_per_loop"] + 1))
+        x = (R - r) * np.cos(t) + d * np.cos((R - r) / r * t)
+        y = (R - r) * np.sin(t) - d * np.sin((R - r) / r * t)
+        theta, rho = _polar(x, y)
+    elif family == "lissajous":
+        t = np.linspace(0.0, 2 * math.pi, _count(p["points"]))
+        theta, rho = _polar(np.sin(p["a"] * t + p["delta"]), np.sin(p["b"] * t))
+    return np.column_stack((theta + p["rotation"], rho * p["scale"]))
+
+def joint_steps(theta, rho):
+    """Vectorized kinematics.calculate_ik over a whole path, starting from the centre like the firmware.
+    Returns the per-point (base, elbow) step positions."""
+    return joint_steps_xy(rho * TABLE_RADIUS * np.cos(theta), rho * TABLE_RADIUS * np.sin(theta))
+
+def joint_steps_xy(x, y, base_start=0.0):
+    """joint_steps over Cartesian points (mm). base_start is the base angle (rad) before the first
+    point, so a long path can be done in chunks."""
+    dist = np.minimum(np.hypot(x, y), L1 + L2)
+    bend = np.arccos(np.clip((dist * dist - L1 * L1 - L2 * L2) / (2.0 * L1 * L2), -1.0, 1.0))
+    t1 = np.arctan2(y, x) - np.arctan2(L2 * np.sin(bend), L1 + L2 * np.cos(bend))
+    centre = dist < 1.0
+    # At the centre the base holds its angle: carry the previous t1 forward
+    t1 = np.where(centre, np.nan, t1)
+    t1 = np.concatenate(([base_start], t1))
+    idx = np.where(np.isnan(t1), 0, np.arange(len(t1)))
+    t1 = t1[np.maximum.accumulate(idx)]
+    # Same choice as calculate_ik: the t1 branch nearest the previous point
+    t1 = np.unwrap(t1)[1:]
+    b = -t1 * STEPS_PER_RAD
+    # At the centre bend is pi, as in the firmware's calculateIK
+    e = -(np.where(centre, math.pi, bend) + GEAR_RATIO * t1) * STEPS_PER_RAD
+    return b, e
+
+def estimate_seconds(data, speed=1.0):
+    """Vectorized kinematics.estimate_seconds."""
+    if len(data) == 0: return 0.0
+    b, e = joint_steps(data[:, 0], data[:, 1])
+    b0, e0 = kinematics.calculate_ik(0, 0, 0)
+    db = np.abs(np.diff(b, prepend=b0))
+    de = np.abs(np.diff(e, prepend=e0))
+    return kinematics.steps_to_seconds(float(np.maximum(db, de).sum()), speed)
+
+# --- Footprint erase ---
+ERASE_SECTORS = 72            # 5 degree sectors in the occupancy grid
+ERASE_STEP = math.radians(2)  # Arc resolution of erase passes, like a fill's 180 points per turn
+
+def footprint(data, pitch_mm=3.0, margin_mm=10.0):
+    """Occupancy grid of a design: rings pitch_mm wide (ring k spans k..k+1 pitches from the
+    centre) by ERASE_SECTORS sectors, True where the path passes within about margin_mm."""
+    data = np.asarray(data, dtype=np.float64).reshape(-1, 2)
+    rings = math.ceil(TABLE_RADIUS / pitch_mm)
+    grid = np.zeros((rings, ERASE_SECTORS), dtype=bool)
+    if len(data) == 0: return grid
+    r = data[:, 1] * TABLE_RADIUS
+    x, y = r * np.cos(data[:, 0]), r * np.sin(data[:, 0])
+    if len(data) > 1:
+        # Sample the straight segments the firmware draws, at most half a pitch apart
+        counts = np.maximum(np.ceil(np.hypot(np.diff(x), np.diff(y)) / (pitch_mm / 2)), 1).astype(np.int64)
+        seg = np.repeat(np.arange(len(counts)), counts)
+        t = (np.arange(len(seg)) - np.repeat(np.cumsum(counts) - counts, counts)) / np.repeat(counts, counts)
+        x = np.append(x[seg] + (x[seg + 1] - x[seg]) * t, x[-1])
+        y = np.append(y[seg] + (y[seg + 1] - y[seg]) * t, y[-1])
+    ring = np.minimum((np.hypot(x, y) / pitch_mm).astype(np.int64), rings - 1)
+    sector = (np.arctan2(y, x) % (2 * math.pi) / (2 * math.pi) * ERASE_SECTORS).astype(np.int64) % ERASE_SECTORS
+    grid[ring, sector] = True
+    # Margin: grow across rings, then around each ring by the angle margin_mm spans at its radius
+    grown = grid.copy()
+    for o in range(1, math.ceil(margin_mm / pitch_mm) + 1):
+        grown[o:] |= grid[:-o]
+        grown[:-o] |= grid[o:]
+    out = grown.copy()
+    width = 2 * math.pi / ERASE_SECTORS
+    for k in np.flatnonzero(grown.any(axis=1)):
+        spread = min(ERASE_SECTORS // 2, math.ceil(margin_mm / ((k + 0.5) * pitch_mm * width)))
+        for o in range(1, spread + 1):
+            out[k] |= np.roll(grown[k], o) | np.roll(grown[k], -o)
+    return out
+
+def _longest_gap(empty):
+    """(first sector, length) of the longest circular run of True."""
+    n = len(empty)
+    best, run = (0, 0), 0
+    for i, e in enumerate(np.concatenate((empty, empty))):
+        run = run + 1 if e else 0
+        if best[1] < run <= n: best = (i - run + 1, run)
+    return best[0] % n, best[1]
+
+def erase_path(grid, pitch_mm, from_theta=0.0, from_rho=0.0):
+    """Shortest sweep of a footprint grid: one pass per occupied ring, covering only the arc
+    between its outermost occupied sectors (a full circle if there is no gap), rings visited
+    in order from the end nearest the arm. Returns (N, 2) [theta, rho]."""
+    rings = list(np.flatnonzero(grid.any(axis=1)))
+    if not rings: return np.empty((0, 2))
+    radius = lambda k: min((k + 0.5) * pitch_mm, TABLE_RADIUS)
+    r_from = from_rho * TABLE_RADIUS
+    if abs(r_from - radius(rings[-1])) < abs(r_from - radius(rings[0])): rings.reverse()
+    width = 2 * math.pi / ERASE_SECTORS
+    a = from_theta % (2 * math.pi)
+    direction = 1
+    angles, radii = [], []
+    for k in rings:
+        gap_start, gap_len = _longest_gap(~grid[k])
+        if gap_len == 0:
+            start, sweep = a, direction * 2 * math.pi
+            direction = -direction
+        else:
+            arc_start = (gap_start + gap_len) % ERASE_SECTORS * width
+            arc_len = (ERASE_SECTORS - gap_len) * width
+            # Enter at whichever end of the arc is nearer, angularly, to where the arm is
+            near = lambda b: abs((b - a + math.pi) % (2 * math.pi) - math.pi)
+            if near(arc_start) <= near(arc_start + arc_len): start, sweep = arc_start, arc_len
+            else: start, sweep = arc_start + arc_len, -arc_len
+        n = max(1, math.ceil(abs(sweep) / ERASE_STEP))
+        angles.append(start + sweep * np.arange(n + 1) / n)
+        radii.append(np.full(n + 1, radius(k)))
+        a = (start + sweep) % (2 * math.pi)
+    theta = np.unwrap(np.concatenate(angles))
+    theta += 2 * math.pi * round((from_theta - theta[0]) / (2 * math.pi))
+    return np.column_stack((theta, np.concatenate(radii) / TABLE_RADIUS))
+
+@functools.lru_cache(maxsize=8)
+def full_erase_seconds(pitch_mm, speed=1.0):
+    """Draw time of a whole-table spiral fill at the same groove pitch, for comparison."""
+    return estimate_seconds(generate(normalize({"family": "fill", "pitch_mm": pitch_mm})), speed)
+
+class PatternLines:
+    """Read-only sequence of 'theta rho' lines over a point array; lines are formatted only
+    when the runner reads them, so a pattern never exists as a list of strings."""
+    def __init__(self, data, prefix=()):
+        self.data = data            # (N, 2) array, usually memory-mapped from the cache
+        self.prefix = list(prefix)  # Lead-in transition lines
+
+    def __len__(self):
+        return len(self.prefix) + len(self.data)
+
+    def __getitem__(self, i):
+        n = len(self.prefix)
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step == 1 and start >= n:
+                return PatternLines(self.data[start - n:max(start, stop) - n])
+            return [self[j] for j in range(start, stop, step)]
+        if i < 0: i += len(self)
+        if not 0 <= i < len(self): raise IndexError(i)
+        if i < n: return self.prefix[i]
+        theta, rho = self.data[i - n]
+        return f"{theta:.4f} {rho:.4f}"
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def __radd__(self, other):
+        # `transition + design` in PreparedJob: prepend the lead-in without copying the points
+        return PatternLines(self.data, list(other) + self.prefix)
+
+    def endpoints(self):
+        if len(self.data) == 0: return None, None
+        return tuple(map(float, self.data[0])), tuple(map(float, self.data[-1]))
+
+    def estimate_seconds(self, speed=1.0):
+        return estimate_seconds(np.asarray(self.data), speed)
+
+def load(params, cache_dir):
+    """Returns the points for a normalized pattern, generating them on a cache miss.
+    Output is cached as <key>.npy and memory-mapped, so repeats cost neither CPU nor RAM."""
+    key = pattern_key(params)
+    path = os.path.join(cache_dir, key + ".npy")
+    if os.path.exists(path):
+        try: os.utime(path)  # Marks it recently used for prune_cache
+        except OSError: pass
+    else:
+        data = generate(params)
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, 'wb') as f: np.save(f, data)
+        os.replace(tmp, path)
+        prune_cache(cache_dir, keep=key)
+    return np.load(path, mmap_mode='r')
+
+def prune_cache(cache_dir, max_bytes=CACHE_MAX_BYTES, keep=None):
+    """Deletes the least recently used patterns (points and thumbnail together) until the cache fits.
+    Patterns being played stay readable: their memory maps outlive the file."""
+    keys = {}
+    for f in os.listdir(cache_dir):
+        key, ext = os.path.splitext(f)
+        if ext not in ('.npy', '.png'): continue
+        try: st = os.stat(os.path.join(cache_dir, f))
+        except OSError: continue
+        used, size = keys.get(key, (0, 0))
+        keys[key] = (max(used, st.st_mtime), size + st.st_size)
+    total = sum(size for _, size in keys.values())
+    for key, (_, size) in sorted(keys.items(), key=lambda k: k[1][0]):
+        if total <= max_bytes: break
+        if key == keep: continue
+        for ext in ('.npy', '.png'):
+            try: os.remove(os.path.join(cache_dir, key + ext))
+            except OSError: pass
+        total -= size
+
+def pattern_lines(params, cache_dir):
+    return PatternLines(load(normalize(params), cache_dir))
+
+def thumbnail(params, cache_dir, builder_factory):
+    """Cached <key>.png drawn with the thumbnailer's builder. Returns the path, or None."""
+    path = os.path.join(cache_dir, pattern_key(params) + ".png")
+    if os.path.exists(path): return path
+    data = load(params, cache_dir)
+    builder = builder_factory()
+    stride = max(1, len(data) // THUMBNAIL_POINTS)
+    for theta, rho in np.asarray(data[::stride]).tolist():
+        builder.add_point(theta, rho)
+    tmp = path + ".tmp"
+    if not builder.save(tmp): return None
+    os.replace(tmp, path)
+    return path
@@ -0,0 +1,213 @@
+import time
+import queue
+import threading
+from collections import OrderedDict
+
+PROTOCOL_VERSION = 2       # Firmware answering PROTO? with at least this understands framed lines and BAUD
+TELEMETRY_VERSION = 3      # ...and with at least this, TELEM <ms> and telemetry frames
+BASE_BAUD = 250000
+BAUD_LADDER = (1000000, 500000, BASE_BAUD)  # Exact UART divisors on the LGT8F328P at 32 MHz
+HISTORY = 64               # Framed lines kept for resends
+FALLBACK_MIN_LINES = 100   # Lines in the window before the error rate is trusted
+FALLBACK_ERROR_RATE = 0.02 # Above this the link drops to the next lower baud
+
+def checksum(data):
+    """XOR of every byte, as in 'N<seq> <payload>*<checksum>'."""
+    c = 0
+    for b in data: c ^= b
+    return c
+
+def frame(seq, payload):
+    body = f"N{seq} {payload}".encode()
+    return body + b"*%d\n" % checksum(body)
+
+def unframe(line):
+    """(seq, payload) for a framed line, (None, line) for a plain one, None when the checksum is wrong."""
+    if not line.startswith("N") or "*" not in line: return None, line
+    body, _, cs = line.rpartition("*")
+    seq, _, payload = body.partition(" ")
+    try: seq, cs = int(seq[1:]), int(cs)
+    except ValueError: return None, line
+    if checksum(body.encode()) != cs: return None
+    return seq, payload
+
+def is_garbled(raw):
+    """A line from the firmware with bytes it never sends (noise or a baud mismatch)."""
+    return any(b >= 0x7f or (b < 0x20 and b not in (0x0a, 0x0d)) for b in raw)
+
+class Link:
+    """Framing, resend history and error counters for one table's serial link.
+
+    Lines the runner streams are sent as 'N<seq> <payload>*<xor>'. The firmware answers a bad
+    checksum, an overlong line or a gap in the sequence with 'RS <seq>', and the lines from that
+    sequence number on are written again. Firmware without protocol support gets plain lines.
+    Sequence numbers restart at 0 for every connection; the PROTO? query during negotiation
+    makes the firmware take the next framed line's number as its new start."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = 0
+        self.framed = False
+        self.baud = BASE_BAUD
+        self.next_seq = 0
+        self.history = OrderedDict()
+        self.sent = 0
+        self.retransmits = 0
+        self.resend_requests = 0
+        self.timeouts = 0
+        self.rx_errors = 0
+        self.fallbacks = 0
+        self.window_sent = 0    # Since the last baud change / fallback check
+        self.window_errors = 0
+        self.negotiating = False
+        self.replies = queue.Queue()  # Firmware lines while negotiating at runtime
+
+    def encode(self, payload):
+        """Returns (bytes to write, sequence number or None when unframed)."""
+        if not self.framed: return (payload + "\n").encode(), None
+        with self.lock:
+            seq = self.next_seq
+            self.next_seq += 1
+            data = frame(seq, payload)
+            self.history[seq] = data
+            while len(self.history) > HISTORY: self.history.popitem(last=False)
+            self.sent += 1
+            self.window_sent += 1
+        return data, seq
+
+    def resend_from(self, seq, reason='request'):
+        """Lines to write again for a resend request (or an ack timeout) starting at seq."""
+        with self.lock:
+            lines = [data for s, data in self.history.items() if s >= seq]
+            if reason == 'request': self.resend_requests += 1
+            else: self.timeouts += 1
+            self.retransmits += len(lines)
+            self.window_errors += 1
+        return lines
+
+    def rx_error(self):
+        with self.lock:
+            self.rx_errors += 1
+            self.window_errors += 1
+
+    def reset_window(self):
+        with self.lock: self.window_sent = self.window_errors = 0
+
+    def should_fall_back(self):
+        with self.lock:
+            if self.baud <= BASE_BAUD or self.window_sent < FALLBACK_MIN_LINES: return False
+            return self.window_errors / self.window_sent > FALLBACK_ERROR_RATE
+
+    def status(self):
+        with self.lock:
+            sent = max(1, self.sent)
+            return {
+                "framed": self.framed,
+                "baud": self.baud,
+                "sent": self.sent,
+                "retransmits": self.retransmits,
+                "resend_requests": self.resend_requests,
+                "timeouts": self.timeouts,
+                "rx_errors": self.rx_errors,
+                "fallbacks": self.fallbacks,
+                "retransmit_rate": round(self.retransmits / sent, 4),
+                "error_rate": round((self.resend_requests + self.timeouts + self.rx_errors) / sent, 4)
+            }
+
+def parse_telemetry(line):
+    """'T <theta> <rho> <lines queued> <steps queued> <steps/s> <paused>' as a dict, None for any other line.
+    Theta is the firmware's, wrapped to [-pi, pi]."""
+    parts = line.split()
+    if len(parts) != 7 or parts[0] != "T": return None
+    try:
+        return {
+            "theta": float(parts[1]),
+            "rho": float(parts[2]),
+            "lines_queued": int(parts[3]),
+            "steps_queued": int(parts[4]),
+            "step_rate": int(parts[5]),
+            "paused": parts[6] == "1",
+        }
+    except ValueError:
+        return None
+
+def port_reader(ser):
+    """read_line(timeout) straight from the port, for use before the reader thread starts."""
+    def read_line(timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            line = ser.readline()
+            if line: return line.decode(errors="ignore").strip()
+        return None
+    return read_line
+
+def queue_reader(link):
+    """read_line(timeout) over the lines the reader thread diverts while link.negotiating is set."""
+    def read_line(timeout):
+        try: return link.replies.get(timeout=timeout)
+        except queue.Empty: return None
+    return read_line
+
+def wait_for(read_line, prefix, timeout):
+    deadline = time.monotonic() + timeout
+    while True:
+        left = deadline - time.monotonic()
+        if left <= 0: return None
+        line = read_line(left)
+        if line and line.startswith(prefix): return line
+
+def query_protocol(ser, read_line, timeout=0.5):
+    """Firmware protocol version; 0 for firmware that predates framing (it ignores PROTO?).
+    Also resets the firmware's expected sequence number, left over from an earlier connection."""
+    ser.write(b"PROTO?\n")
+    line = wait_for(read_line, "PROTO ", timeout)
+    try: return int(line.split()[1]) if line else 0
+    except (IndexError, ValueError): return 0
+
+def switch_baud(ser, read_line, rate, log=print):
+    """Moves both ends to rate. The firmware switches after BAUD_OK and reverts by itself
+    unless a PING gets through at the new rate within a second. Returns True on success."""
+    previous = ser.baudrate
+    ser.write(f"BAUD {rate}\n".encode())
+    if not wait_for(read_line, "BAUD_OK", 0.5): return False
+    ser.flush()
+    ser.baudrate = rate
+    time.sleep(0.02)
+    for _ in range(3):
+        ser.write(b"PING\n")
+        if wait_for(read_line, "PONG", 0.2): return True
+    ser.baudrate = previous
+    wait_for(read_line, "BAUD_REVERT", 1.5)
+    log(f"Link did not hold at {rate} baud, staying at {previous}")
+    return False
+
+def negotiate(ser, link, read_line, max_baud, log=print):
+    """Detects framing support and picks the fastest baud rate the link holds, up to max_baud.
+    link.baud is the rate the port is open at, which can already be above BASE_BAUD."""
+    version = query_protocol(ser, read_line)
+    link.version = version
+    link.framed = version >= PROTOCOL_VERSION
+    if not link.framed:
+        log("Firmware without checksummed protocol, using plain lines at 250000 baud")
+        return
+    for rate in BAUD_LADDER:
+        if rate > max_baud or rate <= link.baud: continue
+        if switch_baud(ser, read_line, rate, log):
+            link.baud = rate
+            break
+    if link.baud > max_baud:
+        # Left above the cap by an earlier run (the board keeps its rate across host restarts)
+        rate = next(r for r in BAUD_LADDER if r <= max(max_baud, BASE_BAUD))
+        if switch_baud(ser, read_line, rate, log): link.baud = rate
+    link.reset_window()
+    log(f"Checksummed protocol v{version} at {link.baud} baud")
+
+def fall_back(ser, link, read_line, log=print):
+    """Drops to the next lower rate after the error counters climbed."""
+    lower = [r for r in BAUD_LADDER if r < link.baud]
+    if not lower: return
+    rate = lower[0]
+    if switch_baud(ser, read_line, rate, log):
+        log(f"Link errors at {link.baud} baud, fell back to {rate}")
+        link.baud = rate
+    link.fallbacks += 1
+    link.reset_window()
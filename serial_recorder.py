@@ -0,0 +1,301 @@
+import os
+import sys
+import mmap
+import time
+import struct
+import threading
+
+import serial_protocol
+
+MAGIC = b'SREC'
+VERSION = 1
+FILE_HEADER = struct.Struct('<4sIIIdQ')  # magic, version, segments, segment size, wall clock at t=0, monotonic ns at t=0
+SEGMENT_HEADER = struct.Struct('<QI')    # sequence (0 = unused), bytes used
+RECORD = struct.Struct('<QBH')           # ns since t=0, kind, payload length
+HEADER_SIZE = 64
+
+TX, RX, NOTE = 1, 2, 3
+KIND_NAMES = {TX: 'TX', RX: 'RX', NOTE: '--'}
+DEFAULT_SIZE = 8 * 1024 * 1024
+SEGMENTS = 8
+KEEP_RECORDINGS = 5
+
+class RingRecorder:
+    """Append-only binary ring of timestamped serial records in a memory-mapped file.
+
+    The file is split into segments; when the current one is full the oldest segment is reused,
+    so the file never grows and always holds the most recent (SEGMENTS-1)/SEGMENTS of capacity.
+    Appending is a struct pack and a memory copy, no syscalls. Segment headers are updated after
+    the record bytes, so a crash loses at most the record being written."""
+    def __init__(self, path, size=DEFAULT_SIZE, segments=SEGMENTS):
+        self.path = path
+        self.segments = segments
+        self.segment_size = (size - HEADER_SIZE) // segments
+        self.lock = threading.Lock()
+        self.origin = time.monotonic_ns()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'wb') as f: f.truncate(HEADER_SIZE + self.segment_size * segments)
+        self.file = open(path, 'r+b')
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        FILE_HEADER.pack_into(self.map, 0, MAGIC, VERSION, segments, self.segment_size, time.time(), self.origin)
+        self.segment = 0
+        self.sequence = 1
+        self.used = SEGMENT_HEADER.size
+        SEGMENT_HEADER.pack_into(self.map, HEADER_SIZE, self.sequence, self.used)
+
+    def append(self, kind, data):
+        t = time.monotonic_ns() - self.origin
+        data = data[:0xFFFF]
+        size = RECORD.size + len(data)
+        with self.lock:
+            if self.map is None: return
+            if self.used + size > self.segment_size:
+                # Move on to the next segment, overwriting its (oldest) records
+                self.segment = (self.segment + 1) % self.segments
+                self.sequence += 1
+                self.used = SEGMENT_HEADER.size
+            base = HEADER_SIZE + self.segment * self.segment_size
+            pos = base + self.used
+            RECORD.pack_into(self.map, pos, t, kind, len(data))
+            self.map[pos + RECORD.size:pos + size] = data
+            self.used += size
+            SEGMENT_HEADER.pack_into(self.map, base, self.sequence, self.used)
+
+    def note(self, text):
+        self.append(NOTE, text.encode())
+
+    def close(self):
+        with self.lock:
+            if self.map is None: return
+            self.map.flush()
+            self.map.close()
+            self.file.close()
+            self.map = None
+
+def read_recording(path):
+    """Returns (info dict, [(seconds, kind, bytes)]) in recorded order, oldest first."""
+    with open(path, 'rb') as f: buf = f.read()
+    magic, version, segments, segment_size, wall, _ = FILE_HEADER.unpack_from(buf, 0)
+    if magic != MAGIC: raise ValueError(f"{path} is not a serial recording")
+    if version != VERSION: raise ValueError(f"Unsupported recording version {version}")
+    found = []
+    for i in range(segments):
+        base = HEADER_SIZE + i * segment_size
+        sequence, used = SEGMENT_HEADER.unpack_from(buf, base)
+        if sequence: found.append((sequence, base, min(used, segment_size)))
+    records = []
+    for _, base, used in sorted(found):
+        pos = base + SEGMENT_HEADER.size
+        while pos + RECORD.size <= base + used:
+            t, kind, length = RECORD.unpack_from(buf, pos)
+            pos += RECORD.size
+            records.append((t / 1e9, kind, buf[pos:pos + length]))
+            pos += length
+    return {"started": wall, "segments": segments, "segment_size": segment_size}, records
+
+class RecordingSerial:
+    """Wraps a serial.Serial, recording every write and every line read. Anything else passes through."""
+    def __init__(self, ser, recorder):
+        self.ser = ser
+        self.recorder = recorder
+
+    def write(self, data):
+        self.recorder.append(TX, bytes(data))
+        return self.ser.write(data)
+
+    def readline(self, *args):
+        line = self.ser.readline(*args)
+        if line: self.recorder.append(RX, line)
+        return line
+
+    @property
+    def baudrate(self):
+        return self.ser.baudrate
+
+    @baudrate.setter
+    def baudrate(self, rate):
+        self.recorder.note(f"baud {rate}")
+        self.ser.baudrate = rate
+
+    def close(self):
+        self.recorder.close()
+        self.ser.close()
+
+    def __getattr__(self, name):
+        return getattr(self.ser, name)
+
+def sent_lines(data, seen=None):
+    """Payloads of the lines in one recorded write, with protocol framing removed.
+    Frames with a bad checksum are dropped, and so are resends of a sequence number already in seen."""
+    lines = []
+    for line in data.decode(errors='ignore').split('\n'):
+        line = line.strip()
+        if not line: continue
+        parsed = serial_protocol.unframe(line)
+        if parsed is None: continue
+        seq, payload = parsed
+        if seq is not None and seen is not None:
+            if seq in seen: continue
+            seen.add(seq)
+        lines.append(payload)
+    return lines
+
+def prune_recordings(folder, keep=KEEP_RECORDINGS):
+    files = [os.path.join(folder, f) for f in os.listdir(folder) if f.endswith('.srec')]
+    files.sort(key=os.path.getmtime, reverse=True)
+    for path in files[keep:]:
+        try: os.remove(path)
+        except OSError: pass
+
+# === REPLAY ===
+class ReplaySerial:
+    """Stands in for the serial port, answering with the lines the firmware sent in a recording.
+
+    Each recorded RX line is tied to the TX line that preceded it. It is released once the
+    replayed code has written that same line, after the original TX->RX delay divided by speed,
+    so the firmware's real response times are reproduced while the host side is the code under test."""
+    def __init__(self, records, speed=1.0):
+        self.speed = speed
+        self.cond = threading.Condition()
+        self.timeout = 0.1  # readline() blocks this long at most, like the real port
+        self.start = time.monotonic()
+        self.tx = []       # Recorded TX payloads, unframed and without resends (one write can carry several)
+        self.written = []  # (time, line) for each replayed write
+        self.matched = 0   # Recorded TX lines matched by replayed writes so far
+        self.matched_at = {}
+        self.pending = []  # (anchor TX index, delay, line)
+        last_tx_time = records[0][0] if records else 0.0
+        seen = set()
+        for t, kind, data in records:
+            if kind == TX:
+                self.tx.extend(sent_lines(data, seen))
+                last_tx_time = t
+            elif kind == RX:
+                self.pending.append((len(self.tx), t - last_tx_time, data))
+        self.is_open = True
+
+    def release_time(self, anchor, delay):
+        if anchor == 0: base = self.start
+        else:
+            base = self.matched_at.get(anchor)
+            if base is None: return None
+        return base + delay / self.speed
+
+    def write(self, data):
+        now = time.monotonic()
+        with self.cond:
+            for line in sent_lines(bytes(data)):
+                self.written.append((now, line))
+                # Find this line among the next recorded TX lines (skips commands the new code no longer sends)
+                for i in range(self.matched, min(self.matched + 64, len(self.tx))):
+                    if self.tx[i] == line:
+                        for j in range(self.matched + 1, i + 2): self.matched_at[j] = now
+                        self.matched = i + 1
+                        break
+            self.cond.notify_all()
+        return len(data)
+
+    def next_release(self):
+        """When the next recorded line is due, or None while its TX line hasn't been written."""
+        if not self.pending: return None
+        return self.release_time(*self.pending[0][:2])
+
+    def ready(self):
+        at = self.next_release()
+        return at is not None and at <= time.monotonic()
+
+    @property
+    def in_waiting(self):
+        with self.cond: return 1 if self.ready() else 0
+
+    def readline(self):
+        deadline = time.monotonic() + self.timeout
+        with self.cond:
+            while not self.ready():
+                now = time.monotonic()
+                if now >= deadline: return b''
+                at = self.next_release()
+                self.cond.wait(min(deadline, at) - now if at is not None else deadline - now)
+            return self.pending.pop(0)[2]
+
+    def done(self):
+        return not self.pending
+
+    def reset_input_buffer(self): pass
+
+    def close(self):
+        self.is_open = False
+
+def percentile(values, p):
+    if not values: return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def tx_lines(records):
+    seen = set()
+    return [(t, line) for t, kind, data in records if kind == TX for line in sent_lines(data, seen)]
+
+def ack_gaps(times):
+    """Intervals between consecutive writes; long ones are where the stream stalled on an ack."""
+    return [b - a for a, b in zip(times, times[1:])]
+
+def report(label, duration, gaps, lines, stall):
+    stalls = [g for g in gaps if g >= stall]
+    print(f"{label}: {lines} lines in {duration:.2f}s ({lines / duration if duration else 0:.0f} lines/s), "
+          f"TX gap p50 {percentile(gaps, 50) * 1000:.1f}ms p99 {percentile(gaps, 99) * 1000:.1f}ms "
+          f"max {max(gaps, default=0) * 1000:.1f}ms, {len(stalls)} stalls >= {stall * 1000:.0f}ms")
+
+def replay(path, speed=1.0, stall=0.25):
+    """Re-runs the job in a recording through the app's GCodeRunner and read_from_serial,
+    against ReplaySerial, and compares the write timing with the original session."""
+    import kinematics
+    import app
+    info, records = read_recording(path)
+    sent = tx_lines(records)
+    design = [line for _, line in sent if kinematics.parse_point(line)]
+    if not design:
+        print("No theta/rho lines in the recording")
+        return
+    times = [t for t, line in sent if kinematics.parse_point(line)]
+    report("Recorded", times[-1] - times[0], ack_gaps(times), len(times), stall)
+
+    port = ReplaySerial(records, speed=speed)
+    table = app.TableController(None)
+    table.id = "replay"
+    table.arduino = port
+    table.connected = True
+    table.calibration_done = True
+    first = kinematics.parse_point(design[0])
+    table.current_theta, table.current_rho = first  # No lead-in: the recording already has it
+    threading.Thread(target=table.read_from_serial, daemon=True).start()
+    prepared = app.PreparedJob({'filename': os.path.basename(path), 'gcode': '\n'.join(design)}, *first)
+    runner = app.GCodeRunner(prepared, table)
+    t0 = time.monotonic()
+    runner.start()
+    runner.join(timeout=(times[-1] - times[0]) / speed * 10 + 30)
+    table.connected = False
+    elapsed = time.monotonic() - t0
+    if runner.is_alive(): print(f"Runner still waiting after {elapsed:.0f}s, stopped (line {runner.lines_sent})")
+    written = [t for t, line in port.written if kinematics.parse_point(line)]
+    report(f"Replay x{speed:g}", elapsed, ack_gaps(written), len(written), stall / speed)
+    print(f"Equivalent at x1: {elapsed * speed:.2f}s; {len(port.pending)} recorded RX lines never released")
+
+def dump(path, limit=None):
+    info, records = read_recording(path)
+    started = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(info["started"]))
+    print(f"# Recording started {started}, {len(records)} records")
+    for t, kind, data in records[:limit]:
+        print(f"{t:12.6f} {KIND_NAMES.get(kind, '??')} {data.decode(errors='replace').rstrip()}")
+
+if __name__ == "__main__":
+    # Usage: python serial_recorder.py dump <file.srec> [count]
+    #        python serial_recorder.py replay <file.srec> [--speed N]
+    args = sys.argv[1:]
+    if len(args) >= 2 and args[0] == "dump":
+        dump(args[1], int(args[2]) if len(args) > 2 else None)
+    elif len(args) >= 2 and args[0] == "replay":
+        speed = float(args[args.index("--speed") + 1]) if "--speed" in args else 1.0
+        replay(args[1], speed=speed)
+    else:
+        print("Usage: python serial_recorder.py dump <file.srec> [count]\n"
+              "       python serial_recorder.py replay <file.srec> [--speed N]")
@@ -0,0 +1,78 @@
+import os
+import gzip
+import hashlib
+import threading
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = ('.html', '.css', '.js', '.json', '.svg', '.txt', '.webmanifest')
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+class Payload:
+    """A response body with its precompressed variants and a per-encoding ETag."""
+    def __init__(self, data):
+        self.data = data
+        self.hash = hashlib.sha256(data).hexdigest()[:12]
+        self.variants = {}
+        gz = gzip.compress(data, compresslevel=9, mtime=0)  # mtime=0 keeps the bytes reproducible
+        if len(gz) < len(data): self.variants['gzip'] = gz
+        if brotli:
+            br = brotli.compress(data, quality=11)
+            if len(br) < len(data): self.variants['br'] = br
+
+    def select(self, accept_encoding):
+        """Returns (encoding or None, body, etag) for a request's Accept-Encoding header."""
+        for enc in ('br', 'gzip'):
+            if enc in self.variants and enc in accept_encoding:
+                return enc, self.variants[enc], f'"{self.hash}-{enc}"'
+        return None, self.data, f'"{self.hash}"'
+
+class Asset:
+    def __init__(self, path, stamp, compressible):
+        self.path = path
+        self.stamp = stamp
+        with open(path, 'rb') as f: data = f.read()
+        self.hash = hashlib.sha256(data).hexdigest()[:12]
+        # Already-compressed formats (PNG, ...) are streamed from disk instead of held in memory
+        self.payload = Payload(data) if compressible else None
+
+class AssetCache:
+    """Content-hash fingerprints and precompressed bodies for files under a static folder.
+    Entries are computed on first use and recomputed when a file's mtime or size changes."""
+    def __init__(self, folder):
+        self.folder = os.path.abspath(folder)
+        self.lock = threading.Lock()
+        self.assets = {}
+
+    def resolve(self, filename):
+        path = os.path.normpath(os.path.join(self.folder, filename))
+        if not path.startswith(self.folder + os.sep) or not os.path.isfile(path): return None
+        return path
+
+    def get(self, filename):
+        path = self.resolve(filename)
+        if not path: return None
+        st = os.stat(path)
+        stamp = (st.st_mtime_ns, st.st_size)
+        with self.lock:
+            asset = self.assets.get(path)
+        if asset and asset.stamp == stamp: return asset
+        asset = Asset(path, stamp, path.endswith(COMPRESSIBLE_EXTENSIONS))
+        with self.lock:
+            self.assets[path] = asset
+        return asset
+
+    def stamp(self, filename):
+        """Current (mtime, size) of a file, used to tell whether pages that embed its URL are stale."""
+        path = self.resolve(filename)
+        if not path: return None
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+
+    def url(self, filename):
+        asset = self.get(filename)
+        if not asset: return f"/static/{filename}"
+        return f"/assets/{asset.hash}/{filename}"
@@ -0,0 +1,37 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+import design_store
+
+DESIGN = "0.0 1.0\n1.0 0.5\n2.0 0.0\n"
+
+def test_collapsed_duplicates_still_play_from_the_queue(tmp_path, monkeypatch):
+    folder = str(tmp_path)
+    for name in ("x1.thr", "x2.thr", "x3.thr"):
+        with open(os.path.join(folder, name), "w") as f: f.write(DESIGN)
+    index = design_store.DesignIndex(folder)
+    for name in ("x1.thr", "x2.thr", "x3.thr"): index.get(name)
+    monkeypatch.setattr(app, "DESIGNS_FOLDER", folder)
+    monkeypatch.setattr(app, "design_index", index)
+    table = app.TableController(None)
+    table.id = "test"
+    monkeypatch.setattr(app, "tables", {"test": table})
+
+    table.job_queue.extend(app.library_job(name) for name in ("x1.thr", "x2.thr", "x3.thr"))
+    table.prefetch_next_job()
+    assert table.prefetched and table.prefetched.filename == "x1.thr"
+
+    res = app.app.test_client().post("/api/designs/collapse", json={"keep": "x3.thr"})
+    assert res.get_json()["success"]
+    assert sorted(os.listdir(folder)).count("x3.thr") == 1
+    assert not os.path.exists(os.path.join(folder, "x1.thr"))
+
+    played = []
+    while table.job_queue:
+        job, prepared = table.next_job()
+        assert prepared is not None
+        played.append((job["filename"], prepared.filename, prepared.design))
+    assert played == [("x3.thr", "x3.thr", ["0.0 1.0", "1.0 0.5", "2.0 0.0"])] * 3
@@ -0,0 +1,16 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+
+def test_jog_sequence_restarts_after_release_and_per_page():
+    jogger = app.JogThread(app.TableController(None))
+    for seq in range(1, 5): assert jogger.submit(0.0, 0.5, seq, "page-a")
+    assert not jogger.submit(0.0, 0.5, 3, "page-a")  # Out of order within one page
+    jogger.release()
+    assert jogger.submit(0.0, 0.5, 1, "page-a")
+    jogger.cancel()
+    assert jogger.submit(0.0, 0.5, 1, "page-a")
+    assert jogger.submit(0.0, 0.5, 1, "page-b")       # A reload or another phone
@@ -0,0 +1,27 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import patterns
+
+def test_pattern_cache_prunes_least_recently_used(tmp_path):
+    cache = str(tmp_path)
+    older = patterns.normalize({"family": "spiral", "turns": 5})
+    newer = patterns.normalize({"family": "rose", "n": 3})
+    patterns.load(older, cache)
+    patterns.load(newer, cache)
+    os.utime(os.path.join(cache, patterns.pattern_key(older) + ".npy"), (1, 1))
+    os.utime(os.path.join(cache, patterns.pattern_key(newer) + ".npy"), (2, 2))
+    patterns.load(older, cache)  # A cache hit marks it recently used again
+
+    size = os.path.getsize(os.path.join(cache, patterns.pattern_key(older) + ".npy"))
+    patterns.prune_cache(cache, max_bytes=size)
+    assert sorted(os.listdir(cache)) == [patterns.pattern_key(older) + ".npy"]
+
+def test_pattern_cache_keeps_the_pattern_just_generated(tmp_path):
+    cache = str(tmp_path)
+    params = patterns.normalize({"family": "spiral", "turns": 5})
+    patterns.load(params, cache)
+    patterns.prune_cache(cache, max_bytes=0, keep=patterns.pattern_key(params))
+    assert os.listdir(cache) == [patterns.pattern_key(params) + ".npy"]
@@ -0,0 +1,36 @@
+import os
+import sys
+import queue
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+import serial_protocol
+
+class StuckAtRate:
+    """Fake Pi UART to firmware left at a faster rate by an earlier run: answers only at that rate."""
+    def __init__(self, rate):
+        self.rate = rate
+        self.baudrate = serial_protocol.BASE_BAUD
+        self.replies = queue.Queue()
+
+    def write(self, data):
+        if self.baudrate == self.rate and data == b"SYNC\n": self.replies.put(b"OK\n")
+        return len(data)
+
+    def readline(self):
+        try: return self.replies.get(timeout=0.05)
+        except queue.Empty: return b""
+
+    def reset_input_buffer(self): pass
+
+def test_find_link_rate_probes_faster_rates():
+    ser = StuckAtRate(500000)
+    assert not app.wait_for_ready(ser, "/dev/ttyS0", timeout=0.2)
+    assert app.find_link_rate(ser, "/dev/ttyS0") == 500000
+    assert ser.baudrate == 500000
+
+def test_find_link_rate_gives_up_at_base_rate():
+    ser = StuckAtRate(None)
+    assert app.find_link_rate(ser, "/dev/ttyS0") is None
+    assert ser.baudrate == serial_protocol.BASE_BAUD
@@ -0,0 +1,69 @@
+import os
+import sys
+import queue
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import serial_protocol
+import serial_recorder
+
+POINTS = ["0.00000 1.00000", "0.50000 0.80000", "1.00000 0.60000", "1.50000 0.40000", "2.00000 0.20000"]
+
+class FramedFirmware:
+    """Fake port for protocol v2 firmware: acks every framed line, and asks once for a resend."""
+    def __init__(self):
+        self.replies = queue.Queue()
+        self.resent = False
+        self.baudrate = serial_protocol.BASE_BAUD
+
+    def write(self, data):
+        for line in bytes(data).decode().splitlines():
+            seq, payload = serial_protocol.unframe(line)
+            if seq == 2 and not self.resent:
+                self.resent = True
+                self.replies.put(b"RS 2\n")
+            else:
+                self.replies.put(b"OK\n")
+        return len(data)
+
+    def readline(self):
+        try: return self.replies.get(timeout=0.1)
+        except queue.Empty: return b""
+
+    def close(self): pass
+
+def record_framed_session(path):
+    recorder = serial_recorder.RingRecorder(path, size=64 * 1024)
+    port = serial_recorder.RecordingSerial(FramedFirmware(), recorder)
+    link = serial_protocol.Link()
+    link.framed = True
+    for point in POINTS + ["SYNC"]:
+        data, seq = link.encode(point)
+        port.write(data)
+        reply = port.readline()
+        if reply.startswith(b"RS "):
+            for again in link.resend_from(seq): port.write(again)
+            port.readline()
+    port.close()
+
+def test_unframe_checks_the_checksum():
+    line = serial_protocol.frame(7, "1.0 0.5").decode().strip()
+    assert serial_protocol.unframe(line) == (7, "1.0 0.5")
+    assert serial_protocol.unframe(line.replace("0.5", "0.6")) is None
+    assert serial_protocol.unframe("PROTO?") == (None, "PROTO?")
+
+def test_framed_recording_yields_payloads_without_resends(tmp_path):
+    path = str(tmp_path / "framed.srec")
+    record_framed_session(path)
+    _, records = serial_recorder.read_recording(path)
+    assert [line for _, line in serial_recorder.tx_lines(records)] == POINTS + ["SYNC"]
+
+def test_replay_of_framed_session(tmp_path, capsys):
+    path = str(tmp_path / "framed.srec")
+    record_framed_session(path)
+    serial_recorder.replay(path, speed=50)
+    out = capsys.readouterr().out
+    assert "No theta/rho lines" not in out
+    assert f"Replay x50: {len(POINTS)} lines" in out
+    assert "still waiting" not in out
+    assert "0 recorded RX lines never released" in out
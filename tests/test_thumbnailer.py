@@ -0,0 +1,21 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import design_store
+import thumbnailer
+
+def test_regenerating_a_shared_thumbnail_leaves_its_twin_alone(tmp_path):
+    a, b = str(tmp_path / "a.thr"), str(tmp_path / "b.thr")
+    a_png, b_png = str(tmp_path / "a.png"), str(tmp_path / "b.png")
+    for path in (a, b):
+        with open(path, "w") as f: f.write("0 0\n0 1\n3 1\n")
+    assert thumbnailer.generate_thumbnail(a, a_png)
+    design_store.link_or_copy(a_png, b_png)
+    with open(a_png, "rb") as f: before = f.read()
+
+    with open(b, "w") as f: f.write("0 1\n1 0.5\n2 1\n")
+    assert thumbnailer.generate_thumbnail(b, b_png)
+    with open(a_png, "rb") as f: assert f.read() == before
+    with open(b_png, "rb") as f: assert f.read() != before
@@ -1,122 +1,156 @@
+import io
 import os
 import math
 import time
+import itertools
+import threading
 from PIL import Image, ImageDraw
 
-# Machine Constants (matching Sand.ino and designs.html)
-TABLE_RADIUS = 202.6
-L1 = 101.3
-L2 = 101.3
-STEPS_PER_RAD = (3200.0 / 360.0) * (180.0 / math.pi)
+from kinematics import TABLE_RADIUS, calculate_ik, get_xy
+import design_store
 
-def calculate_ik(x, y, last_b):
-    dist = math.hypot(x, y)
-    max_reach = L1 + L2
-    if dist > max_reach:
-        x *= (max_reach / dist)
-        y *= (max_reach / dist)
-        dist = max_reach
-    
-    if dist < 1.0:
-        return last_b, -math.pi * STEPS_PER_RAD
-    
-    cos_bend = (dist * dist - L1 * L1 - L2 * L2) / (2.0 * L1 * L2)
-    bend = math.acos(max(-1.0, min(1.0, cos_bend)))
-    t1 = math.atan2(y, x) - math.atan2(L2 * math.sin(bend), L1 + L2 * math.cos(bend))
-    
-    last_t1 = -last_b / STEPS_PER_RAD
-    t1 = t1 - (round((t1 - last_t1) / (2.0 * math.pi)) * 2.0 * math.pi)
-    
-    return -t1 * STEPS_PER_RAD, -(bend + 1.125 * t1) * STEPS_PER_RAD
+THUMB_SIZE = 300
 
-def get_xy(b, e):
-    t1 = -b / STEPS_PER_RAD
-    bend = -e / STEPS_PER_RAD - 1.125 * t1
-    x = L1 * math.cos(t1) + L2 * math.cos(t1 + bend)
-    y = L1 * math.sin(t1) + L2 * math.sin(t1 + bend)
-    return x, y
+def to_pixel(x, y, size=THUMB_SIZE):
+    """Table mm -> image pixels; the projection shared by thumbnails and the live view."""
+    scale = (size / (TABLE_RADIUS * 2)) * 0.9
+    offset = size / 2
+    return offset + x * scale, offset + y * scale
 
-def generate_thumbnail(file_path, output_path):
-    try:
-        with open(file_path, 'r') as f:
-            lines = f.readlines()
-        
-        path = []
-        last_b = 0
-        last_e = 0
-        
-        for line in lines:
-            line = line.split('#')[0].split(';')[0].strip()
-            if not line:
-                continue
-            
-            try:
-                if line.upper().startswith('G1'):
-                    parts = line[2:].strip().split()
-                    theta = float(parts[0])
-                    rho = float(parts[1])
-                else:
-                    parts = line.split()
-                    if len(parts) >= 2:
-                        theta = float(parts[0])
-                        rho = float(parts[1])
-                    else:
-                        continue
-                
-                x_mm = rho * TABLE_RADIUS * math.cos(theta)
-                y_mm = rho * TABLE_RADIUS * math.sin(theta)
-                
-                b, e = calculate_ik(x_mm, y_mm, last_b)
-                # For smooth preview, we can just use the IK points directly or interpolate
-                # But for a thumbnail, the raw points are usually enough
-                cur_x, cur_y = get_xy(b, e)
-                path.append((cur_x, cur_y))
-                last_b, last_e = b, e
-            except:
-                continue
+class ThumbnailBuilder:
+    """Collects points one at a time so a thumbnail can be drawn during a single streaming pass."""
+    def __init__(self):
+        self.path = []
+        self.last_b = 0
+
+    def add_point(self, theta, rho):
+        x_mm = rho * TABLE_RADIUS * math.cos(theta)
+        y_mm = rho * TABLE_RADIUS * math.sin(theta)
         
-        if not path:
+        b, e = calculate_ik(x_mm, y_mm, self.last_b)
+        # For smooth preview, we can just use the IK points directly or interpolate
+        # But for a thumbnail, the raw points are usually enough
+        self.path.append(get_xy(b, e))
+        self.last_b = b
+
+    def save(self, output_path):
+        if not self.path:
             return False
 
         # Create image
-        size = 300
-        img = Image.new('RGBA', (size, size), (0, 0, 0, 0))
+        img = Image.new('RGBA', (THUMB_SIZE, THUMB_SIZE), (0, 0, 0, 0))
         draw = ImageDraw.Draw(img)
         
-        # Scaling
-        scale = (size / (TABLE_RADIUS * 2)) * 0.9
-        offset = size / 2
-        
         # Transform points to pixel coordinates
-        pixel_path = []
-        for x, y in path:
-            # Note: The website rotates the canvas 180 deg, so we flip y here if needed
-            # but usually we just want a centered preview.
-            px = offset + x * scale
-            py = offset + y * scale
-            pixel_path.append((px, py))
+        # Note: The website rotates the canvas 180 deg, so we flip y here if needed
+        # but usually we just want a centered preview.
+        pixel_path = [to_pixel(x, y) for x, y in self.path]
             
         if len(pixel_path) > 1:
             draw.line(pixel_path, fill=(0, 0, 0, 255), width=2)
             
-        img.save(output_path, 'PNG')
+        # Written beside and moved into place: the old file may be hard-linked to a twin's thumbnail
+        tmp = output_path + '.tmp'
+        img.save(tmp, 'PNG')
+        os.replace(tmp, output_path)
         return True
+
+_raster_versions = itertools.count(1)
+
+class ProgressRaster:
+    """Image of the sand drawn so far, in the thumbnail projection. Each update only draws the
+    segments added since the previous one; the PNG is encoded on demand, once per version."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.img = Image.new('RGBA', (THUMB_SIZE, THUMB_SIZE), (0, 0, 0, 0))
+            self.draw = ImageDraw.Draw(self.img)
+            self.last_b = 0
+            self.last_pixel = None
+            self.version = next(_raster_versions)
+            self.png = None
+
+    def add_points(self, points):
+        """Extends the path through (theta, rho) points. Returns True if the image changed."""
+        if not points: return False
+        with self.lock:
+            pixels = [self.last_pixel] if self.last_pixel else []
+            for theta, rho in points:
+                b, e = calculate_ik(rho * TABLE_RADIUS * math.cos(theta), rho * TABLE_RADIUS * math.sin(theta), self.last_b)
+                pixels.append(to_pixel(*get_xy(b, e)))
+                self.last_b = b
+            if len(pixels) > 1:
+                self.draw.line(pixels, fill=(0, 0, 0, 255), width=2)
+            self.last_pixel = pixels[-1]
+            self.version = next(_raster_versions)
+            self.png = None
+            return True
+
+    def png_bytes(self):
+        """Returns (version, PNG bytes) for the current image."""
+        with self.lock:
+            if self.png is None:
+                buf = io.BytesIO()
+                self.img.save(buf, 'PNG')
+                self.png = buf.getvalue()
+            return self.version, self.png
+
+def generate_thumbnail(file_path, output_path):
+    try:
+        builder = ThumbnailBuilder()
+        
+        with design_store.open_design(file_path) as lines:
+            for line in lines:
+                line = line.split('#')[0].split(';')[0].strip()
+                if not line:
+                    continue
+            
+                try:
+                    if line.upper().startswith('G1'):
+                        parts = line[2:].strip().split()
+                        theta = float(parts[0])
+                        rho = float(parts[1])
+                    else:
+                        parts = line.split()
+                        if len(parts) >= 2:
+                            theta = float(parts[0])
+                            rho = float(parts[1])
+                        else:
+                            continue
+                
+                    builder.add_point(theta, rho)
+                except:
+                    continue
+        
+        return builder.save(output_path)
     except Exception as e:
         print(f"Error generating thumbnail for {file_path}: {e}")
         return False
 
-def monitor_designs(designs_folder):
+def monitor_designs(designs_folder, twin_thumbnail=None):
+    """twin_thumbnail(filename) may return the up-to-date thumbnail of an identical design,
+    which is then linked instead of drawing the same picture again."""
     print(f"Monitoring {designs_folder} for thumbnails...")
     while True:
         try:
-            files = [f for f in os.listdir(designs_folder) if f.endswith('.txt') or f.endswith('.thr')]
+            files = design_store.list_designs(designs_folder)
             for f in files:
-                thumb_name = f.replace('.txt', '.png').replace('.thr', '.png')
+                thumb_name = design_store.thumb_name(f)
                 thumb_path = os.path.join(designs_folder, thumb_name)
                 file_path = os.path.join(designs_folder, f)
                 
                 # If thumb doesn't exist or is older than the source file
                 if not os.path.exists(thumb_path) or os.path.getmtime(file_path) > os.path.getmtime(thumb_path):
+                    twin = twin_thumbnail(f) if twin_thumbnail else None
+                    if twin and os.path.exists(thumb_path) and os.path.samefile(twin, thumb_path):
+                        continue
+                    if twin:
+                        print(f"Sharing thumbnail of {f} with {os.path.basename(twin)}")
+                        design_store.link_or_copy(twin, thumb_path)
+                        continue
                     print(f"Generating thumbnail for {f}...")
                     generate_thumbnail(file_path, thumb_path)
             
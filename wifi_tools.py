@@ -1,6 +1,10 @@
 import subprocess
+import threading
 import time
 
+SCAN_TTL = 30          # Seconds a scan result is considered fresh
+SCAN_IDLE_STOP = 300   # Background rescans stop once nobody has asked for results for this long
+
 def get_wifi_networks():
     """Scans for available Wi-Fi networks using nmcli."""
     try:
@@ -49,6 +53,72 @@ def get_saved_networks():
     except Exception as e:
         return []
 
+class WifiScanner:
+    """Background nmcli scanner with a TTL cache.
+
+    Pages read the cache instantly; stale data triggers a background refresh.
+    Concurrent refresh requests share one in-flight nmcli call.
+    """
+    def __init__(self, ttl=SCAN_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.networks = []
+        self.saved = []
+        self.updated = 0
+        self.last_access = 0
+        self.in_flight = None  # threading.Event while a scan is running
+
+    def refresh(self, wait=False, timeout=15):
+        """Starts a scan unless one is already running. Optionally waits for its result."""
+        with self.lock:
+            done = self.in_flight
+            if done is None:
+                done = self.in_flight = threading.Event()
+                threading.Thread(target=self._scan, args=(done,), daemon=True).start()
+        if wait:
+            done.wait(timeout)
+        return done
+
+    def _scan(self, done):
+        networks, saved = get_wifi_networks(), get_saved_networks()
+        with self.lock:
+            self.networks, self.saved = networks, saved
+            self.updated = time.time()
+            self.in_flight = None
+        done.set()
+
+    def snapshot(self):
+        """Cached networks; kicks off a background refresh if they are stale."""
+        now = time.time()
+        with self.lock:
+            self.last_access = now
+            stale = now - self.updated > self.ttl
+            data = {
+                "networks": list(self.networks),
+                "saved_networks": list(self.saved),
+                "age": round(now - self.updated) if self.updated else None,
+                "scanning": self.in_flight is not None or stale
+            }
+        if stale:
+            self.refresh()
+        return data
+
+    def invalidate(self):
+        with self.lock:
+            self.updated = 0
+
+    def start(self):
+        """Keeps the cache warm while the setup page is in use."""
+        def loop():
+            self.refresh()
+            while True:
+                time.sleep(self.ttl)
+                if time.time() - self.last_access < SCAN_IDLE_STOP:
+                    self.refresh()
+        threading.Thread(target=loop, daemon=True).start()
+
+scanner = WifiScanner()
+
 def forget_network(ssid):
     """Deletes a saved connection profile."""
     try:
@@ -57,6 +127,7 @@ def forget_network(ssid):
             return False, "Cannot delete the Hotspot profile."
             
         subprocess.run(["sudo", "nmcli", "connection", "delete", ssid], check=True)
+        scanner.invalidate()
         return True, f"Forgot {ssid}"
     except Exception as e:
         return False, str(e)